@@ -1,54 +1,34 @@
-import matplotlib.pyplot as plt
-from ortools.linear_solver import pywraplp
-import example
-from solver import solve_solar
+"""
+Plan one day folder and print (and plot) the result.
+
+    python Solar.py [folder]                 table, costs, plots and commands like before
+    python Solar.py [folder] --headless      only plan and print the command schedule
+    python Solar.py [folder] --events f      also append the solve statistics to f (JSON lines)
+    python Solar.py [folder] --grid 5:180,60 5 minute slots for three hours, hourly after that
+    python Solar.py [folder] --history DIR   also append the plan to the history store in DIR
+
+The functions can also be imported. matplotlib and OR-Tools are only imported
+when plotting or a MILP backend is actually used, so a headless run with
+--backend DP needs neither of them.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+
 import numpy as np
-import re
-from example import exampleData
 
-from batteryCommands.sma import generate_commands
-from batteryCommands.sma import group_commands
-from batteryCommands.sma import format_command_schedule
+import instrument
+import timegrid
+from dataset import DEFAULT_PARAMETERS, load_day, read_battery_file, read_start_time
+from batteryCommands.custom import COMMAND_NAMES
+from batteryCommands.custom import encode_commands
+from batteryCommands.custom import group_command_codes
+from batteryCommands.custom import format_command_schedule
 
 interval = list(range(96))
 
-def readData(filename, length):
-    with open(filename) as f:
-        data = [float(x) for line in f for x in line.strip().split()[2:]]
-    if len(data) != length:
-        raise ValueError(f"Unerwartete Anzahl an Daten: {len(data)} statt {length}")
-    return data
-
-def read_battery_file(filename):
-    try:
-        with open(filename) as f:
-            text = f.read()
-
-        # batsoc extrahieren
-        match_batsoc = re.search(r"batsoc\s*:\s*([\d\.]+)", text)
-        if match_batsoc:
-            battery_soc_initial = float(match_batsoc.group(1))
-        else:
-            raise ValueError("batsoc not found")
-
-        # socneu extrahieren
-        match_soc = re.search(r"socneu\s*:\s*\[([^\]]+)\]", text)
-        if match_soc:
-            soc_bestehend = [float(x) for x in re.split(r'\s+', match_soc.group(1).strip()) if x]
-        else:
-            raise ValueError("socneu not found")
-
-        # bezugneu extrahieren
-        match_bezug = re.search(r"bezugneu\s*:\s*\[([^\]]+)\]", text)
-        if match_bezug:
-            bezug_bestehend = [float(x) for x in re.split(r'\s+', match_bezug.group(1).strip()) if x]
-        else:
-            raise ValueError("bezugneu not found")
-
-        return battery_soc_initial, soc_bestehend, bezug_bestehend
-    except FileNotFoundError:
-        return 50, [], []
-
 def draw_plots(
     soc_optimiert,
     soc_bestehend,
@@ -63,19 +43,26 @@ def draw_plots(
     with_external_data,
     folderName
 ):
+    # imported here, matplotlib alone takes longer than a whole headless run
+    import matplotlib.pyplot as plt
+
     # data preparations
-    energyConsumption_plot = [abs(x) * 1000 for x in energyConsumption]
-    values_kosten_plot = [x * 50 for x in values_kosten]
+    energyConsumption_plot = np.abs(energyConsumption) * 1000
+    values_kosten_plot = np.asarray(values_kosten) * 50
     x = range(len(soc_optimiert))
 
     # calculations
-    total = sum((e + s) * -k for e, s, k in zip(energyConsumption, values_pv, values_kosten))
-    total_bestehend = sum(e * k for e, k in zip(bezug_bestehend_1000, values_kosten))
-    total_optimized = sum(e * k for e, k in zip(energy_bought_list, values_kosten)) / 1000
+    values_kosten = np.asarray(values_kosten)
+    net_consumption = -(np.asarray(energyConsumption) + np.asarray(values_pv))
+    energy_bought = np.asarray(energy_bought_list)
+
+    total = float(net_consumption @ values_kosten)
+    total_bestehend = float(np.dot(bezug_bestehend_1000, values_kosten)) if with_external_data else 0
+    total_optimized = float(energy_bought @ values_kosten) / 1000
 
-    energyBrought = sum((e + s) * -1 for e, s in zip(energyConsumption, values_pv))
-    energyBrought_bestehend = sum(e for e in bezug_bestehend_1000) if with_external_data else 1
-    energyBrought_optimized = sum(e / 1000 for e in energy_bought_list)
+    energyBrought = float(net_consumption.sum())
+    energyBrought_bestehend = float(np.sum(bezug_bestehend_1000)) if with_external_data else 1
+    energyBrought_optimized = float(energy_bought.sum()) / 1000
 
     # description
     description = (
@@ -151,130 +138,173 @@ def draw_plots(
     # description
     fig.text(0.5, 0.04, description, ha='center', va='top', fontsize=20, wrap=True)
     plt.tight_layout(rect=[0, 0.08, 1, 1])
-    plt.savefig(folderName + "\\" + folderName + ".png", dpi=300, bbox_inches='tight')
+    plt.savefig(os.path.join(folderName, os.path.basename(os.path.normpath(folderName)) + ".png"), dpi=300, bbox_inches='tight')
     plt.close()
 
 
-folderName = "20.01"
-battery_soc_initial, soc_bestehend, bezug_bestehend = read_battery_file(folderName+"/log.log")
+def existing_plan(soc_bestehend, bezug_bestehend, battery_max_capacity=DEFAULT_PARAMETERS["battery_max_capacity"]):
+    """
+    Grid import (Wh) and discharge (Wh) per period of the existing controller
+    from socneu / bezugneu of log.log, empty lists without data.
+    """
+    if not len(soc_bestehend):
+        return [], []
 
-with_external_data = False;
-if soc_bestehend:
     bezug_bestehend_1000 = [v * 1000 for v in bezug_bestehend]
     discharge_bestehend = []
     for i in range(1, len(soc_bestehend)):
-        delta = int((soc_bestehend[i-1] - soc_bestehend[i]) * 28800 / 100)
+        delta = int((soc_bestehend[i-1] - soc_bestehend[i]) * battery_max_capacity / 100)
         discharge_bestehend.append(max(delta, 0))
 
     discharge_bestehend.insert(0, 0)
-    with_external_data = True
-else:
-    bezug_bestehend_1000 = []
-    discharge_bestehend = []
-    
-
-
-
-print("Initial SOC:", battery_soc_initial)
-print("SOC array:", soc_bestehend[:10], "...")      # nur die ersten 10 Werte
-print("Bezug array:", bezug_bestehend[:10], "...")
-
-values_kosten = readData(folderName+"/netztarif.log", len(interval))
-energyConsumption = readData(folderName+"/verbrauch.log", len(interval))
-values_pv = readData(folderName+"/pv.log", len(interval))
-
-#energyConsumption, values_pv, values_kosten, interval = exampleData()
-
-battery_soc_target = 35;
-
-battery_soc_minimum_allowed = 35
-
-battery_max_capacity=28800
-battery_initial_capacity = int(battery_soc_initial * battery_max_capacity / 100)
-battery_target_capacity = int(battery_soc_target * battery_max_capacity / 100)
-battery_minimal_capacity = int(battery_soc_minimum_allowed * battery_max_capacity / 100)
-
-battery_charge_power= 1000
-battery_discharge_power= 1500
-
-price_selling_energy = 785
-price_using_battery = 3091
-
-consumption = {i: int(abs(v) * 1000) for i, v in zip(interval, energyConsumption)}
-price_outside_power = {i: int(v * 100) for i, v in zip(interval, values_kosten)}
-solar_production = {i: int(v * 1000) for i, v in zip(interval, values_pv)}
-
-
-soc_optimiert, energy_bought_list, battery_discharge_list, battery_charge_list, solar_energy_list, is_charging_list, is_discharging_list, outside_to_battery_list,solar_to_battery_list = solve_solar(
-    interval=interval,
-    C=consumption,
-    P=price_outside_power,
-    P_solar=price_selling_energy,
-    S=solar_production,
-    B_c_initial=battery_initial_capacity,
-    B_c_min=battery_minimal_capacity,
-    B_charge_max=battery_charge_power,
-    B_discharge_max=battery_discharge_power,
-    B_c_max=battery_max_capacity,
-    P_loaded = price_using_battery,
-    battery_target_capacity = battery_target_capacity,
-    mustLoadFirst =0,
-    min_battery_discharge = 23040,
-    printEnabled = 1
-)
-
-total = sum((e + s) * k for e, s, k in zip(energyConsumption, values_pv, values_kosten))
-if(with_external_data):
-    total_bestehend = sum(e * k for e, k in zip(bezug_bestehend, values_kosten))
-else:
-    total_bestehend = 0
-
-total_optimized = sum(e * k for e, k in zip(energy_bought_list, values_kosten))
-
-print(f"Es werden geplant, dass {sum(energyConsumption)} kWh verbraucht werden,\n"
-      f"die Kosten ohne Optimierung: {total*-1}, \n"
-      f"Die bestehende Optimierung errechnet:{total_bestehend}\n"
-      f"Die OR Tools Optimierung errechnet:{total_optimized / 1000:.1f}"
-      )
-
-if not soc_optimiert:
-    exit()
-
-draw_plots(
-    soc_optimiert=soc_optimiert,
-    soc_bestehend=soc_bestehend,
-    values_kosten=values_kosten,
-    energyConsumption=energyConsumption,
-    values_pv=values_pv,
-    energy_bought_list=energy_bought_list,
-    battery_discharge_list=battery_discharge_list,
-    solar_energy_list=solar_energy_list,
-    bezug_bestehend_1000=bezug_bestehend_1000,
-    discharge_bestehend=discharge_bestehend,
-    with_external_data=with_external_data,
-    folderName=folderName
-)
-
-# Generate commands
-commands = generate_commands(
-    interval, is_discharging_list, battery_discharge_list,
-    is_charging_list, outside_to_battery_list, solar_to_battery_list
-)
-
-print("Individual Commands:")
-for i, cmd in commands.items():
-    print(f"Period {i}: {cmd}")
-    
-print("\n" + "=" * 50 + "\n")
-    
-# Group commands
-grouped = group_commands(commands)
-    
-print("Grouped Commands:")
-for group in grouped:
-    print(group)
-    
-print("\n" + "=" * 50 + "\n")
-    
-# Format schedule
-print(format_command_schedule(grouped))
\ No newline at end of file
+    return bezug_bestehend_1000, discharge_bestehend
+
+def plan_day(folderName, backend="CBC", printEnabled=0, parameters=None, durations=None, history=None):
+    """
+    Read a day folder and solve it.
+
+    Args:
+        folderName: Folder with netztarif.log, verbrauch.log, pv.log and log.log
+        backend: Backend for solve_solar, "DP" does not import OR-Tools
+        printEnabled: Print the table of the solver
+        parameters: Overrides for dataset.DEFAULT_PARAMETERS
+        durations: Slot durations in minutes (see timegrid.py), None for 15 minute slots
+        history: history.HistoryStore for the plan, it starts at the time of the log files
+
+    Returns:
+        tuple: (day as returned by dataset.load_day, SolarResult)
+    """
+    from solver import solve_solar
+
+    day = load_day(folderName, interval=interval, parameters=parameters, durations=durations)
+    inputs = dict(day["inputs"], printEnabled=printEnabled)
+    start_time = read_start_time(os.path.join(folderName, "netztarif.log")) if history is not None else None
+    return day, solve_solar(**inputs, backend=backend, durations=durations, history=history, start_time=start_time)
+
+def plan_commands(result):
+    """
+    Commands of a plan.
+
+    Returns:
+        tuple: (commands per period, grouped commands)
+    """
+    codes = encode_commands(
+        result.is_discharging, result.battery_discharge,
+        result.is_charging, result.outside_to_battery, result.solar_to_battery
+    )
+    commands = {i: COMMAND_NAMES[code] for i, code in enumerate(codes.tolist())}
+    return commands, group_command_codes(codes)
+
+def run_headless(folderName, backend="CBC", durations=None, history=None):
+    """Plan a day and print only the command schedule, nothing is plotted."""
+    # the solver output is not part of the schedule
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, result = plan_day(folderName, backend=backend, durations=durations, history=history)
+    if not result:
+        print("Keine Lösung, kein Fahrplan")
+        return 1
+    _, grouped = plan_commands(result)
+    print(format_command_schedule(grouped, durations=durations))
+    return 0
+
+def run_report(folderName, backend="CBC", plot=True, durations=None, history=None):
+    """Plan a day like before: solver table, costs, plots and all commands."""
+    battery_soc_initial, soc_bestehend, bezug_bestehend = read_battery_file(folderName+"/log.log")
+
+    bezug_bestehend_1000, discharge_bestehend = existing_plan(soc_bestehend, bezug_bestehend)
+    with_external_data = bool(soc_bestehend)
+
+    print("Initial SOC:", battery_soc_initial)
+    print("SOC array:", soc_bestehend[:10], "...")      # nur die ersten 10 Werte
+    print("Bezug array:", bezug_bestehend[:10], "...")
+
+    #energyConsumption, values_pv, values_kosten, interval = exampleData()
+
+    day, result = plan_day(folderName, backend=backend, printEnabled=1, durations=durations, history=history)
+    # costs and plots are on the 15 minute grid of the log files
+    base_day = load_day(folderName, interval=interval) if durations is not None else day
+    values_kosten = base_day["values_kosten"]
+    energyConsumption = base_day["energyConsumption"]
+    values_pv = base_day["values_pv"]
+    planned = timegrid.to_base(result, durations) if result and durations is not None else result
+
+    total = sum((e + s) * k for e, s, k in zip(energyConsumption, values_pv, values_kosten))
+    if(with_external_data):
+        total_bestehend = sum(e * k for e, k in zip(bezug_bestehend, values_kosten))
+    else:
+        total_bestehend = 0
+
+    total_optimized = float(planned.energy_bought @ np.asarray(values_kosten)) if result else 0
+
+    print(f"Es werden geplant, dass {sum(energyConsumption)} kWh verbraucht werden,\n"
+          f"die Kosten ohne Optimierung: {total*-1}, \n"
+          f"Die bestehende Optimierung errechnet:{total_bestehend}\n"
+          f"Die OR Tools Optimierung errechnet:{total_optimized / 1000:.1f}"
+          )
+
+    if not result:
+        return 1
+
+    if plot:
+        draw_plots(
+            soc_optimiert=planned.soc,
+            soc_bestehend=soc_bestehend,
+            values_kosten=values_kosten,
+            energyConsumption=energyConsumption,
+            values_pv=values_pv,
+            energy_bought_list=planned.energy_bought,
+            battery_discharge_list=planned.battery_discharge,
+            solar_energy_list=planned.solar_energy,
+            bezug_bestehend_1000=bezug_bestehend_1000,
+            discharge_bestehend=discharge_bestehend,
+            with_external_data=with_external_data,
+            folderName=folderName
+        )
+
+    # Generate commands
+    commands, grouped = plan_commands(result)
+
+    print("Individual Commands:")
+    for i, cmd in commands.items():
+        print(f"Period {i}: {cmd}")
+
+    print("\n" + "=" * 50 + "\n")
+
+    print("Grouped Commands:")
+    for group in grouped:
+        print(group)
+
+    print("\n" + "=" * 50 + "\n")
+
+    # Format schedule
+    print(format_command_schedule(grouped, durations=durations))
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan the battery for one day folder")
+    parser.add_argument("folder", nargs="?", default="20.01")
+    parser.add_argument("--headless", action="store_true", help="only plan and print the command schedule")
+    parser.add_argument("--no-plot", action="store_true", help="report without plots")
+    parser.add_argument("--backend", default="CBC", help="CBC, SCIP or DP (DP needs no OR-Tools)")
+    parser.add_argument("--events", help="JSON-lines file for timings, model size and statistics of the solve")
+    parser.add_argument("--grid", help="slot minutes, e.g. 5 or 5:180,60 (5 min for 180 min, then 60 min)")
+    parser.add_argument("--history", help="directory of the history store for the plan, see history.py")
+    args = parser.parse_args(argv)
+
+    durations = timegrid.parse_grid(args.grid, len(interval) * timegrid.BASE_MINUTES) if args.grid else None
+
+    if args.events:
+        instrument.add_sink(instrument.JsonLinesSink(args.events))
+
+    history = None
+    if args.history:
+        from history import HistoryStore
+        history = HistoryStore(args.history)
+
+    if args.headless:
+        return run_headless(args.folder, args.backend, durations, history)
+    return run_report(args.folder, args.backend, plot=not args.no_plot, durations=durations, history=history)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
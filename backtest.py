@@ -0,0 +1,260 @@
+"""
+Backtest of plans against realized consumption and PV.
+
+A plan is only sent as commands (ACC, DIS, NOD per slot, see
+batteryCommands/custom.py). simulate() applies the commands slot by slot to
+the realized load and PV, with the battery limits of solve_solar:
+
+- DIS: the battery covers the load left after PV, at most B_discharge_max
+  per slot and down to B_c_min, PV surplus is exported
+- ACC: the battery charges B_charge_max (less if it is nearly full), PV
+  surplus first (90 % arrive in the battery, at most B_discharge_max Wh of
+  PV per slot like in the model), the rest from the grid
+- NOD (and Failure): no discharge and no grid charging, PV surplus charges
+  the battery up to B_charge_max per slot, the rest is exported
+
+So the realized cost, grid exchange and SOC differ from the plan as soon as
+the forecast was wrong. All arrays are sites x periods (one row per site or
+per day), the loop only runs over the periods and every step handles all
+rows at once:
+
+    codes = plan_codes(result)                     # or a sites x periods array
+    run = simulate(codes, C, S, P, P_solar, B_c_initial, B_c_min, B_c_max, B_charge_max, B_discharge_max)
+    run["cost"]                                    # ct per row
+
+    python backtest.py                 # day folders, plan on a noisy forecast, replay on the data
+    python backtest.py --sites 300 --days 365      # speed on synthetic sites
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from batteryCommands.custom import ACC, DIS, encode_commands
+from dp_solver import EFFICIENCY
+from result import COST_SCALE
+from timegrid import scale
+
+
+def plan_codes(result):
+    """Command codes (see COMMAND_NAMES) of a SolarResult, the schedule which is sent to the battery."""
+    return encode_commands(result.is_discharging, result.battery_discharge, result.is_charging,
+                           result.outside_to_battery, result.solar_to_battery)
+
+
+def _rows(value, n):
+    """A scalar or one value per row as array of n rows."""
+    return np.broadcast_to(np.asarray(value, dtype=float), (n,))
+
+
+def simulate(codes, C, S, P, P_solar, B_c_initial, B_c_min, B_c_max, B_charge_max, B_discharge_max,
+             P_loaded=0, durations=None, efficiency=EFFICIENCY):
+    """
+    Apply command schedules to realized consumption and PV.
+
+    Args:
+        codes: Command code per period (sites x periods, or one schedule)
+        C: Realized consumption per period (Wh), same shape as codes
+        S: Realized PV per period (Wh)
+        P: Grid price per period (ct/kWh * 100), per row or one row for all
+        P_solar: Price for sold energy, a number or per period
+        B_c_initial, B_c_min, B_c_max: SOC at the start, minimum and maximum (Wh), a number or one per row
+        B_charge_max, B_discharge_max: Charge and discharge per 15 minutes (Wh), a number or one per row
+        P_loaded: Value of the energy left in the battery at the end (like in the objective)
+        durations: Slot durations in minutes (see timegrid.py), scales the charge and discharge limits
+        efficiency: Share of the PV energy which arrives in the battery
+
+    Returns:
+        dict: 'soc_wh' (SOC at the end of every period), 'grid_import', 'grid_export',
+              'battery_charge', 'battery_discharge', 'solar_to_battery', 'grid_to_battery'
+              (Wh, rows x periods), per row 'cost' (ct), 'final_soc_wh' and 'value' (cost
+              minus the value of the final SOC, comparable to the objective / COST_SCALE)
+    """
+    codes = np.atleast_2d(codes)
+    n, horizon = codes.shape
+    C = np.broadcast_to(np.asarray(C, dtype=float), (n, horizon))
+    S = np.broadcast_to(np.asarray(S, dtype=float), (n, horizon))
+    P = np.broadcast_to(np.asarray(P, dtype=float), (n, horizon))
+    P_solar = np.broadcast_to(np.asarray(P_solar, dtype=float), (n, horizon))
+
+    B_c_min = _rows(B_c_min, n)
+    B_c_max = _rows(B_c_max, n)
+    period_scale = scale(durations)
+    if period_scale is None:
+        period_scale = np.ones(horizon)
+    charge_max = np.outer(_rows(B_charge_max, n), period_scale)
+    discharge_max = np.outer(_rows(B_discharge_max, n), period_scale)
+
+    # PV and load within a slot, independent of the battery
+    solar_to_load = np.minimum(S, C)
+    rest_load = C - solar_to_load
+    surplus = S - solar_to_load
+    discharging = codes == DIS
+    grid_charging = codes == ACC
+
+    soc = np.empty((n, horizon))
+    E_D = np.zeros((n, horizon))
+    E_SB = np.zeros((n, horizon))
+    E_GB = np.zeros((n, horizon))
+    B = _rows(B_c_initial, n).copy()
+    for t in range(horizon):
+        # the only dependency between the slots is the SOC
+        discharge = np.where(discharging[:, t],
+                             np.clip(np.minimum(rest_load[:, t], B - B_c_min), 0, discharge_max[:, t]), 0.0)
+        target = np.clip(np.minimum(charge_max[:, t], B_c_max - B), 0, None)
+        target = np.where(discharging[:, t], 0.0, target)
+        solar = np.minimum(np.minimum(surplus[:, t], target / efficiency), discharge_max[:, t])
+        grid = np.where(grid_charging[:, t], target - efficiency * solar, 0.0)
+        B = B + efficiency * solar + grid - discharge
+        soc[:, t] = B
+        E_D[:, t] = discharge
+        E_SB[:, t] = solar
+        E_GB[:, t] = grid
+
+    grid_import = rest_load - E_D + E_GB
+    grid_export = surplus - E_SB
+    cost = ((P * grid_import).sum(axis=1) - (P_solar * grid_export).sum(axis=1)) / COST_SCALE
+    final_soc = soc[:, -1]
+    return {
+        "soc_wh": soc,
+        "grid_import": grid_import,
+        "grid_export": grid_export,
+        "battery_charge": efficiency * E_SB + E_GB,
+        "battery_discharge": E_D,
+        "solar_to_battery": E_SB,
+        "grid_to_battery": E_GB,
+        "cost": cost,
+        "final_soc_wh": final_soc,
+        "value": cost - np.asarray(P_loaded, dtype=float) * final_soc / COST_SCALE,
+    }
+
+
+def inputs_arrays(inputs_list):
+    """
+    solve_solar inputs of several sites / days with the same horizon as
+    keyword arguments of simulate() (C, S, P as rows x periods, the rest per row).
+    """
+    def series(name):
+        return np.array([[inputs[name][i] for i in inputs["interval"]] for inputs in inputs_list], dtype=float)
+
+    def per_row(name):
+        return np.array([inputs[name] for inputs in inputs_list], dtype=float)
+
+    P_solar = [inputs["P_solar"] for inputs in inputs_list]
+    if all(np.isscalar(value) for value in P_solar):
+        P_solar = np.array(P_solar, dtype=float)[:, None]
+    else:
+        P_solar = series("P_solar")
+    return {
+        "C": series("C"), "S": series("S"), "P": series("P"), "P_solar": P_solar,
+        "B_c_initial": per_row("B_c_initial"), "B_c_min": per_row("B_c_min"), "B_c_max": per_row("B_c_max"),
+        "B_charge_max": per_row("B_charge_max"), "B_discharge_max": per_row("B_discharge_max"),
+        "P_loaded": per_row("P_loaded"),
+    }
+
+
+def backtest_days(inputs_list, backend="DP", seed=0, pv_sigma=0.35, load_sigma=0.15):
+    """
+    Plan every day on a forecast with errors (stochastic.forecast_ensemble)
+    and on the realized data, and replay both plans on the realized data.
+
+    Returns:
+        list: One dict per day with the planned and realized cost of the
+              forecast plan and the realized cost with perfect foresight (ct)
+    """
+    from solver import solve_solar
+    from stochastic import forecast_ensemble
+
+    forecast_codes = []
+    perfect_codes = []
+    planned = []
+    for k, inputs in enumerate(inputs_list):
+        interval = inputs["interval"]
+        C = [inputs["C"][i] for i in interval]
+        S = [inputs["S"][i] for i in interval]
+        C_forecast, S_forecast = forecast_ensemble(C, S, 1, seed=seed + k, pv_sigma=pv_sigma, load_sigma=load_sigma)
+        forecast = dict(inputs, C=dict(zip(interval, C_forecast[0].tolist())),
+                        S=dict(zip(interval, S_forecast[0].tolist())))
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = solve_solar(**forecast, backend=backend)
+            perfect = solve_solar(**inputs, backend=backend)
+        forecast_codes.append(plan_codes(result))
+        perfect_codes.append(plan_codes(perfect))
+        planned.append(float(result.energy_bought @ result.price - result.energy_sold @
+                             np.broadcast_to(inputs["P_solar"], len(interval))) / COST_SCALE)
+
+    rows = [None] * len(inputs_list)
+    # one simulation per horizon length, all days of the same length at once
+    for horizon in sorted({len(inputs["interval"]) for inputs in inputs_list}):
+        days = [k for k, inputs in enumerate(inputs_list) if len(inputs["interval"]) == horizon]
+        arrays = inputs_arrays([inputs_list[k] for k in days])
+        realized = simulate(np.array([forecast_codes[k] for k in days]), **arrays)
+        foresight = simulate(np.array([perfect_codes[k] for k in days]), **arrays)
+        for row, k in enumerate(days):
+            rows[k] = {
+                "planned": planned[k],
+                "realized": float(realized["cost"][row]),
+                "perfect": float(foresight["cost"][row]),
+                "final_soc_wh": float(realized["final_soc_wh"][row]),
+                "peak_import": float(realized["grid_import"][row].max()),
+            }
+    return rows
+
+
+def synthetic_year(n_sites, days, seed=0, backend="DP"):
+    """
+    Sites x (days * 96) arrays for a speed test: one plan per site
+    (fleet.synthetic_sites) repeated every day, realized load and PV with
+    day to day noise.
+
+    Returns:
+        tuple: (codes, keyword arguments of simulate())
+    """
+    from fleet import synthetic_sites
+    from solver import solve_solar
+
+    rng = np.random.default_rng(seed)
+    sites = synthetic_sites(n_sites, seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        codes = np.array([plan_codes(solve_solar(**site, backend=backend)) for site in sites])
+    arrays = inputs_arrays(sites)
+    noise = rng.lognormal(0, 0.2, (n_sites, days * codes.shape[1]))
+    arrays["C"] = np.tile(arrays["C"], days) * noise
+    arrays["S"] = np.tile(arrays["S"], days) * rng.lognormal(0, 0.4, (n_sites, days, 1)).repeat(codes.shape[1], 2) \
+        .reshape(n_sites, -1)
+    arrays["P"] = np.tile(arrays["P"], days)
+    return np.tile(codes, days), arrays
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay plans against realized consumption and PV")
+    parser.add_argument("root", nargs="?", default=".")
+    parser.add_argument("--backend", default="DP")
+    parser.add_argument("--pv-sigma", type=float, default=0.35, help="forecast error of the PV")
+    parser.add_argument("--load-sigma", type=float, default=0.15, help="forecast error of the consumption")
+    parser.add_argument("--sites", type=int, help="speed test on synthetic sites instead of the day folders")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.sites:
+        codes, arrays = synthetic_year(args.sites, args.days, args.seed, args.backend)
+        start = time.perf_counter()
+        run = simulate(codes, **arrays)
+        seconds = time.perf_counter() - start
+        print(f"{args.sites} Standorte x {codes.shape[1]} Perioden in {seconds:.2f} s, "
+              f"Kosten im Mittel {run['cost'].mean() / 100:.2f} EUR pro Standort")
+        raise SystemExit(0)
+
+    from dataset import find_day_folders, load_day
+
+    folders = find_day_folders(args.root)
+    rows = backtest_days([load_day(folder)["inputs"] for folder in folders], args.backend, args.seed,
+                         args.pv_sigma, args.load_sigma)
+    print(f"{'Tag':10s} {'geplant':>10s} {'realisiert':>11s} {'Voraussicht':>12s} {'SOC Ende':>9s}")
+    for folder, row in zip(folders, rows):
+        print(f"{folder:10s} {row['planned']:10.1f} {row['realized']:11.1f} {row['perfect']:12.1f} "
+              f"{row['final_soc_wh']:9.0f}")
@@ -0,0 +1,183 @@
+"""
+Batch optimization of many day folders in parallel.
+
+    python batch.py [root] --workers 4 --threads 1 --output summary.csv [--cache] [--events solves.jsonl]
+
+Every folder below root with netztarif.log, pv.log, verbrauch.log and log.log
+is solved in its own process. Rows are printed (and appended to the CSV file)
+as soon as a day is finished. A failing or infeasible day only produces a row
+with its status, the rest of the batch continues.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import io
+import os
+import time
+
+import instrument
+from dataset import find_day_folders, load_day
+
+FIELDS = [
+    "folder", "status", "periods", "seconds",
+    "cost_without", "cost_existing", "cost_optimized",
+    "savings", "savings_vs_existing", "error",
+]
+
+
+def day_costs(day, energy_bought_list):
+    """
+    Costs of one day in ct, calculated like Solar.py:
+    without optimization, existing controller (bezugneu) and optimized plan.
+    """
+    values_kosten = day["values_kosten"]
+    cost_without = -sum((e + s) * k for e, s, k in zip(day["energyConsumption"], day["values_pv"], values_kosten))
+    cost_existing = None
+    if len(day["soc_bestehend"]):
+        cost_existing = sum(e * k for e, k in zip(day["bezug_bestehend"], values_kosten))
+    cost_optimized = sum(e * k for e, k in zip(energy_bought_list, values_kosten)) / 1000
+    return cost_without, cost_existing, cost_optimized
+
+
+def _init_worker(events=None):
+    """Every worker appends its solve events to the same JSON-lines file."""
+    if events:
+        instrument.add_sink(instrument.JsonLinesSink(events))
+
+
+def solve_day(folderName, parameters=None, backend="CBC", num_threads=1, cache=False, cache_dir=None):
+    """
+    Solve one folder. Runs in a worker process and never raises,
+    errors are returned in the row.
+
+    Returns:
+        dict: One summary row with the keys of FIELDS
+    """
+    # imported here, so every worker process creates its own solver
+    from solver import solve_solar
+
+    row = {name: None for name in FIELDS}
+    row["folder"] = folderName
+    start = time.perf_counter()
+    try:
+        day = load_day(folderName, parameters=parameters, cache=cache, cache_dir=cache_dir)
+        row["periods"] = len(day["interval"])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = solve_solar(**day["inputs"], backend=backend, num_threads=num_threads)
+
+        energy_bought_list = result[1]
+        if not energy_bought_list:
+            row["status"] = "infeasible"
+        else:
+            row["status"] = "ok"
+            cost_without, cost_existing, cost_optimized = day_costs(day, energy_bought_list)
+            row["cost_without"] = cost_without
+            row["cost_existing"] = cost_existing
+            row["cost_optimized"] = cost_optimized
+            row["savings"] = cost_without - cost_optimized
+            if cost_existing is not None:
+                row["savings_vs_existing"] = cost_existing - cost_optimized
+    except Exception as e:
+        row["status"] = "error"
+        row["error"] = f"{type(e).__name__}: {e}"
+
+    row["seconds"] = time.perf_counter() - start
+    return row
+
+
+def run_batch(folders, parameters=None, backend="CBC", workers=None, num_threads=1, cache=False, cache_dir=None,
+              events=None):
+    """
+    Solve all folders in a process pool.
+
+    Args:
+        folders: List of day folders
+        parameters: Overrides for dataset.DEFAULT_PARAMETERS
+        backend: Backend for solve_solar
+        workers: Number of processes, None for one per core
+        num_threads: Solver threads per worker
+        cache: Read the days with the binary cache of dataset.load_day_cached()
+        cache_dir: Directory of the cache, None for a .cache folder in every day folder
+        events: JSON-lines file for the instrumentation events of all solves (see instrument.py)
+
+    Yields:
+        dict: One summary row per folder, in the order they are finished
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                initargs=(events,)) as pool:
+        futures = [pool.submit(solve_day, folderName, parameters, backend, num_threads, cache, cache_dir) for folderName in folders]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+def summarize(rows):
+    """Totals over all successfully solved days."""
+    solved = [row for row in rows if row["status"] == "ok"]
+    summary = {
+        "days": len(rows),
+        "solved": len(solved),
+        "failed": len(rows) - len(solved),
+        "cost_without": sum(row["cost_without"] for row in solved),
+        "cost_optimized": sum(row["cost_optimized"] for row in solved),
+    }
+    summary["savings"] = summary["cost_without"] - summary["cost_optimized"]
+    with_existing = [row for row in solved if row["cost_existing"] is not None]
+    summary["savings_vs_existing"] = sum(row["savings_vs_existing"] for row in with_existing)
+    return summary
+
+
+def format_row(row):
+    def value(name):
+        v = row[name]
+        return f"{v:.1f}" if isinstance(v, float) else ("-" if v is None else str(v))
+    return (f"{row['folder']:16s}{row['status']:12s}{value('seconds'):>8s}{value('cost_without'):>12s}"
+            f"{value('cost_existing'):>12s}{value('cost_optimized'):>12s}{value('savings'):>10s}"
+            + (f"  {row['error']}" if row["error"] else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve all day folders in parallel")
+    parser.add_argument("root", nargs="?", default=".")
+    parser.add_argument("--workers", type=int, default=None, help="processes, default one per core")
+    parser.add_argument("--threads", type=int, default=1, help="solver threads per worker")
+    parser.add_argument("--backend", default="CBC")
+    parser.add_argument("--output", help="CSV file, rows are appended as they finish")
+    parser.add_argument("--cache", action="store_true", help="parse the log files once into a binary cache")
+    parser.add_argument("--cache-dir", help="directory of the cache, default .cache in every day folder")
+    parser.add_argument("--events", help="JSON-lines file for timings, model size and statistics of every solve")
+    args = parser.parse_args()
+
+    folders = find_day_folders(args.root)
+    print(f"{len(folders)} Ordner gefunden")
+    print(f"{'Folder':16s}{'Status':12s}{'Sec':>8s}{'Ohne':>12s}{'Bestehend':>12s}{'Optimiert':>12s}{'Ersparnis':>10s}")
+
+    writer = None
+    output = None
+    if args.output:
+        new_file = not os.path.exists(args.output)
+        output = open(args.output, "a", newline="")
+        writer = csv.DictWriter(output, fieldnames=FIELDS)
+        if new_file:
+            writer.writeheader()
+
+    rows = []
+    try:
+        for row in run_batch(folders, backend=args.backend, workers=args.workers, num_threads=args.threads,
+                             cache=args.cache or args.cache_dir is not None, cache_dir=args.cache_dir,
+                             events=args.events):
+            rows.append(row)
+            print(format_row(row), flush=True)
+            if writer:
+                writer.writerow(row)
+                output.flush()
+    finally:
+        if output:
+            output.close()
+
+    summary = summarize(rows)
+    print(f"\n{summary['solved']}/{summary['days']} Tage gelöst, "
+          f"Kosten ohne Optimierung {summary['cost_without']:.1f}, optimiert {summary['cost_optimized']:.1f}, "
+          f"Ersparnis {summary['savings']:.1f} (gegenüber bestehend {summary['savings_vs_existing']:.1f})")
@@ -0,0 +1,676 @@
+"""
+Benchmarks of the solve_solar backends.
+
+    python benchmark.py
+    python benchmark.py --folders 19.01 20.01 --resolutions 100 10
+    python benchmark.py --suite --output bench.json
+    python benchmark.py --suite --horizons 96 672 --backends CBC DP --time-limit 30
+    python benchmark.py --imports
+    python benchmark.py --commands 5000
+    python benchmark.py --switching --backends CBC SCIP
+    python benchmark.py --cpsat --workers 1 8 --horizons 96 672
+    python benchmark.py --lp
+
+Without --suite, the CBC MILP and the DP engine (at several SOC resolutions)
+are solved for every folder with the same inputs. The table shows the runtime
+and the value of the MILP objective of the returned plan, so the costs are
+comparable.
+
+With --suite, a grid of cases is run: synthetic price/PV/load profiles for
+every horizon and battery size plus the shipped day folders, each with every
+backend. Every case runs in a fresh process so the peak memory belongs to the
+case. Build time, solve time, peak memory, objective, best bound and MIP gap
+are written as JSON, so results of different versions can be compared.
+
+With --imports, the import time of the modules and the wall time of a
+headless Solar.py run are measured in fresh interpreters.
+
+With --commands, the command encoding of many site schedules is timed: per
+site with generate_commands() / group_commands() against one encode_commands()
+pass over all sites with run-length groups and the diff to the last schedule.
+
+With --switching, every folder is solved with and without switch penalty /
+minimum dwell (see SolarPlanner.add_switching()); the table shows solve time,
+number of command groups and costs.
+
+With --cpsat, CBC and the CP-SAT backend (cpsat_solver.py) with every number
+of search workers solve the folders and the synthetic horizons; the table
+shows solve time, status and the gap of the objective to the best one.
+
+With --lp, every folder is solved with CBC directly and with lp_first="GLOP"
+(LP relaxation first, MILP only if the LP solution breaks the binaries); the
+table shows the path taken, LP and MILP time and the objectives.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import instrument
+from dataset import build_inputs, load_day
+from solver import SolarPlanner, solve_solar
+
+DEFAULT_FOLDERS = ["19.01", "20.01", "25.11"]
+
+DEFAULT_HORIZONS = [96, 192, 672]
+
+DEFAULT_BACKENDS = ["CBC", "SCIP", "DP"]
+
+# "<solver>/chunked" solves long horizons in chunks of one day with half a day lookahead
+CHUNK = 96
+LOOKAHEAD = 48
+CHUNK_TIME_LIMIT_MS = 2000
+
+# capacity, charge and discharge power per period (Wh)
+BATTERY_SIZES = {
+    "small": {"battery_max_capacity": 10000, "battery_charge_power": 500, "battery_discharge_power": 750},
+    "default": {"battery_max_capacity": 28800, "battery_charge_power": 1000, "battery_discharge_power": 1500},
+    "large": {"battery_max_capacity": 57600, "battery_charge_power": 2000, "battery_discharge_power": 3000},
+}
+
+
+def plan_objective(inputs, result):
+    """
+    Objective of solve_solar for a returned plan:
+    grid cost - sold solar + value of the battery content at the end.
+    """
+    (soc_list, energy_bought_list, battery_discharge_list, battery_charge_list,
+     solar_energy_list, is_charging_list, is_discharging_list,
+     outside_to_battery_list, solar_to_battery_list) = result
+
+    C, P, S = inputs["C"], inputs["P"], inputs["S"]
+    objective = 0
+    for k, i in enumerate(inputs["interval"]):
+        E_G = energy_bought_list[k]
+        E_GL = E_G - outside_to_battery_list[k]
+        E_SL = C[i] - battery_discharge_list[k] - E_GL
+        E_S = S[i] - solar_to_battery_list[k] - E_SL
+        objective += P[i] * E_G - inputs["P_solar"] * E_S
+
+    B_end = soc_list[-1] * inputs["B_c_max"] / 100
+    return objective - inputs["P_loaded"] * B_end
+
+
+def run_backend(inputs, backend, soc_resolution=10):
+    """Solve once and return (result, seconds), solver output is suppressed."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = solve_solar(**inputs, backend=backend, soc_resolution=soc_resolution)
+        seconds = time.perf_counter() - start
+    return result, seconds
+
+
+def compare_backends(folders=DEFAULT_FOLDERS, resolutions=(100, 50, 10)):
+    """
+    Returns:
+        list: One dict per (folder, backend) with 'folder', 'backend',
+              'seconds', 'objective' and 'gap' (relative to CBC)
+    """
+    rows = []
+    for folderName in folders:
+        inputs = load_day(folderName, interval=list(range(96)))["inputs"]
+
+        result, seconds = run_backend(inputs, "CBC")
+        reference = plan_objective(inputs, result) if result[0] else None
+        rows.append({"folder": folderName, "backend": "CBC", "seconds": seconds,
+                     "objective": reference, "gap": 0.0 if reference is not None else None})
+
+        for resolution in resolutions:
+            result, seconds = run_backend(inputs, "DP", resolution)
+            objective = plan_objective(inputs, result) if result[0] else None
+            gap = None
+            if objective is not None and reference:
+                gap = (objective - reference) / abs(reference)
+            rows.append({"folder": folderName, "backend": f"DP/{resolution}Wh", "seconds": seconds,
+                         "objective": objective, "gap": gap})
+    return rows
+
+
+def synthetic_profile(horizon, seed=0):
+    """
+    Random but realistic looking 15 minute profiles, in the units of the log files.
+
+    Returns:
+        tuple: energyConsumption (kWh, negative), values_kosten (ct/kWh), values_pv (kWh)
+    """
+    rng = np.random.default_rng(seed)
+    hours = (np.arange(horizon) % 96) / 4
+    day = np.arange(horizon) // 96
+
+    # morning and evening price peaks, different level for every day
+    level = 28 + 6 * rng.random(day.max() + 1)[day]
+    peaks = 12 * np.exp(-((hours - 8) / 1.5) ** 2) + 18 * np.exp(-((hours - 18.5) / 2) ** 2)
+    values_kosten = level + peaks + rng.normal(0, 1.5, horizon)
+
+    # bell shaped PV, clouds scale every day
+    clouds = 0.2 + 0.8 * rng.random(day.max() + 1)[day]
+    values_pv = np.clip(1.2 * clouds * np.exp(-((hours - 12.5) / 2.5) ** 2) - 0.02, 0, None)
+
+    # base load plus random appliances
+    appliances = rng.random(horizon) < 0.25
+    energyConsumption = -(0.15 + 0.9 * appliances * rng.random(horizon) + 0.1 * np.exp(-((hours - 19) / 2) ** 2))
+
+    return energyConsumption.round(3).tolist(), values_kosten.round(2).tolist(), values_pv.round(3).tolist()
+
+
+def benchmark_cases(horizons=DEFAULT_HORIZONS, sizes=tuple(BATTERY_SIZES), backends=DEFAULT_BACKENDS,
+                    folders=DEFAULT_FOLDERS, seed=0):
+    """All (profile, horizon, battery, backend) combinations of the suite."""
+    cases = []
+    for horizon in horizons:
+        for size in sizes:
+            for backend in backends:
+                cases.append({"profile": f"synthetic-{seed}", "horizon": horizon, "battery": size, "backend": backend, "seed": seed})
+    for folderName in folders:
+        for backend in backends:
+            cases.append({"profile": folderName, "horizon": None, "battery": "default", "backend": backend})
+    return cases
+
+
+def case_inputs(case):
+    """solve_solar keyword arguments of a case."""
+    parameters = BATTERY_SIZES[case["battery"]]
+    if case["profile"].startswith("synthetic"):
+        interval = list(range(case["horizon"]))
+        energyConsumption, values_kosten, values_pv = synthetic_profile(case["horizon"], case["seed"])
+        return build_inputs(interval, energyConsumption, values_kosten, values_pv, 50, parameters)
+    return load_day(case["profile"], parameters=parameters)["inputs"]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (ru_maxrss is KB on Linux), None without resource (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def rss_mb():
+    """Current resident memory of this process in MB, None if /proc or resource is not available."""
+    try:
+        import resource
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+    except (ImportError, OSError):
+        return None
+
+
+def run_case(case, time_limit_ms=None, soc_resolution=10):
+    """
+    Run one case and measure it. Meant to run in a fresh process.
+
+    Returns:
+        dict: The case plus status, build/solve/extract seconds, peak memory
+              (and the memory before the solve), objective, best bound, gap
+              and the model size
+    """
+    inputs = case_inputs(case)
+    record = dict(case, horizon=len(inputs["interval"]), rss_start_mb=rss_mb())
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if case["backend"].endswith("/chunked"):
+            start = time.perf_counter()
+            result = solve_solar(**inputs, backend=case["backend"].split("/")[0], chunk=CHUNK, lookahead=LOOKAHEAD,
+                                 chunk_time_limit_ms=CHUNK_TIME_LIMIT_MS)
+            record.update(build_s=None, solve_s=time.perf_counter() - start, extract_s=None,
+                          best_bound=None, gap=None, variables=None, constraints=None)
+        elif case["backend"] == "DP":
+            start = time.perf_counter()
+            result = solve_solar(**inputs, backend="DP", soc_resolution=soc_resolution)
+            record.update(build_s=0.0, solve_s=time.perf_counter() - start, extract_s=0.0,
+                          best_bound=None, gap=None, variables=None, constraints=None)
+        elif case["backend"] == "CP_SAT":
+            with instrument.recording(instrument.MemorySink()) as sink:
+                result = solve_solar(**inputs, backend="CP_SAT", time_limit_ms=time_limit_ms)
+            event = sink.events[-1]
+            record.update(build_s=event["build_s"], solve_s=event["solve_s"], extract_s=event["extract_s"],
+                          best_bound=event["best_bound"], gap=event["gap"],
+                          variables=event["variables"], constraints=event["constraints"])
+        else:
+            planner = SolarPlanner(len(inputs["interval"]), inputs["B_c_min"], inputs["B_c_max"],
+                                   inputs["B_charge_max"], inputs["B_discharge_max"], case["backend"])
+            result = planner.solve(inputs["C"], inputs["P"], inputs["S"], inputs["B_c_initial"],
+                                   inputs["P_solar"], inputs["P_loaded"], time_limit_ms=time_limit_ms)
+            timings = planner.last_timings
+            bound = planner.solver.Objective().BestBound() if result else None
+            gap = None
+            if result and result.objective:
+                gap = abs(result.objective - bound) / abs(result.objective)
+            record.update(build_s=timings["build"], solve_s=timings["solve"], extract_s=timings["extract"],
+                          best_bound=bound, gap=gap,
+                          variables=planner.solver.NumVariables(), constraints=planner.solver.NumConstraints())
+
+    record.update(
+        status=result.status,
+        # chunked results have no objective of the whole horizon
+        objective=result.objective if result.objective is not None else (plan_objective(inputs, result) if result else None),
+        cost_optimized=result.cost_optimized() if result else None,
+        peak_rss_mb=peak_rss_mb(),
+    )
+    return record
+
+
+def run_suite(cases, time_limit_ms=None, soc_resolution=10):
+    """
+    Run every case in its own spawned process, one after the other, so
+    timings do not compete for cores and the peak memory is not inherited.
+
+    Yields:
+        dict: One record per case
+    """
+    for case in cases:
+        try:
+            context = multiprocessing.get_context("spawn")
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                yield pool.submit(run_case, case, time_limit_ms, soc_resolution).result()
+        except Exception as e:
+            yield dict(case, status="error", error=f"{type(e).__name__}: {e}")
+
+
+# statements timed by measure_imports(), each in a fresh interpreter
+IMPORT_STATEMENTS = {
+    "numpy": "import numpy",
+    "ortools pywraplp": "from ortools.linear_solver import pywraplp",
+    "matplotlib.pyplot": "import matplotlib.pyplot",
+    "solver": "import solver",
+    "Solar": "import Solar",
+    # top level imports of Solar.py before it was split into library and CLI
+    "Solar (alle Imports)": "import numpy, matplotlib.pyplot, solver; from ortools.linear_solver import pywraplp",
+}
+
+
+def measure_imports(statements=IMPORT_STATEMENTS, repeat=5):
+    """
+    Median time (s) of every import statement, each run in a new interpreter
+    so nothing is cached in sys.modules.
+    """
+    times = {}
+    for name, statement in statements.items():
+        code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+        runs = [float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout)
+                for _ in range(repeat)]
+        times[name] = statistics.median(runs)
+    return times
+
+
+def measure_headless(folderName="19.01", backends=("DP", "CBC"), repeat=5):
+    """Median wall time (s) of python Solar.py <folder> --headless per backend, including startup."""
+    times = {}
+    for backend in backends:
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "Solar.py", folderName, "--headless", "--backend", backend],
+                           capture_output=True, check=True)
+            runs.append(time.perf_counter() - start)
+        times[f"Solar.py --headless --backend {backend}"] = statistics.median(runs)
+    return times
+
+
+# (switch_penalty in ct, min_dwell in periods) of --switching
+SWITCHING_SETTINGS = [(0, 1), (1, 1), (5, 1), (0, 4), (1, 4)]
+
+
+def compare_switching(folders=DEFAULT_FOLDERS, backends=("CBC",), settings=SWITCHING_SETTINGS, time_limit_ms=None):
+    """
+    Solve time, command groups and costs of every folder per switching setting.
+
+    Returns:
+        list: One dict per folder, backend and setting
+    """
+    from batteryCommands.custom import command_runs, encode_commands
+
+    rows = []
+    for folderName in folders:
+        inputs = load_day(folderName)["inputs"]
+        for backend in backends:
+            for switch_penalty, min_dwell in settings:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = solve_solar(**inputs, backend=backend, switch_penalty=switch_penalty,
+                                         min_dwell=min_dwell, time_limit_ms=time_limit_ms)
+                seconds = time.perf_counter() - start
+                codes = encode_commands(result.is_discharging, result.battery_discharge, result.is_charging,
+                                        result.outside_to_battery, result.solar_to_battery)
+                rows.append({
+                    "folder": folderName,
+                    "backend": backend,
+                    "switch_penalty": switch_penalty,
+                    "min_dwell": min_dwell,
+                    "status": result.status,
+                    "seconds": seconds,
+                    "commands": len(command_runs(codes)[0]),
+                    "cost": result.cost_optimized() if result else None,
+                    "objective": result.objective,
+                })
+    return rows
+
+
+def compare_cpsat(folders=DEFAULT_FOLDERS, horizons=(96, 672), workers=(1, None), time_limit_ms=None, seed=0):
+    """
+    Solve time of CBC and CP-SAT (per number of search workers, None for all
+    cores) on the day folders and synthetic horizons.
+
+    Returns:
+        list: One dict per profile and solver with 'gap' to the best objective of the profile
+    """
+    profiles = [{"profile": folderName, "horizon": None, "battery": "default"} for folderName in folders]
+    profiles += [{"profile": f"synthetic-{seed}", "horizon": horizon, "battery": "default", "seed": seed}
+                 for horizon in horizons]
+    solvers = [("CBC", None)] + [("CP_SAT", count) for count in workers]
+
+    rows = []
+    for profile in profiles:
+        inputs = case_inputs(profile)
+        profile_rows = []
+        for backend, count in solvers:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = solve_solar(**inputs, backend=backend, num_threads=count, time_limit_ms=time_limit_ms)
+            profile_rows.append({
+                "profile": profile["profile"],
+                "horizon": len(inputs["interval"]),
+                "backend": backend if backend == "CBC" else f"CP_SAT/{count or 'alle'}",
+                "status": result.status,
+                "seconds": time.perf_counter() - start,
+                "objective": result.objective if result else None,
+            })
+        objectives = [row["objective"] for row in profile_rows if row["objective"] is not None]
+        for row in profile_rows:
+            row["gap"] = None
+            if row["objective"] is not None:
+                row["gap"] = (row["objective"] - min(objectives)) / max(abs(min(objectives)), 1e-9)
+        rows.extend(profile_rows)
+    return rows
+
+
+def format_cpsat(rows):
+    lines = [f"{'Profile':14s}{'N':>5s}  {'Solver':12s}{'Status':>11s}{'Sek':>9s}{'Gap':>9s}{'Objective':>14s}"]
+    for row in rows:
+        gap = "-" if row["gap"] is None else f"{row['gap']:.3%}"
+        objective = "-" if row["objective"] is None else f"{row['objective']:.0f}"
+        lines.append(f"{row['profile']:14s}{row['horizon']:>5}  {row['backend']:12s}{row['status']:>11s}"
+                     f"{row['seconds']:9.2f}{gap:>9s}{objective:>14s}")
+    return "\n".join(lines)
+
+
+def compare_lp(folders=DEFAULT_FOLDERS, backend="CBC", lp_solver="GLOP"):
+    """
+    Path and timings of lp_first compared with solving the MILP directly.
+
+    Returns:
+        list: One dict per folder with 'path' ("LP", "LP+MILP" or "MILP"), the
+              LP and MILP solve times, the wall times and both objectives
+    """
+    from solver import LP_SOLVERS
+
+    rows = []
+    for folderName in folders:
+        inputs = load_day(folderName)["inputs"]
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            reference = solve_solar(**inputs, backend=backend)
+            milp_seconds = time.perf_counter() - start
+            with instrument.recording(instrument.MemorySink()) as sink:
+                start = time.perf_counter()
+                result = solve_solar(**inputs, backend=backend, lp_first=lp_solver)
+                seconds = time.perf_counter() - start
+        lp_events = [event for event in sink.events if event["backend"] in LP_SOLVERS]
+        milp_events = [event for event in sink.events if event["backend"] not in LP_SOLVERS]
+        rows.append({
+            "folder": folderName,
+            "path": "+".join(name for name, events in (("LP", lp_events), ("MILP", milp_events)) if events),
+            "violations": len(lp_events[0]["warnings"]) if lp_events else None,
+            "lp_s": sum(event["solve_s"] for event in lp_events),
+            "milp_s": sum(event["solve_s"] for event in milp_events),
+            "seconds": seconds,
+            "reference_seconds": milp_seconds,
+            "objective": result.objective,
+            "reference_objective": reference.objective,
+        })
+    return rows
+
+
+def format_lp(rows):
+    lines = [f"{'Folder':10s}{'Pfad':>9s}{'Verl.':>7s}{'LP s':>8s}{'MILP s':>8s}{'Gesamt':>8s}{'nur MILP':>10s}"
+             f"{'Objective':>14s}{'MILP-Objective':>16s}"]
+    for row in rows:
+        violations = "-" if row["violations"] is None else str(row["violations"])
+        lines.append(f"{row['folder']:10s}{row['path']:>9s}{violations:>7s}{row['lp_s']:8.3f}{row['milp_s']:8.3f}"
+                     f"{row['seconds']:8.3f}{row['reference_seconds']:10.3f}"
+                     f"{row['objective']:14.0f}{row['reference_objective']:16.0f}")
+    return "\n".join(lines)
+
+
+def compare_presolve(folders=DEFAULT_FOLDERS, horizons=(192,), backend="CBC", time_limit_ms=None, seed=0):
+    """
+    Model reduction and solve time of presolve (see presolve.py) on the day
+    folders and synthetic horizons.
+
+    Returns:
+        list: One dict per profile with the variables and binaries, how many of
+              them presolve fixed, the solve times without and with presolve and both objectives
+    """
+    profiles = [{"profile": folderName, "horizon": None, "battery": "default"} for folderName in folders]
+    profiles += [{"profile": f"synthetic-{seed}", "horizon": horizon, "battery": "default", "seed": seed}
+                 for horizon in horizons]
+
+    rows = []
+    for profile in profiles:
+        inputs = case_inputs(profile)
+        events = {}
+        results = {}
+        for presolve in (False, True):
+            with contextlib.redirect_stdout(io.StringIO()), \
+                    instrument.recording(instrument.MemorySink()) as sink:
+                results[presolve] = solve_solar(**inputs, backend=backend, time_limit_ms=time_limit_ms,
+                                                presolve=presolve)
+            events[presolve] = sink.events[-1]
+        reduction = events[True]["presolve"]
+        rows.append({
+            "profile": profile["profile"],
+            "horizon": len(inputs["interval"]),
+            "variables": reduction["variables"],
+            "binaries": reduction["binaries"],
+            "fixed_variables": reduction["fixed_variables"],
+            "fixed_binaries": reduction["fixed_binaries"],
+            "tightened": reduction["tightened"],
+            "solve_s": events[False]["solve_s"],
+            "presolve_solve_s": events[True]["solve_s"],
+            "update_s": events[False]["update_s"],
+            "presolve_update_s": events[True]["update_s"],
+            "objective": results[False].objective,
+            "presolve_objective": results[True].objective,
+        })
+    return rows
+
+
+def format_presolve(rows):
+    lines = [f"{'Profile':14s}{'N':>5s}{'Var.':>7s}{'fix':>6s}{'Bin.':>6s}{'fix':>6s}{'enger':>7s}"
+             f"{'Solve':>9s}{'mit':>9s}{'Update':>9s}{'mit':>9s}{'Objective':>14s}{'mit':>14s}"]
+    for row in rows:
+        objectives = ["-" if value is None else f"{value:.0f}"
+                      for value in (row["objective"], row["presolve_objective"])]
+        lines.append(f"{row['profile']:14s}{row['horizon']:>5}{row['variables']:7d}{row['fixed_variables']:6d}"
+                     f"{row['binaries']:6d}{row['fixed_binaries']:6d}{row['tightened']:7d}"
+                     f"{row['solve_s']:9.3f}{row['presolve_solve_s']:9.3f}"
+                     f"{row['update_s']:9.4f}{row['presolve_update_s']:9.4f}"
+                     f"{objectives[0]:>14s}{objectives[1]:>14s}")
+    return "\n".join(lines)
+
+
+def format_switching(rows):
+    lines = [f"{'Folder':10s}{'Solver':8s}{'Strafe':>8s}{'Dwell':>7s}{'Status':>11s}{'Sek':>8s}{'Befehle':>9s}{'Kosten':>10s}"]
+    for row in rows:
+        cost = "-" if row["cost"] is None else f"{row['cost']:.1f}"
+        lines.append(f"{row['folder']:10s}{row['backend']:8s}{row['switch_penalty']:>8}{row['min_dwell']:>7}"
+                     f"{row['status']:>11s}{row['seconds']:8.2f}{row['commands']:9d}{cost:>10s}")
+    return "\n".join(lines)
+
+
+def site_schedules(sites, folders=DEFAULT_FOLDERS, seed=0):
+    """
+    Plans of many sites for the command benchmark: the DP plans of the day
+    folders, rotated by a random number of periods per site.
+
+    Returns:
+        dict: sites x periods arrays of the inputs of encode_commands()
+    """
+    from dp_solver import solve_solar_dp
+
+    plans = []
+    for folderName in folders:
+        with contextlib.redirect_stdout(io.StringIO()):
+            plans.append(solve_solar_dp(**load_day(folderName)["inputs"]))
+    periods = min(len(plan.soc) for plan in plans)
+    rng = np.random.default_rng(seed)
+    names = ("is_discharging", "battery_discharge", "is_charging", "outside_to_battery", "solar_to_battery")
+    choice = rng.integers(0, len(plans), sites)
+    shift = rng.integers(0, periods, sites)
+    return {
+        name: np.stack([np.roll(getattr(plans[k], name)[:periods], s) for k, s in zip(choice, shift)])
+        for name in names
+    }
+
+
+def measure_commands(sites=5000, seed=0):
+    """
+    Seconds to encode and group the schedules of all sites, per site with the
+    dict based functions and in one array pass, and to diff every schedule
+    against the previous re-plan, in which every site has three random periods
+    with another command.
+    """
+    from batteryCommands.custom import (command_runs, diff_schedules, encode_commands, generate_commands,
+                                        group_commands)
+
+    arrays = site_schedules(sites, seed=seed)
+    names = ("is_discharging", "battery_discharge", "is_charging", "outside_to_battery", "solar_to_battery")
+    periods = arrays["is_charging"].shape[1]
+    times = {}
+
+    start = time.perf_counter()
+    for k in range(sites):
+        rows = [arrays[name][k].tolist() for name in names]
+        group_commands(generate_commands(range(periods), *rows))
+    times["generate_commands + group_commands"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    codes = encode_commands(*(arrays[name] for name in names))
+    runs = [command_runs(row) for row in codes]
+    times["encode_commands + command_runs"] = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed + 1)
+    previous = codes.copy()
+    rows = np.repeat(np.arange(sites), 3)
+    previous[rows, rng.integers(0, periods, len(rows))] = rng.integers(0, 3, len(rows))
+    start = time.perf_counter()
+    changed = sum(len(diff_schedules(previous[k], codes[k], start=1)) for k in range(sites))
+    times["diff_schedules"] = time.perf_counter() - start
+
+    groups = sum(len(r[0]) for r in runs)
+    print(f"{sites} Anlagen, {periods} Perioden, {groups} Gruppen, {changed} geänderte Segmente")
+    return times
+
+
+def environment():
+    """Versions to store with the results."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    try:
+        from ortools import __version__ as ortools_version
+    except ImportError:
+        ortools_version = None
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "ortools": ortools_version,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+
+
+def format_record(record):
+    def value(name, fmt):
+        v = record.get(name)
+        return "-" if v is None else format(v, fmt)
+    return (f"{record['profile']:14s}{record['horizon'] or '-':>5}  {record['battery']:8s}{record['backend']:13s}"
+            f"{record['status']:>11s}{value('build_s', '.3f'):>9s}{value('solve_s', '.3f'):>9s}"
+            f"{value('peak_rss_mb', '.0f'):>7s}{value('gap', '.2%'):>9s}{value('objective', '.0f'):>13s}")
+
+
+def format_rows(rows):
+    text = f"{'Folder':8s}{'Backend':12s}{'Time (ms)':>12s}{'Objective':>16s}{'Gap':>10s}\n"
+    for row in rows:
+        objective = f"{row['objective']:.0f}" if row["objective"] is not None else "-"
+        gap = f"{row['gap'] * 100:.2f}%" if row["gap"] is not None else "-"
+        text += f"{row['folder']:8s}{row['backend']:12s}{row['seconds'] * 1000:12.1f}{objective:>16s}{gap:>10s}\n"
+    return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the solve_solar backends")
+    parser.add_argument("--folders", nargs="*", default=DEFAULT_FOLDERS)
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[100, 50, 10])
+    parser.add_argument("--suite", action="store_true", help="run the full benchmark suite")
+    parser.add_argument("--imports", action="store_true", help="measure import and headless startup times")
+    parser.add_argument("--commands", type=int, metavar="SITES", help="time the command encoding of SITES schedules")
+    parser.add_argument("--switching", action="store_true", help="compare solves with switch penalty / minimum dwell")
+    parser.add_argument("--cpsat", action="store_true", help="compare CBC with CP-SAT per number of workers")
+    parser.add_argument("--lp", action="store_true", help="compare lp_first (LP relaxation first) with the MILP")
+    parser.add_argument("--presolve", action="store_true", help="model reduction and solve time with presolve")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 0], help="CP-SAT search workers, 0 for all cores")
+    parser.add_argument("--horizons", nargs="+", type=int, default=DEFAULT_HORIZONS)
+    parser.add_argument("--sizes", nargs="+", default=list(BATTERY_SIZES), choices=list(BATTERY_SIZES))
+    parser.add_argument("--backends", nargs="+", default=DEFAULT_BACKENDS,
+                        help="CBC, SCIP, CP_SAT, DP or CBC/chunked, SCIP/chunked")
+    parser.add_argument("--time-limit", type=float, default=60, help="seconds per MILP solve")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_output.json")
+    args = parser.parse_args()
+
+    if args.lp:
+        print(format_lp(compare_lp(args.folders)))
+    elif args.presolve:
+        print(format_presolve(compare_presolve(args.folders, args.horizons, time_limit_ms=args.time_limit * 1000,
+                                               seed=args.seed)))
+    elif args.cpsat:
+        workers = [count or None for count in args.workers]
+        print(format_cpsat(compare_cpsat(args.folders, args.horizons, workers, args.time_limit * 1000, args.seed)))
+    elif args.switching:
+        backends = [b for b in args.backends if b != "DP"]
+        print(format_switching(compare_switching(args.folders, backends, time_limit_ms=args.time_limit * 1000)))
+    elif args.commands:
+        for name, seconds in measure_commands(args.commands, args.seed).items():
+            print(f"{name:40s}{seconds * 1000:10.1f} ms  {seconds / args.commands * 1e6:8.1f} µs/Anlage")
+    elif args.imports:
+        times = measure_imports()
+        times.update(measure_headless(args.folders[0] if args.folders else "19.01"))
+        for name, seconds in times.items():
+            print(f"{name:40s}{seconds * 1000:10.1f} ms")
+    elif not args.suite:
+        print(format_rows(compare_backends(args.folders, args.resolutions)))
+    else:
+        cases = benchmark_cases(args.horizons, args.sizes, args.backends, args.folders, args.seed)
+        print(f"{'Profile':14s}{'N':>5s}  {'Battery':8s}{'Solver':13s}{'Status':>11s}{'Build':>9s}{'Solve':>9s}{'MB':>7s}{'Gap':>9s}{'Objective':>13s}")
+        records = []
+        for record in run_suite(cases, args.time_limit * 1000, args.resolutions[-1]):
+            records.append(record)
+            print(format_record(record), flush=True)
+
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "results": records}, f, indent=2)
+        print(f"\n{len(records)} Ergebnisse in {args.output} gespeichert")
@@ -0,0 +1,217 @@
+"""
+CP-SAT backend for the solve_solar model.
+
+The model is the MILP of solver.py, built with the CP-SAT API of OR-Tools
+(ortools.sat.python.cp_model) instead of pywraplp. All energies are integer
+Wh, only the solar efficiency of 0.9 is not an integer, so the rows with it
+are multiplied by 10:
+
+    E_C = 0.9 * E_SB + E_GB     ->     10 * E_C == 9 * E_SB + 10 * E_GB
+
+and the model is integer-exact. Like in the MILP E_C is an integer, so E_SB
+is a multiple of 10. CP-SAT runs a portfolio of num_workers search workers
+(all cores by default) and needs finite bounds, which are the per period
+limits of the MILP (charge / discharge power, C, S and the Big-M of the
+import / export rows).
+
+    result = solve_solar(**inputs, backend="CP_SAT", num_threads=8, time_limit_ms=2000)
+
+With hint the coarse DP plan (solver.FALLBACK_RESOLUTION) is passed as
+solution hint. It is off by default: on the day folders it makes no
+difference, on a synthetic week it made one worker five times slower.
+"""
+
+import numbers
+import time
+
+import numpy as np
+
+import instrument
+import timegrid
+from dp_solver import EFFICIENCY_NUMERATOR, EFFICIENCY_SCALE, M
+from result import SolarResult
+
+STATUS_NAMES = {
+    "OPTIMAL": "OPTIMAL",
+    "FEASIBLE": "FEASIBLE",
+    "INFEASIBLE": "INFEASIBLE",
+    "MODEL_INVALID": "MODEL_INVALID",
+    "UNKNOWN": "NOT_SOLVED",
+}
+
+
+def _integral(value):
+    """A coefficient as int if it is integral, CP-SAT scales other objective coefficients itself."""
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def solve_solar_cpsat(interval,
+                      C,
+                      P,
+                      P_solar,
+                      S,
+                      B_c_initial,
+                      B_c_min,
+                      B_charge_max,
+                      B_discharge_max,
+                      B_c_max,
+                      P_loaded,
+                      printEnabled=0,
+                      num_workers=None,
+                      time_limit_ms=None,
+                      relative_gap=None,
+                      durations=None,
+                      hint=False):
+    """
+    Solve the battery schedule with CP-SAT.
+
+    Args:
+        interval: List of time periods, C, P, S (and P_solar per period) are indexed by it
+        num_workers: Parallel search workers, None for all cores
+        time_limit_ms: Time limit of the search, the best solution so far is
+            returned afterwards (status FEASIBLE)
+        relative_gap: Stop as soon as the solution is proven within this relative gap
+        durations: Slot durations in minutes (see timegrid.py)
+        hint: Start from the coarse DP plan
+
+    Returns:
+        SolarResult: Same values as the MILP backends
+    """
+    from ortools.sat.python import cp_model
+
+    start = time.perf_counter()
+    n = len(interval)
+    period_scale = timegrid.scale(durations)
+    if period_scale is None:
+        period_scale = np.ones(n)
+    elif len(period_scale) != n:
+        raise ValueError(f"{len(period_scale)} Slotdauern für {n} Perioden")
+    charge_max = [int(round(B_charge_max * f)) for f in period_scale]
+    discharge_max = [int(round(B_discharge_max * f)) for f in period_scale]
+    big_m = [int(M * f) for f in period_scale]
+
+    C_values = [int(C[i]) for i in interval]
+    S_values = [int(S[i]) for i in interval]
+    P_values = [P[i] for i in interval]
+    solar_per_period = not isinstance(P_solar, numbers.Number)
+    P_solar_values = [P_solar[i] if solar_per_period else P_solar for i in interval]
+
+    model = cp_model.CpModel()
+    B = [model.NewIntVar(B_c_min, B_c_max, f"B_{k}") for k in range(n)]
+    E_D = [model.NewIntVar(0, min(discharge_max[k], C_values[k]), f"E_D_{k}") for k in range(n)]
+    E_GB = [model.NewIntVar(0, charge_max[k], f"E_GB_{k}") for k in range(n)]
+    E_GL = [model.NewIntVar(0, C_values[k], f"E_GL_{k}") for k in range(n)]
+    E_SB = [model.NewIntVar(0, min(discharge_max[k], S_values[k]), f"E_SB_{k}") for k in range(n)]
+    E_SL = [model.NewIntVar(0, min(C_values[k], S_values[k]), f"E_SL_{k}") for k in range(n)]
+    E_S = [model.NewIntVar(0, min(big_m[k], S_values[k]), f"E_S_{k}") for k in range(n)]
+    c = [model.NewBoolVar(f"c_{k}") for k in range(n)]
+    x = [model.NewBoolVar(f"x_{k}") for k in range(n)]
+    m = [model.NewBoolVar(f"m_{k}") for k in range(n)]
+    y = [model.NewBoolVar(f"y_{k}") for k in range(n)]
+
+    for k in range(n):
+        model.Add(c[k] + x[k] <= 1)
+        model.Add(m[k] + y[k] <= 1)
+        model.Add(E_GL[k] + E_GB[k] <= min(big_m[k], C_values[k] + charge_max[k]) * m[k])
+        model.Add(E_S[k] <= min(big_m[k], S_values[k]) * y[k])
+        # charging always charges the full charge_max (E_C = charge_max * c), scaled by 10
+        model.Add(EFFICIENCY_NUMERATOR * E_SB[k] + EFFICIENCY_SCALE * E_GB[k]
+                  == EFFICIENCY_SCALE * charge_max[k] * c[k])
+        model.Add(E_D[k] <= discharge_max[k] * x[k])
+        model.Add(E_SL[k] + E_D[k] + E_GL[k] == C_values[k])
+        model.Add(E_SB[k] + E_SL[k] + E_S[k] == S_values[k])
+        previous = B_c_initial if k == 0 else B[k - 1]
+        model.Add(B[k] == previous + charge_max[k] * c[k] - E_D[k])
+
+    model.Minimize(
+        sum(_integral(P_values[k]) * (E_GL[k] + E_GB[k]) - _integral(P_solar_values[k]) * E_S[k] for k in range(n))
+        - _integral(P_loaded) * B[-1]
+    )
+
+    if hint:
+        from solver import FALLBACK_RESOLUTION
+        from dp_solver import solve_solar_dp
+
+        # the coarse DP plan is feasible for this model, with the same charge amounts
+        plan = solve_solar_dp(interval, C, P, P_solar, S, B_c_initial, B_c_min, B_charge_max, B_discharge_max,
+                              B_c_max, P_loaded, None, 0, None, 0, soc_resolution=FALLBACK_RESOLUTION,
+                              durations=durations)
+        if plan:
+            for k in range(n):
+                for var, value in ((c[k], plan.is_charging[k]), (x[k], plan.is_discharging[k]),
+                                   (E_D[k], plan.battery_discharge[k]), (E_GB[k], plan.outside_to_battery[k]),
+                                   (E_SB[k], plan.solar_to_battery[k])):
+                    model.AddHint(var, int(round(value)))
+    build_time = time.perf_counter() - start
+
+    solver = cp_model.CpSolver()
+    if num_workers:
+        solver.parameters.num_workers = num_workers
+    if time_limit_ms:
+        solver.parameters.max_time_in_seconds = time_limit_ms / 1000
+    if relative_gap is not None:
+        solver.parameters.relative_gap_limit = relative_gap
+
+    start = time.perf_counter()
+    status = solver.Solve(model)
+    solve_time = time.perf_counter() - start
+    status_name = STATUS_NAMES.get(solver.StatusName(status), solver.StatusName(status))
+
+    start = time.perf_counter()
+    if status_name not in ("OPTIMAL", "FEASIBLE"):
+        if printEnabled:
+            print("Keine optimale Lösung gefunden")
+        result = SolarResult.empty(status_name)
+    else:
+        def values(variables):
+            return np.array([solver.Value(var) for var in variables], dtype=float)
+
+        objective = solver.ObjectiveValue()
+        if printEnabled:
+            print("Zielfunktionswert =", objective)
+        E_GB_values = values(E_GB)
+        E_GL_values = values(E_GL)
+        E_SB_values = values(E_SB)
+        c_values = values(c)
+        result = SolarResult(
+            soc=values(B) / B_c_max * 100,
+            energy_bought=E_GL_values + E_GB_values,
+            battery_discharge=values(E_D),
+            battery_charge=np.array(charge_max, dtype=float) * c_values,
+            solar_energy=np.array(S_values, dtype=float),
+            is_charging=c_values,
+            is_discharging=values(x),
+            outside_to_battery=E_GB_values,
+            solar_to_battery=E_SB_values,
+            price=np.array(P_values, dtype=float),
+            consumption=np.array(C_values, dtype=float),
+            energy_sold=values(E_S),
+            status=status_name,
+            objective=objective,
+            gap=instrument.mip_gap(objective, solver.BestObjectiveBound()),
+        )
+    extract_time = time.perf_counter() - start
+
+    if instrument.enabled():
+        proto = model.Proto()
+        instrument.emit({
+            "backend": "CP_SAT",
+            "status": status_name,
+            "periods": n,
+            "objective": result.objective if result else None,
+            "variables": len(proto.variables),
+            "constraints": len(proto.constraints),
+            "binaries": 4 * n,
+            "build_s": build_time,
+            "update_s": 0.0,
+            "solve_s": solve_time,
+            "extract_s": extract_time,
+            "iterations": None,
+            "nodes": solver.NumBranches(),
+            "best_bound": solver.BestObjectiveBound() if result else None,
+            "gap": result.gap,
+            "states": None,
+            "warnings": [],
+            "presolve": None,
+        })
+    return result
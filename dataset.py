@@ -0,0 +1,330 @@
+"""
+Reading of the day folders (netztarif.log, verbrauch.log, pv.log, log.log)
+and conversion into the integer inputs of solve_solar, the same way Solar.py
+feeds the solver.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+# battery and tariff settings used by Solar.py
+DEFAULT_PARAMETERS = {
+    "battery_soc_target": 35,
+    "battery_soc_minimum_allowed": 35,
+    "battery_max_capacity": 28800,
+    "battery_charge_power": 1000,
+    "battery_discharge_power": 1500,
+    "price_selling_energy": 785,
+    "price_using_battery": 3091,
+}
+
+DAY_FILES = ("netztarif.log", "verbrauch.log", "pv.log", "log.log")
+
+# binary cache of a day folder, see load_day_cached()
+CACHE_DIR = ".cache"
+CACHE_VERSION = 1
+# arrays in the cache, stored one after another in values.npy
+CACHE_ARRAYS = ("values_kosten", "energyConsumption", "values_pv", "soc_bestehend", "bezug_bestehend")
+
+
+def readData(filename, length):
+    with open(filename) as f:
+        data = [float(x) for line in f for x in line.strip().split()[2:]]
+    if len(data) != length:
+        raise ValueError(f"Unerwartete Anzahl an Daten: {len(data)} statt {length}")
+    return data
+
+def read_battery_file(filename):
+    try:
+        with open(filename) as f:
+            text = f.read()
+
+        # batsoc extrahieren
+        match_batsoc = re.search(r"batsoc\s*:\s*([\d\.]+)", text)
+        if match_batsoc:
+            battery_soc_initial = float(match_batsoc.group(1))
+        else:
+            raise ValueError("batsoc not found")
+
+        # socneu extrahieren
+        match_soc = re.search(r"socneu\s*:\s*\[([^\]]+)\]", text)
+        if match_soc:
+            soc_bestehend = [float(x) for x in re.split(r'\s+', match_soc.group(1).strip()) if x]
+        else:
+            raise ValueError("socneu not found")
+
+        # bezugneu extrahieren
+        match_bezug = re.search(r"bezugneu\s*:\s*\[([^\]]+)\]", text)
+        if match_bezug:
+            bezug_bestehend = [float(x) for x in re.split(r'\s+', match_bezug.group(1).strip()) if x]
+        else:
+            raise ValueError("bezugneu not found")
+
+        return battery_soc_initial, soc_bestehend, bezug_bestehend
+    except FileNotFoundError:
+        return 50, [], []
+
+def read_start_time(filename):
+    """Timestamp of the first value of a log file (date and time of its first line), None if it is empty."""
+    with open(filename) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2:
+                return datetime.datetime.strptime(parts[0] + " " + parts[1], "%Y-%m-%d %H:%M:%S")
+    return None
+
+def count_values(filename):
+    """Number of values in a log file, without the date and time columns."""
+    with open(filename) as f:
+        return sum(len(line.strip().split()[2:]) for line in f)
+
+def is_day_folder(folderName):
+    """True if the folder contains all files of one dataset."""
+    return all(os.path.isfile(os.path.join(folderName, name)) for name in DAY_FILES)
+
+def find_day_folders(root="."):
+    """All dataset folders below root (including root itself), sorted by path."""
+    folders = []
+    for path, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d != "__pycache__"]
+        if is_day_folder(path):
+            folders.append(os.path.normpath(path))
+    return sorted(folders)
+
+def build_inputs(interval, energyConsumption, values_kosten, values_pv, battery_soc_initial, parameters=None):
+    """
+    Scale the raw values (kWh, ct/kWh, SOC in %) to the integer keyword
+    arguments of solve_solar.
+
+    Args:
+        interval: List of time periods
+        energyConsumption: Consumption per period (kWh, negative)
+        values_kosten: Grid price per period (ct/kWh)
+        values_pv: Solar production per period (kWh)
+        battery_soc_initial: SOC at the start in percent
+        parameters: Overrides for DEFAULT_PARAMETERS
+
+    Returns:
+        dict: Keyword arguments for solve_solar
+    """
+    params = dict(DEFAULT_PARAMETERS)
+    params.update(parameters or {})
+
+    battery_max_capacity = params["battery_max_capacity"]
+
+    return {
+        "interval": interval,
+        "C": {i: int(abs(v) * 1000) for i, v in zip(interval, energyConsumption)},
+        "P": {i: int(v * 100) for i, v in zip(interval, values_kosten)},
+        "P_solar": params["price_selling_energy"],
+        "S": {i: int(v * 1000) for i, v in zip(interval, values_pv)},
+        "B_c_initial": int(battery_soc_initial * battery_max_capacity / 100),
+        "B_c_min": int(params["battery_soc_minimum_allowed"] * battery_max_capacity / 100),
+        "B_charge_max": params["battery_charge_power"],
+        "B_discharge_max": params["battery_discharge_power"],
+        "B_c_max": battery_max_capacity,
+        "P_loaded": params["price_using_battery"],
+        "battery_target_capacity": int(params["battery_soc_target"] * battery_max_capacity / 100),
+        "mustLoadFirst": 0,
+        "min_battery_discharge": 23040,
+        "printEnabled": 0,
+    }
+
+def resample_day(day, durations, parameters=None):
+    """
+    A day of load_day() on a grid of slot durations (see timegrid.py). Price
+    and energies are resampled, 'durations' is added. The existing controller
+    values (soc_bestehend, bezug_bestehend) stay on the 15 minute grid.
+    """
+    from timegrid import BASE_MINUTES, resample_energy, resample_mean, uniform_grid
+
+    base = uniform_grid(len(day["interval"]), BASE_MINUTES)
+    interval = list(range(len(durations)))
+    values_kosten = resample_mean(day["values_kosten"], base, durations).tolist()
+    energyConsumption = resample_energy(day["energyConsumption"], base, durations).tolist()
+    values_pv = resample_energy(day["values_pv"], base, durations).tolist()
+    return dict(
+        day,
+        interval=interval,
+        durations=list(durations),
+        values_kosten=values_kosten,
+        energyConsumption=energyConsumption,
+        values_pv=values_pv,
+        inputs=build_inputs(interval, energyConsumption, values_kosten, values_pv, day["battery_soc_initial"],
+                            parameters),
+    )
+
+def load_day(folderName, interval=None, parameters=None, cache=False, cache_dir=None, durations=None):
+    """
+    Read one day folder.
+
+    Args:
+        folderName: Folder with netztarif.log, verbrauch.log, pv.log and log.log
+        interval: List of time periods, None to use all values of netztarif.log
+        parameters: Overrides for DEFAULT_PARAMETERS
+        cache: Use the binary cache of load_day_cached(), the values are arrays then
+        cache_dir: Directory of the cache, see load_day_cached()
+        durations: Slot durations in minutes (see timegrid.py), None for the 15 minute values of the files
+
+    Returns:
+        dict: Raw values ('values_kosten', 'energyConsumption', 'values_pv',
+              'battery_soc_initial', 'soc_bestehend', 'bezug_bestehend'),
+              'interval' and the solve_solar keyword arguments in 'inputs'
+    """
+    if durations is not None:
+        return resample_day(load_day(folderName, interval, parameters, cache, cache_dir), durations, parameters)
+
+    if cache:
+        return load_day_cached(folderName, interval, parameters, cache_dir)
+
+    if interval is None:
+        interval = list(range(count_values(os.path.join(folderName, "netztarif.log"))))
+
+    battery_soc_initial, soc_bestehend, bezug_bestehend = read_battery_file(os.path.join(folderName, "log.log"))
+    values_kosten = readData(os.path.join(folderName, "netztarif.log"), len(interval))
+    energyConsumption = readData(os.path.join(folderName, "verbrauch.log"), len(interval))
+    values_pv = readData(os.path.join(folderName, "pv.log"), len(interval))
+
+    return {
+        "folderName": folderName,
+        "interval": interval,
+        "values_kosten": values_kosten,
+        "energyConsumption": energyConsumption,
+        "values_pv": values_pv,
+        "battery_soc_initial": battery_soc_initial,
+        "soc_bestehend": soc_bestehend,
+        "bezug_bestehend": bezug_bestehend,
+        "inputs": build_inputs(interval, energyConsumption, values_kosten, values_pv, battery_soc_initial, parameters),
+    }
+
+def file_signature(filename):
+    """(mtime in ns, size) of a file, None if it does not exist."""
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+def cache_folder(folderName, cache_dir=None):
+    """
+    Folder of the binary cache of one day folder: CACHE_DIR inside the day
+    folder, or one subfolder per day (hash of the absolute path) in cache_dir.
+    """
+    if cache_dir is None:
+        return os.path.join(folderName, CACHE_DIR)
+    key = hashlib.sha1(os.path.abspath(folderName).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, key)
+
+def read_values(filename):
+    """All values of a log file as float64 array, without the date and time columns."""
+    with open(filename) as f:
+        return np.array([float(x) for line in f for x in line.strip().split()[2:]], dtype=np.float64)
+
+def write_cache(folderName, cache_dir=None):
+    """
+    Parse the log files of one day folder once and store the values in
+    values.npy. meta.json is written last, so an interrupted write is never used.
+
+    Returns:
+        dict: Content of meta.json
+    """
+    folder = cache_folder(folderName, cache_dir)
+    os.makedirs(folder, exist_ok=True)
+
+    # signatures before reading, a file changed while reading invalidates the cache
+    signatures = {name: file_signature(os.path.join(folderName, name)) for name in DAY_FILES}
+
+    battery_soc_initial, soc_bestehend, bezug_bestehend = read_battery_file(os.path.join(folderName, "log.log"))
+    arrays = {
+        "values_kosten": read_values(os.path.join(folderName, "netztarif.log")),
+        "energyConsumption": read_values(os.path.join(folderName, "verbrauch.log")),
+        "values_pv": read_values(os.path.join(folderName, "pv.log")),
+        "soc_bestehend": np.array(soc_bestehend, dtype=np.float64),
+        "bezug_bestehend": np.array(bezug_bestehend, dtype=np.float64),
+    }
+    # all arrays in one file, so a later load needs only one memory map
+    tmp = os.path.join(folder, "values.tmp.npy")
+    np.save(tmp, np.concatenate([arrays[name] for name in CACHE_ARRAYS]))
+    os.replace(tmp, os.path.join(folder, "values.npy"))
+
+    meta = {
+        "version": CACHE_VERSION,
+        "files": signatures,
+        "battery_soc_initial": battery_soc_initial,
+        "lengths": {name: len(arrays[name]) for name in CACHE_ARRAYS},
+    }
+    tmp = os.path.join(folder, "meta.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(folder, "meta.json"))
+    return meta
+
+def read_cache_meta(folderName, cache_dir=None):
+    """meta.json of the cache if it is still valid for the log files, otherwise None."""
+    try:
+        with open(os.path.join(cache_folder(folderName, cache_dir), "meta.json")) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if meta.get("version") != CACHE_VERSION:
+        return None
+    for name in DAY_FILES:
+        if meta["files"].get(name) != file_signature(os.path.join(folderName, name)):
+            return None
+    return meta
+
+def load_day_cached(folderName, interval=None, parameters=None, cache_dir=None):
+    """
+    Same as load_day(), but the log files are parsed only once. The values
+    are stored as .npy files (see cache_folder()) and memory mapped on later
+    calls, so they are not copied. The cache is rebuilt when mtime or size of
+    one of the log files changes.
+
+    Args:
+        folderName: Folder with netztarif.log, verbrauch.log, pv.log and log.log
+        interval: List of time periods, None to use all values of netztarif.log
+        parameters: Overrides for DEFAULT_PARAMETERS
+        cache_dir: Directory for the cache, None to write it into the day folder
+
+    Returns:
+        dict: Like load_day(), the raw values are read-only NumPy arrays
+    """
+    meta = read_cache_meta(folderName, cache_dir)
+    if meta is None:
+        meta = write_cache(folderName, cache_dir)
+
+    folder = cache_folder(folderName, cache_dir)
+    if sum(meta["lengths"].values()):
+        # plain ndarray view of the memory map, slices of it are views as well
+        values = np.asarray(np.load(os.path.join(folder, "values.npy"), mmap_mode="r"))
+    else:
+        # an empty file can not be memory mapped
+        values = np.empty(0)
+    arrays = {}
+    offset = 0
+    for name in CACHE_ARRAYS:
+        length = meta["lengths"][name]
+        arrays[name] = values[offset:offset + length]
+        offset += length
+
+    if interval is None:
+        interval = list(range(len(arrays["values_kosten"])))
+    for name in ("values_kosten", "energyConsumption", "values_pv"):
+        if len(arrays[name]) != len(interval):
+            raise ValueError(f"Unerwartete Anzahl an Daten: {len(arrays[name])} statt {len(interval)}")
+
+    battery_soc_initial = meta["battery_soc_initial"]
+    return {
+        "folderName": folderName,
+        "interval": interval,
+        **arrays,
+        "battery_soc_initial": battery_soc_initial,
+        # lists are much faster to iterate than arrays
+        "inputs": build_inputs(interval, arrays["energyConsumption"].tolist(), arrays["values_kosten"].tolist(),
+                               arrays["values_pv"].tolist(), battery_soc_initial, parameters),
+    }
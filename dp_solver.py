@@ -0,0 +1,360 @@
+"""
+Dynamic programming backend for the solve_solar model.
+
+The battery has one state (B, Wh) and every period is one stage. In the MILP
+of solver.py the cost of a period only depends on the action, not on the
+battery state:
+
+- charging (c = 1) always charges exactly B_charge_max, the solar share is
+  chosen to be as cheap as possible
+- discharging (x = 1) can discharge 0..min(B_discharge_max, C) Wh, the
+  discharge only feeds the load
+- idle is the same as discharging 0 Wh
+
+So the stage costs are computed once per period for every battery change and
+the backward recursion is a vectorized min over a sliding window of the value
+function. The state grid is anchored at B_c_initial with a step of
+soc_resolution Wh, so the start is exact. If B_charge_max is not a multiple of
+soc_resolution, the charge step is rounded to the grid.
+
+The plan is optimal on the state grid only, so its status is "DISCRETIZED"
+and not "OPTIMAL", and there is no best bound: on 19.01 the 10 Wh grid is
+about 0.4 % more expensive than the MILP optimum.
+
+Only NumPy is needed, OR-Tools is not imported.
+"""
+
+import numbers
+import time
+from fractions import Fraction
+
+import numpy as np
+
+import instrument
+from result import SolarResult
+
+# Big-M of the MILP, limits import and export per period; solver.py and cpsat_solver.py import it
+M = 10000
+
+# duration of one period without durations (minutes), the powers are given per period of this length
+BASE_MINUTES = 15
+
+# share of solar energy which arrives in the battery
+EFFICIENCY = 0.9
+
+# the same as integer ratio, EFFICIENCY = EFFICIENCY_NUMERATOR / EFFICIENCY_SCALE, for the
+# rows of solver.py and cpsat_solver.py
+EFFICIENCY_NUMERATOR, EFFICIENCY_SCALE = Fraction(EFFICIENCY).limit_denominator(1000).as_integer_ratio()
+
+
+def charge_costs(C, S, P, P_solar, B_charge_max, B_discharge_max, import_max=M, export_max=M):
+    """
+    Cheapest way to charge B_charge_max in one period.
+    import_max and export_max limit the grid exchange of the period (M for 15 minutes).
+
+    Returns:
+        tuple: (cost, E_SB, E_GB, E_G, E_S), cost is inf if charging is impossible
+    """
+    # E_GB = B_charge_max - 0.9 * E_SB must be an integer, so E_SB is a multiple of 10
+    solar_max = min(S, B_discharge_max, int(B_charge_max / EFFICIENCY))
+    E_SB = np.arange(0, solar_max + 1, 10)
+    E_GB = B_charge_max - np.round(E_SB * EFFICIENCY)
+    rest = S - E_SB
+    E_SL = np.minimum(rest, C)
+    E_S = rest - E_SL
+    E_G = (C - E_SL) + E_GB
+
+    cost = P * E_G - P_solar * E_S
+    # import and export at the same time is not allowed, and both are limited
+    invalid = ((E_G > 0) & (E_S > 0)) | (E_G > import_max) | (E_S > export_max) | (E_GB < 0)
+    cost = np.where(invalid, np.inf, cost)
+
+    best = int(np.argmin(cost))
+    return cost[best], int(E_SB[best]), int(E_GB[best]), int(E_G[best]), int(E_S[best])
+
+
+def discharge_costs(C, S, P, P_solar, E_D, import_max=M, export_max=M):
+    """
+    Cost of a period without charging for an array of discharge values E_D.
+    import_max and export_max limit the grid exchange of the period (M for 15 minutes).
+
+    Returns:
+        tuple: (cost, E_G, E_S) arrays
+    """
+    rest_load = C - E_D
+    E_G = np.maximum(rest_load - S, 0)
+    E_S = np.maximum(S - rest_load, 0)
+    cost = P * E_G - P_solar * E_S
+    cost = np.where((E_G > import_max) | (E_S > export_max), np.inf, cost)
+    return cost, E_G, E_S
+
+
+def idle_plan(interval, C, P, P_solar, S, B_c_initial, B_c_max, P_loaded):
+    """
+    Plan without any battery action: the load comes from solar and the grid,
+    the rest of the solar energy is sold. Needs no search, so it is the last
+    fallback when no solver produced a plan in time.
+
+    Returns:
+        SolarResult: status "HEURISTIC"
+    """
+    solar_per_period = not isinstance(P_solar, numbers.Number)
+    C_values = np.array([C[i] for i in interval], dtype=float)
+    P_values = np.array([P[i] for i in interval], dtype=float)
+    S_values = np.array([S[i] for i in interval], dtype=float)
+    P_solar_values = np.array([P_solar[i] for i in interval] if solar_per_period else [P_solar] * len(interval),
+                              dtype=float)
+    _, E_G, E_S = discharge_costs(C_values, S_values, P_values, P_solar_values, 0)
+    zeros = np.zeros(len(interval))
+    return SolarResult(
+        soc=np.full(len(interval), B_c_initial / B_c_max * 100),
+        energy_bought=E_G,
+        battery_discharge=zeros,
+        battery_charge=zeros,
+        solar_energy=S_values,
+        is_charging=zeros,
+        is_discharging=zeros,
+        outside_to_battery=zeros,
+        solar_to_battery=zeros,
+        price=P_values,
+        consumption=C_values,
+        energy_sold=E_S,
+        status="HEURISTIC",
+        objective=float(P_values @ E_G - P_solar_values @ E_S - P_loaded * B_c_initial),
+    )
+
+
+def emit_event(result, periods, states, actions, solve_time, extract_time):
+    """Instrumentation event of a DP solve, the fields of SolarPlanner.solve_event()."""
+    if not instrument.enabled():
+        return
+    instrument.emit({
+        "backend": "DP",
+        "status": result.status,
+        "periods": periods,
+        "objective": result.objective,
+        # states x actions per stage take the place of the model size
+        "variables": periods * states,
+        "constraints": None,
+        "binaries": 0,
+        "build_s": 0.0,
+        "update_s": 0.0,
+        "solve_s": solve_time,
+        "extract_s": extract_time,
+        "iterations": periods * states * actions,
+        "nodes": None,
+        # optimal on the SOC grid only, the DP proves no bound of the MILP
+        "best_bound": None,
+        "gap": None,
+        "states": states,
+        "warnings": [],
+        "presolve": None,
+    })
+
+
+def solve_solar_dp(interval,
+                   C,
+                   P,
+                   P_solar,
+                   S,
+                   B_c_initial,
+                   B_c_min,
+                   B_charge_max,
+                   B_discharge_max,
+                   B_c_max,
+                   P_loaded,
+                   battery_target_capacity,
+                   mustLoadFirst, min_battery_discharge,
+                   printEnabled,
+                   soc_resolution=10,
+                   import_max=None,
+                   export_max=None,
+                   first_command=None,
+                   durations=None):
+    """
+    Same call signature and outputs as solver.solve_solar, solved with
+    dynamic programming over SOC buckets of soc_resolution Wh.
+
+    Like SolarPlanner.solve, P_solar may also be given per period and
+    import_max / export_max optionally limit the grid exchange per period (Wh).
+    first_command restricts the first period like SolarPlanner.fix_first_command:
+    'ACC' is a charge with grid energy, 'DIS' a discharge and 'NOD' neither.
+    With durations (slot minutes, see timegrid.py) B_charge_max, B_discharge_max
+    and M are per 15 minutes and scaled per period.
+
+    Returns:
+        SolarResult: iterable as soc_list, energy_bought_list, battery_discharge_list,
+               battery_charge_list, solar_energy_list, is_charging_list,
+               is_discharging_list, outside_to_battery_list, solar_to_battery_list
+               (empty if there is no feasible plan), status "DISCRETIZED"
+    """
+    start = time.perf_counter()
+    step = soc_resolution
+    n = len(interval)
+
+    # state grid anchored at the initial capacity, the initial capacity itself
+    # may be outside of [B_c_min, B_c_max], all later states must not
+    low = min(0, -((B_c_initial - B_c_min) // step))
+    high = max(0, (B_c_max - B_c_initial) // step)
+    states = B_c_initial + np.arange(low, high + 1) * step
+    n_states = len(states)
+    valid = (states >= B_c_min) & (states <= B_c_max)
+
+    # limits per period, scaled with the slot duration
+    period_scale = np.ones(n) if durations is None else np.asarray(durations, dtype=float) / BASE_MINUTES
+    charge_max = [int(round(B_charge_max * f)) for f in period_scale]
+    discharge_max = [int(round(B_discharge_max * f)) for f in period_scale]
+    charge_steps = [max(1, int(round(E / step))) for E in charge_max]
+    discharge_step_counts = [E // step for E in discharge_max]
+    discharge_steps = max(discharge_step_counts)
+    # window of battery changes from -discharge_steps to the largest charge step,
+    # column j is the battery change (j - discharge_steps) * step
+    width = discharge_steps + max(charge_steps) + 1
+
+    solar_per_period = not isinstance(P_solar, numbers.Number)
+
+    def limits(k, i):
+        """Price for sold energy and grid limits of a period."""
+        big_m = M * period_scale[k]
+        return (P_solar[i] if solar_per_period else P_solar,
+                big_m if import_max is None else min(big_m, import_max[k]),
+                big_m if export_max is None else min(big_m, export_max[k]))
+
+    stage_cost = np.full((n, width), np.inf)
+    charge_plan = {}
+    for k, i in enumerate(interval):
+        P_solar_i, import_max_i, export_max_i = limits(k, i)
+        E_D = np.arange(discharge_step_counts[k] + 1) * step
+        cost, _, _ = discharge_costs(C[i], S[i], P[i], P_solar_i, E_D, import_max_i, export_max_i)
+        # discharge only feeds the load
+        cost = np.where(E_D <= C[i], cost, np.inf)
+        stage_cost[k, discharge_steps - discharge_step_counts[k]:discharge_steps + 1] = cost[::-1]
+
+        charge = charge_costs(C[i], S[i], P[i], P_solar_i, charge_max[k], discharge_max[k],
+                              import_max_i, export_max_i)
+        stage_cost[k, discharge_steps + charge_steps[k]] = charge[0]
+        charge_plan[k] = charge
+
+    if first_command is not None:
+        # column of no change, columns before it discharge, the charge column after it
+        allowed = np.zeros(width, dtype=bool)
+        grid_charge = charge_plan[0][2] > 0
+        charge_column = discharge_steps + charge_steps[0]
+        if first_command == "ACC":
+            allowed[charge_column] = grid_charge
+        elif first_command == "DIS":
+            allowed[:discharge_steps] = True
+        elif first_command == "NOD":
+            allowed[discharge_steps] = True
+            allowed[charge_column] = not grid_charge
+        else:
+            raise ValueError(f"Unbekannter Befehl: {first_command}")
+        stage_cost[0, ~allowed] = np.inf
+
+    # backward recursion, value of the battery content at the end is P_loaded per Wh
+    value = np.where(valid, -P_loaded * states.astype(float), np.inf)
+    policy = np.zeros((n, n_states), dtype=np.int64)
+    pad_left = discharge_steps
+    pad_right = width - 1 - discharge_steps
+    for k in range(n - 1, -1, -1):
+        padded = np.concatenate([np.full(pad_left, np.inf), value, np.full(pad_right, np.inf)])
+        # windows[s, j] is the value after moving from state s by column j
+        windows = np.lib.stride_tricks.sliding_window_view(padded, width)
+        # only the battery changes which are possible in this period
+        columns = np.flatnonzero(np.isfinite(stage_cost[k]))
+        if columns.size == 0:
+            value = np.full(n_states, np.inf)
+            continue
+        total = windows[:, columns] + stage_cost[k, columns]
+        best = np.argmin(total, axis=1)
+        policy[k] = columns[best]
+        value = total[np.arange(n_states), best]
+        if k > 0:
+            value = np.where(valid, value, np.inf)
+
+    soc_list = []
+    energy_bought_list = []
+    battery_discharge_list = []
+    battery_charge_list = []
+    solar_energy_list = []
+    is_charging_list = []
+    is_discharging_list = []
+    outside_to_battery_list = []
+    solar_to_battery_list = []
+    energy_sold_list = []
+
+    solve_time = time.perf_counter() - start
+    start = time.perf_counter()
+
+    state = -low
+    if not np.isfinite(value[state]):
+        if printEnabled:
+            print("Keine optimale Lösung gefunden")
+        result = SolarResult.empty("INFEASIBLE")
+        emit_event(result, n, n_states, width, solve_time, time.perf_counter() - start)
+        return result
+
+    objective = float(value[state])
+    if printEnabled:
+        print("Zielfunktionswert =", objective)
+
+    for k, i in enumerate(interval):
+        column = policy[k, state]
+        if column > discharge_steps:
+            cost, E_SB, E_GB, E_G, E_S = charge_plan[k]
+            E_C, E_D = charge_max[k], 0
+            state += charge_steps[k]
+        else:
+            E_D = (discharge_steps - column) * step
+            P_solar_i, import_max_i, export_max_i = limits(k, i)
+            _, E_G, E_S = discharge_costs(C[i], S[i], P[i], P_solar_i, E_D, import_max_i, export_max_i)
+            E_C, E_SB, E_GB = 0, 0, 0
+            state -= discharge_steps - column
+
+        B = states[state]
+        soc_percent = B / B_c_max * 100
+        soc_list.append(soc_percent)
+        energy_bought_list.append(float(E_G))
+        battery_discharge_list.append(float(E_D))
+        battery_charge_list.append(float(E_C))
+        solar_energy_list.append(S[i])
+        is_charging_list.append(1.0 if E_C > 0 else 0.0)
+        is_discharging_list.append(1.0 if E_D > 0 else 0.0)
+        outside_to_battery_list.append(float(E_GB))
+        solar_to_battery_list.append(float(E_SB))
+        energy_sold_list.append(float(E_S))
+
+        if(printEnabled):
+            print(
+                f"{i}\t"
+                f"{C[i]}\t"
+                f"{E_G}\t"
+                f"{P[i]}\t"
+                f"{S[i]}\t"
+                f"{E_S}\t"
+                f"{soc_percent:.1f}\t"  # SOC in %
+                f"{E_C}\t"
+                f"{E_D}\t"
+                f"{E_SB}\t"
+                f"{E_GB}\t"
+                f"{B:.1f}"
+            )
+
+    result = SolarResult(
+        soc=soc_list,
+        energy_bought=energy_bought_list,
+        battery_discharge=battery_discharge_list,
+        battery_charge=battery_charge_list,
+        solar_energy=solar_energy_list,
+        is_charging=is_charging_list,
+        is_discharging=is_discharging_list,
+        outside_to_battery=outside_to_battery_list,
+        solar_to_battery=solar_to_battery_list,
+        price=[P[i] for i in interval],
+        consumption=[C[i] for i in interval],
+        energy_sold=energy_sold_list,
+        status="DISCRETIZED",
+        objective=objective,
+    )
+    emit_event(result, n, n_states, width, solve_time, time.perf_counter() - start)
+    return result
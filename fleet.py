@@ -0,0 +1,428 @@
+"""
+Fleet optimization: many batteries behind one shared grid connection.
+
+Every site is the single battery model of solver.py. The sites are coupled
+only by the shared limit of the summed grid import (and optionally export)
+per period. Instead of one MILP over all sites, the limit is priced in
+(dual decomposition):
+
+1. every site is solved with its own prices plus the price of the shared
+   limit, all sites in parallel
+2. the price of every period is raised where the summed import exceeds the
+   limit and lowered where there is room (subgradient step)
+3. repeat until the plans meet the limit or max_iterations is reached
+
+The sites are solved with the DP engine by default: its runtime is the same
+for every site, while single MILPs can take seconds, and one slow site holds
+up every iteration. The DP plans are not proven optimal, so the dual value of
+an iteration is only a lower bound of the fleet cost with a MILP backend.
+Because the sites have binary charge decisions, similar sites tend to switch
+together and the prices alone may not find a plan within the limit. In that
+case the limit is split between the sites in proportion to their average
+plan over all iterations and every site is solved once more with its share
+as hard limit. The unused part of the limit is then split again equally
+for a few rounds, every round can only lower the costs.
+
+    python fleet.py --sites 50 --import-max 20000 --workers 4
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+
+from dp_solver import solve_solar_dp
+
+# per worker process: all sites and one planner per battery spec (MILP backends)
+_sites = None
+_backend = None
+_planners = {}
+
+
+def _init_worker(sites, backend):
+    global _sites, _backend
+    _sites = sites
+    _backend = backend
+    _planners.clear()
+
+
+def _planner(site):
+    """Planner for the battery spec of a site, built once per worker and spec."""
+    from solver import SolarPlanner
+
+    key = (len(site["interval"]), site["B_c_min"], site["B_c_max"], site["B_charge_max"], site["B_discharge_max"])
+    if key not in _planners:
+        _planners[key] = SolarPlanner(len(site["interval"]), site["B_c_min"], site["B_c_max"],
+                                      site["B_charge_max"], site["B_discharge_max"], _backend, num_threads=1)
+    return _planners[key]
+
+
+def site_cost(site, energy_bought, energy_sold, soc):
+    """Objective of a site plan at the site's own prices, like the MILP objective."""
+    n = len(site["interval"])
+    P = np.array([site["P"][i] for i in site["interval"]], dtype=float)
+    B_end = soc[n - 1] * site["B_c_max"] / 100
+    return float(P @ energy_bought - site["P_solar"] * energy_sold.sum() - site["P_loaded"] * B_end)
+
+
+def _solve_sites(indices, import_price, export_price, import_limits=None, export_limits=None):
+    """
+    Solve some sites with the prices of the shared limits added. Runs in a worker.
+
+    Returns:
+        list: (site index, SolarResult, energy sold array, cost at own prices) per site,
+              result and energy sold are None if the site has no plan
+    """
+    rows = []
+    for k in indices:
+        site = _sites[k]
+        interval = site["interval"]
+        P = [site["P"][i] + import_price[n] for n, i in enumerate(interval)]
+        P_solar = [site["P_solar"] - export_price[n] for n in range(len(interval))]
+        C = [site["C"][i] for i in interval]
+        S = [site["S"][i] for i in interval]
+        import_max = None if import_limits is None else import_limits[k]
+        export_max = None if export_limits is None else export_limits[k]
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            if _backend == "DP":
+                result = solve_solar_dp(
+                    list(range(len(interval))), C, P, P_solar, S, site["B_c_initial"], site["B_c_min"],
+                    site["B_charge_max"], site["B_discharge_max"], site["B_c_max"], site["P_loaded"],
+                    site["battery_target_capacity"], site["mustLoadFirst"], site["min_battery_discharge"], 0,
+                    import_max=import_max, export_max=export_max,
+                )
+            else:
+                result = _planner(site).solve(
+                    C=C, P=P, S=S,
+                    B_c_initial=site["B_c_initial"],
+                    P_solar=P_solar,
+                    P_loaded=site["P_loaded"],
+                    import_max=import_max,
+                    export_max=export_max,
+                )
+        if not result:
+            rows.append((k, None, None, None))
+            continue
+
+        # the result carries the shifted prices, the costs use the site's own
+        result.price = np.array([site["P"][i] for i in interval], dtype=float)
+        rows.append((k, result, result.energy_sold,
+                     site_cost(site, result.energy_bought, result.energy_sold, result.soc)))
+    return rows
+
+
+def split_limit(limit, usage, share=0.1):
+    """
+    Split a shared limit per period between the sites.
+
+    Every site gets share of the limit in equal parts and the rest in
+    proportion to its usage in the last plan. The shares are rounded down, so
+    they never add up to more than the limit.
+
+    Args:
+        limit: Shared limit per period (Wh), array of length horizon
+        usage: Usage per site and period (Wh), array sites x horizon
+
+    Returns:
+        np.ndarray: Limit per site and period (Wh), integer valued
+    """
+    n_sites = usage.shape[0]
+    total = usage.sum(axis=0)
+    proportional = np.divide(usage, total, out=np.full_like(usage, 1 / n_sites), where=total > 0)
+    return np.floor(limit * ((1 - share) * proportional + share / n_sites))
+
+
+class FleetRun:
+    """
+    Runs the parallel site solves of one fleet optimization.
+
+    Args:
+        sites: List of solve_solar keyword arguments (see dataset.build_inputs), same horizon for all
+        backend: "DP", "CBC" or "SCIP"
+        workers: Number of processes, None for one per core
+        chunk_size: Sites per task, None for about four tasks per worker
+    """
+
+    def __init__(self, sites, backend="DP", workers=None, chunk_size=None):
+        self.sites = sites
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(sites, backend)
+        )
+        workers = workers or os.cpu_count() or 1
+        chunk_size = chunk_size or max(1, len(sites) // (4 * workers))
+        self.chunks = [list(range(k, min(k + chunk_size, len(sites)))) for k in range(0, len(sites), chunk_size)]
+
+    def solve(self, import_price, export_price, import_limits=None, export_limits=None):
+        """Solve all sites, returns the rows of _solve_sites() ordered by site."""
+        futures = [self.pool.submit(_solve_sites, chunk, import_price, export_price, import_limits, export_limits)
+                   for chunk in self.chunks]
+        rows = [row for future in futures for row in future.result()]
+        return sorted(rows, key=lambda row: row[0])
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def site_usage(rows, horizon, direction):
+    """Import or export per site and period (Wh), zero for sites without a plan."""
+    usage = np.zeros((len(rows), horizon))
+    for n, (_, result, energy_sold, _) in enumerate(rows):
+        if result is not None:
+            usage[n] = result.energy_bought if direction == "import" else energy_sold
+    return usage
+
+
+def fleet_totals(rows, horizon):
+    """Summed import and export per period and the summed cost of all sites with a plan."""
+    imports = np.zeros(horizon)
+    exports = np.zeros(horizon)
+    cost = 0.0
+    for _, result, energy_sold, site_cost_value in rows:
+        if result is None:
+            continue
+        imports += result.energy_bought
+        exports += energy_sold
+        cost += site_cost_value
+    return imports, exports, cost
+
+
+def best_violation(best, import_limit, export_limit):
+    """Largest violation of the shared limits (Wh) of a (rows, cost, imports, exports) plan."""
+    _, _, imports, exports = best
+    violation = max(float((imports - import_limit).max()), 0.0)
+    if export_limit is not None:
+        violation = max(violation, float((exports - export_limit).max()))
+    return violation
+
+
+def solve_fleet(sites, import_max, export_max=None, backend="DP", workers=None, max_iterations=30,
+                step_size=0.5, tolerance=0.0, recovery_rounds=3, chunk_size=None, printEnabled=0):
+    """
+    Coordinate the sites so the summed grid import (and export) per period
+    stays within the shared limits.
+
+    Args:
+        sites: List of solve_solar keyword arguments, one per site, same horizon for all
+        import_max: Shared import limit per period (Wh), a number or one value per period
+        export_max: Shared export limit per period (Wh), None for no limit
+        backend: "DP" (default, the same runtime for every site), "CBC" or "SCIP"
+        workers: Number of processes, None for one per core
+        max_iterations: Maximum number of price updates
+        step_size: Price step for a violation as large as the limit, relative to the mean grid price
+        tolerance: Violation of the limit (Wh) which is accepted
+        recovery_rounds: Maximum number of solves with split limits, if the prices do not converge.
+            With 0 the plans of the last iteration are returned with status 'violated'
+        chunk_size: Sites per task, None for about four tasks per worker
+        printEnabled: Print the iteration trace
+
+    Returns:
+        dict: 'results' (SolarResult per site, None without plan), 'status'
+              ('converged', 'recovered' or 'violated'), 'imports', 'exports',
+              'import_price', 'export_price', 'cost', 'max_violation' and
+              'trace' (one dict per iteration). 'dual_value' in the trace is the
+              Lagrangian value at the plans of the iteration, 'dual_bound' the
+              same value as lower bound of the fleet cost, None unless all sites
+              were solved to optimality by a MILP backend
+    """
+    horizon = len(sites[0]["interval"])
+    if any(len(site["interval"]) != horizon for site in sites):
+        raise ValueError("Alle Standorte brauchen den gleichen Horizont")
+    if recovery_rounds < 0:
+        raise ValueError("recovery_rounds darf nicht negativ sein")
+
+    import_limit = np.broadcast_to(np.asarray(import_max, dtype=float), (horizon,))
+    export_limit = None if export_max is None else np.broadcast_to(np.asarray(export_max, dtype=float), (horizon,))
+
+    # a violation as large as the limit moves the price by step_size times the mean grid price
+    price_scale = np.mean([np.mean([site["P"][i] for i in site["interval"]]) for site in sites])
+    import_step = step_size * price_scale / max(float(import_limit.mean()), 1.0)
+    export_step = 0.0 if export_limit is None else step_size * price_scale / max(float(export_limit.mean()), 1.0)
+
+    import_price = np.zeros(horizon)
+    export_price = np.zeros(horizon)
+    trace = []
+    best = None
+    rows = None
+    # summed over all iterations, the average plan is much smoother than the last one
+    usage_import = np.zeros((len(sites), horizon))
+    usage_export = np.zeros((len(sites), horizon))
+    start = time.perf_counter()
+
+    run = FleetRun(sites, backend, workers, chunk_size)
+    try:
+        for iteration in range(max_iterations):
+            rows = run.solve(import_price, export_price)
+            imports, exports, cost = fleet_totals(rows, horizon)
+            usage_import += site_usage(rows, horizon, "import")
+            usage_export += site_usage(rows, horizon, "export")
+
+            import_violation = imports - import_limit
+            export_violation = np.zeros(horizon) if export_limit is None else exports - export_limit
+            max_violation = float(max(import_violation.max(), export_violation.max(), 0.0))
+            # value of the Lagrangian relaxation at the current plans, a lower bound of the
+            # fleet cost only if every site plan is optimal: the DP and failed sites give an estimate
+            dual_value = float(sum(row[3] for row in rows if row[1] is not None)
+                               + import_price @ np.nan_to_num(import_violation, neginf=0.0)
+                               + export_price @ export_violation)
+            exact = backend != "DP" and all(row[1] is not None and row[1].status == "OPTIMAL" for row in rows)
+
+            trace.append({
+                "iteration": iteration,
+                "seconds": time.perf_counter() - start,
+                "cost": cost,
+                "dual_value": dual_value,
+                "dual_bound": dual_value if exact else None,
+                "max_violation": max_violation,
+                "violated_periods": int(np.sum((import_violation > tolerance) | (export_violation > tolerance))),
+                "max_import_price": float(import_price.max()),
+                "max_export_price": float(export_price.max()),
+                "failed_sites": sum(1 for row in rows if row[1] is None),
+            })
+            if printEnabled:
+                print(format_trace(trace[-1]), flush=True)
+
+            if max_violation <= tolerance and (best is None or cost < best[1]):
+                best = (rows, cost, imports, exports)
+            if max_violation <= tolerance:
+                break
+
+            step = 1 / np.sqrt(iteration + 1)
+            import_price = np.maximum(0.0, import_price + step * import_step * import_violation)
+            if export_limit is not None:
+                export_price = np.maximum(0.0, export_price + step * export_step * export_violation)
+
+        status = "converged"
+        if best is None:
+            # split the limits by the average plans and solve every site once more within its share
+            import_limits = split_limit(import_limit, usage_import)
+            export_limits = None if export_limit is None else split_limit(export_limit, usage_export)
+            previous = rows
+            best_rank = None
+            for recovery in range(recovery_rounds):
+                recovered = run.solve(np.zeros(horizon), np.zeros(horizon), import_limits, export_limits)
+                # a site without a plan within its share keeps its previous plan
+                recovered = [new if new[1] is not None else old for new, old in zip(recovered, previous)]
+                imports, exports, cost = fleet_totals(recovered, horizon)
+                max_violation = float(max((imports - import_limit).max(),
+                                          0.0 if export_limit is None else (exports - export_limit).max(), 0.0))
+                trace.append({
+                    "iteration": f"recovery {recovery}",
+                    "seconds": time.perf_counter() - start,
+                    "cost": cost,
+                    "dual_value": None,
+                    "dual_bound": None,
+                    "max_violation": max_violation,
+                    "violated_periods": int(np.sum(imports - import_limit > tolerance)),
+                    "max_import_price": 0.0,
+                    "max_export_price": 0.0,
+                    "failed_sites": sum(1 for row in recovered if row[1] is None),
+                })
+                if printEnabled:
+                    print(format_trace(trace[-1]), flush=True)
+
+                # a round is kept for a smaller violation first, then for lower cost
+                rank = (max(max_violation - tolerance, 0.0), cost)
+                if best is not None and rank >= best_rank:
+                    break
+                best = (recovered, cost, imports, exports)
+                best_rank = rank
+                previous = recovered
+
+                # every site keeps room for its plan and gets an equal part of the unused limit,
+                # so the next round can only make the sites cheaper
+                import_limits = (site_usage(recovered, horizon, "import")
+                                 + np.floor(np.maximum(import_limit - imports, 0) / len(sites)))
+                if export_limit is not None:
+                    export_limits = (site_usage(recovered, horizon, "export")
+                                     + np.floor(np.maximum(export_limit - exports, 0) / len(sites)))
+            if best is None:
+                # no recovery round: the plans of the last iteration
+                imports, exports, cost = fleet_totals(rows, horizon)
+                best = (rows, cost, imports, exports)
+            status = "recovered" if best_violation(best, import_limit, export_limit) <= tolerance else "violated"
+    finally:
+        run.close()
+
+    rows, cost, imports, exports = best
+    return {
+        "results": [row[1] for row in rows],
+        "status": status,
+        "imports": imports,
+        "exports": exports,
+        "import_price": import_price,
+        "export_price": export_price,
+        "cost": cost,
+        "max_violation": best_violation(best, import_limit, export_limit),
+        "trace": trace,
+    }
+
+
+def format_trace(row):
+    def value(name, fmt):
+        v = row[name]
+        return "-" if v is None else format(v, fmt)
+    return (f"{row['iteration']!s:>9s}{value('seconds', '.1f'):>8s}{value('cost', '.0f'):>14s}"
+            f"{value('dual_bound', '.0f'):>14s}{value('max_violation', '.0f'):>10s}{row['violated_periods']:>6d}"
+            f"{value('max_import_price', '.0f'):>8s}{row['failed_sites']:>6d}")
+
+
+def synthetic_sites(n_sites, seed=0, horizon=96):
+    """
+    Sites with different loads, PV and SOC on the same day-ahead prices, in
+    the units of solve_solar.
+    """
+    from dataset import build_inputs
+
+    rng = np.random.default_rng(seed)
+    interval = list(range(horizon))
+    hours = (np.arange(horizon) % 96) / 4
+    values_kosten = 30 + 12 * np.exp(-((hours - 8) / 1.5) ** 2) + 18 * np.exp(-((hours - 18.5) / 2) ** 2) \
+        + rng.normal(0, 1.5, horizon)
+
+    sites = []
+    for _ in range(n_sites):
+        pv_size = rng.uniform(0, 1.5)
+        values_pv = np.clip(pv_size * np.exp(-((hours - 12.5) / 2.5) ** 2) - 0.02, 0, None)
+        appliances = rng.random(horizon) < 0.25
+        energyConsumption = -(0.1 + 0.8 * appliances * rng.random(horizon) + 0.1 * np.exp(-((hours - 19) / 2) ** 2))
+        parameters = {
+            "battery_max_capacity": int(rng.choice([5000, 10000, 15000])),
+            "battery_charge_power": int(rng.choice([500, 1000])),
+            "battery_discharge_power": 1000,
+        }
+        sites.append(build_inputs(interval, energyConsumption.round(3).tolist(), values_kosten.round(2).tolist(),
+                                  values_pv.round(3).tolist(), rng.uniform(35, 90), parameters))
+    return sites
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fleet optimization with a shared grid limit on synthetic sites")
+    parser.add_argument("--sites", type=int, default=20)
+    parser.add_argument("--import-max", type=float, default=None, help="Wh per period, default 40%% of the uncoordinated peak")
+    parser.add_argument("--export-max", type=float, default=None, help="Wh per period")
+    parser.add_argument("--backend", default="DP")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--step", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sites = synthetic_sites(args.sites, args.seed)
+
+    import_max = args.import_max
+    if import_max is None:
+        # uncoordinated plans, one iteration without limit
+        free = solve_fleet(sites, np.inf, backend=args.backend, workers=args.workers, max_iterations=1)
+        import_max = round(0.4 * free["imports"].max())
+        print(f"Unkoordinierte Spitze {free['imports'].max():.0f} Wh, Grenze {import_max} Wh")
+
+    print(f"{'Iter':>9s}{'Sek':>8s}{'Kosten':>14s}{'Schranke':>14s}{'Verl.':>10s}{'Per.':>6s}{'Preis':>8s}{'Fehl':>6s}")
+    fleet = solve_fleet(sites, import_max, args.export_max, backend=args.backend, workers=args.workers,
+                        max_iterations=args.iterations, step_size=args.step, printEnabled=1)
+    print(f"\n{args.sites} Standorte: {fleet['status']}, Spitze {fleet['imports'].max():.0f} Wh "
+          f"(Grenze {import_max} Wh), Kosten {fleet['cost']:.0f}")
@@ -0,0 +1,488 @@
+"""
+Append-only columnar history of inputs, plans and realized data.
+
+The day folders hold one or two days each, without year in the name. The
+history keeps all of them in one store, partitioned by site, table and
+month, one raw binary file per column:
+
+    <root>/index.json                          sites, partitions, time range and rows per partition
+    <root>/<site>/series/2026-01/time.bin      slot start (int64 minutes since 1970)
+    <root>/<site>/series/2026-01/price.bin     ct/kWh, pv / consumption in kWh per slot, ...
+    <root>/<site>/plans/2026-01/...            one row per planned slot of every solve_solar plan
+
+Tables (TABLES):
+
+- series: per 15 minute slot the price, PV and consumption of the logs and
+  the SOC / grid import of the existing controller (socneu / bezugneu of log.log)
+- plans: every plan recorded with record_plan() or solve_solar(history=store),
+  one row per slot with the plan id (creation time), its start, status and objective
+
+Appending writes the new rows at the end of the column files first and then
+the row count into index.json (atomically), so an interrupted append is
+never visible and its rest is cut off by the next append. There is one
+writer at a time. Reads memory map the column files and only open the
+partitions which overlap the date range, a scan over months therefore never
+builds Python lists:
+
+    store = HistoryStore(".history")
+    import_folders(store, ".")                                  # the day folders, once
+    for part in store.scan("series", start="2026-01", end="2026-02", columns=("time", "price")):
+        part["price"]                                           # read-only view of the memory map
+    data = store.read("series", start="2026-01-19", end="2026-01-20")
+    rows = daily_summary(store)                                 # e.g. days with negative prices
+
+    python history.py import .                    # import the day folders below .
+    python history.py days --negative             # days with negative prices
+    python history.py info                        # sites, tables and partitions
+"""
+
+import argparse
+import datetime
+import json
+import os
+
+import numpy as np
+
+from dataset import find_day_folders, load_day, read_start_time
+from timegrid import BASE_MINUTES, slot_starts
+
+INDEX_VERSION = 1
+
+# columns and dtypes of every table, "time" is the slot start in minutes since 1970
+TABLES = {
+    "series": (
+        ("time", "<i8"),
+        ("price", "<f8"),
+        ("pv", "<f8"),
+        ("consumption", "<f8"),
+        ("soc", "<f8"),
+        ("bezug", "<f8"),
+    ),
+    "plans": (
+        ("time", "<i8"),
+        ("plan", "<i8"),
+        ("created", "<i8"),
+        ("minutes", "<i4"),
+        ("status", "<i1"),
+        ("objective", "<f8"),
+        ("soc", "<f8"),
+        ("energy_bought", "<f8"),
+        ("energy_sold", "<f8"),
+        ("battery_charge", "<f8"),
+        ("battery_discharge", "<f8"),
+        ("outside_to_battery", "<f8"),
+        ("solar_to_battery", "<f8"),
+        ("solar_energy", "<f8"),
+        ("consumption", "<f8"),
+        ("price", "<f8"),
+        ("is_charging", "<f8"),
+        ("is_discharging", "<f8"),
+    ),
+}
+
+# status of a plan as small integer in the plans table
+STATUS_CODES = ("OPTIMAL", "FEASIBLE", "HEURISTIC", "INFEASIBLE", "UNBOUNDED", "ABNORMAL", "MODEL_INVALID",
+                "NOT_SOLVED", "DISCRETIZED")
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def to_minutes(value):
+    """
+    Minutes since 1970 of a date, None stays None.
+
+    Args:
+        value: datetime, np.datetime64 or string like "2026-01", "2026-01-19" or "2026-01-19 06:00"
+
+    Returns:
+        int: Minutes since 1970
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip().replace(" ", "T")
+    return int(np.datetime64(value, "m").astype(np.int64))
+
+
+def to_datetime64(minutes):
+    """Minutes since 1970 (the time column) as np.datetime64[m]."""
+    return np.asarray(minutes, dtype=np.int64).astype("datetime64[m]")
+
+
+class HistoryStore:
+    """
+    Columnar store in a directory, see the module docstring.
+
+    Args:
+        root: Directory of the store, created on the first append
+        site: Site used when append() / scan() get no site
+    """
+
+    def __init__(self, root, site="default"):
+        self.root = root
+        self.site = site
+        self.index = self._read_index()
+
+    # ------------------------------------------------------------- index
+
+    def _index_path(self):
+        return os.path.join(self.root, "index.json")
+
+    def _read_index(self):
+        try:
+            with open(self._index_path()) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {"version": INDEX_VERSION, "sites": {}, "sources": {}}
+        if index.get("version") != INDEX_VERSION:
+            raise ValueError(f"{self._index_path()}: Version {index.get('version')} wird nicht unterstützt")
+        return index
+
+    def _write_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._index_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(tmp, self._index_path())
+
+    def sites(self):
+        """Names of all sites in the store."""
+        return sorted(self.index["sites"])
+
+    def partitions(self, table, site=None, start=None, end=None):
+        """
+        Partitions of a table which overlap [start, end).
+
+        Returns:
+            list: (month, entry of index.json with 'rows', 'start', 'end', 'sorted'), sorted by month
+        """
+        start, end = to_minutes(start), to_minutes(end)
+        entries = self.index["sites"].get(site or self.site, {}).get(table, {})
+        return [(month, entry) for month, entry in sorted(entries.items())
+                if entry["rows"] and (start is None or entry["end"] >= start) and (end is None or entry["start"] < end)]
+
+    def _folder(self, table, site, month):
+        return os.path.join(self.root, site, table, month)
+
+    # ------------------------------------------------------------- write
+
+    def append(self, table, columns, site=None):
+        """
+        Append rows to a table, split into the month partitions of their time.
+
+        Args:
+            table: Name in TABLES
+            columns: Column name to array, all columns of the table with the same length
+            site: Site of the rows, None for self.site
+
+        Returns:
+            int: Number of appended rows
+        """
+        site = site or self.site
+        names = [name for name, _ in TABLES[table]]
+        missing = [name for name in names if name not in columns]
+        if missing:
+            raise ValueError(f"Spalten fehlen für {table}: {', '.join(missing)}")
+        arrays = {name: np.asarray(columns[name], dtype=dtype) for name, dtype in TABLES[table]}
+        lengths = {len(values) for values in arrays.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"Spalten von {table} haben verschiedene Längen: {sorted(lengths)}")
+        if not lengths.pop():
+            return 0
+
+        months = to_datetime64(arrays["time"]).astype("datetime64[M]")
+        entries = self.index["sites"].setdefault(site, {}).setdefault(table, {})
+        for month in np.unique(months):
+            rows = months == month
+            key = str(month)
+            entry = entries.setdefault(key, {"rows": 0, "start": None, "end": None, "sorted": True})
+            folder = self._folder(table, site, key)
+            os.makedirs(folder, exist_ok=True)
+            time = arrays["time"][rows]
+            for name, dtype in TABLES[table]:
+                with open(os.path.join(folder, name + ".bin"), "ab") as f:
+                    # the rest of an interrupted append is cut off first
+                    f.truncate(entry["rows"] * np.dtype(dtype).itemsize)
+                    f.write(arrays[name][rows].tobytes())
+            in_order = bool(np.all(np.diff(time) >= 0) and (entry["end"] is None or time[0] >= entry["end"]))
+            entry["sorted"] = entry["sorted"] and in_order
+            entry["start"] = int(time.min()) if entry["start"] is None else min(entry["start"], int(time.min()))
+            entry["end"] = int(time.max()) if entry["end"] is None else max(entry["end"], int(time.max()))
+            entry["rows"] += int(rows.sum())
+        # the rows only count once the index is written
+        self._write_index()
+        return len(arrays["time"])
+
+    # ------------------------------------------------------------- read
+
+    def columns(self, table, month, site=None, columns=None):
+        """
+        All rows of one partition, per column a read-only view of the memory
+        mapped file (no copy).
+        """
+        site = site or self.site
+        entry = self.index["sites"][site][table][month]
+        folder = self._folder(table, site, month)
+        dtypes = dict(TABLES[table])
+        result = {}
+        for name in columns or dtypes:
+            # plain ndarray view of the memory map, like dataset.load_day_cached()
+            result[name] = np.asarray(np.memmap(os.path.join(folder, name + ".bin"), dtype=dtypes[name], mode="r",
+                                                shape=(entry["rows"],)))
+        return result
+
+    def scan(self, table, site=None, start=None, end=None, columns=None):
+        """
+        Rows of [start, end) partition by partition.
+
+        In partitions appended in time order the range is a slice of the
+        memory maps (views), otherwise the rows are selected with a mask (copies).
+
+        Args:
+            table: Name in TABLES
+            site: Site, None for self.site
+            start, end: Date range, see to_minutes(), None for no limit
+            columns: Column names, None for all ("time" is always included)
+
+        Yields:
+            dict: Column name to array, for every partition with rows in the range
+        """
+        site = site or self.site
+        start_minutes, end_minutes = to_minutes(start), to_minutes(end)
+        if columns is not None and "time" not in columns:
+            columns = ("time",) + tuple(columns)
+        for month, entry in self.partitions(table, site, start, end):
+            part = self.columns(table, month, site, columns)
+            time = part["time"]
+            inside_start = start_minutes is None or entry["start"] >= start_minutes
+            inside_end = end_minutes is None or entry["end"] < end_minutes
+            if inside_start and inside_end:
+                selection = slice(None)
+            elif entry["sorted"]:
+                low = 0 if start_minutes is None else np.searchsorted(time, start_minutes, "left")
+                high = len(time) if end_minutes is None else np.searchsorted(time, end_minutes, "left")
+                selection = slice(low, high)
+            else:
+                selection = np.ones(len(time), dtype=bool)
+                if start_minutes is not None:
+                    selection &= time >= start_minutes
+                if end_minutes is not None:
+                    selection &= time < end_minutes
+            part = {name: values[selection] for name, values in part.items()}
+            if len(part["time"]):
+                yield part
+
+    def read(self, table, site=None, start=None, end=None, columns=None):
+        """Rows of [start, end) of all partitions in one array per column, see scan()."""
+        parts = list(self.scan(table, site, start, end, columns))
+        names = [name for name, _ in TABLES[table] if columns is None or name == "time" or name in columns]
+        if not parts:
+            dtypes = dict(TABLES[table])
+            return {name: np.empty(0, dtype=dtypes[name]) for name in names}
+        return {name: np.concatenate([part[name] for part in parts]) for name in names}
+
+    def times(self, table, site=None, start=None, end=None):
+        """Time column of [start, end), e.g. to skip rows which are already stored."""
+        return self.read(table, site, start, end, columns=("time",))["time"]
+
+
+# ----------------------------------------------------------------- import / record
+
+def import_folder(store, folderName, site=None):
+    """
+    Import one day folder (netztarif.log, verbrauch.log, pv.log, log.log)
+    into the series table. The time comes from the first line of
+    netztarif.log, slots which are already in the store (e.g. 19.01 and
+    19.20.01 overlap) are skipped, so importing again adds nothing.
+
+    Returns:
+        int: Number of new rows
+    """
+    start = read_start_time(os.path.join(folderName, "netztarif.log"))
+    if start is None:
+        return 0
+    day = load_day(folderName)
+    n = len(day["interval"])
+    time = to_minutes(start) + BASE_MINUTES * np.arange(n, dtype=np.int64)
+
+    def controller(values):
+        # socneu / bezugneu start with the day, missing values are NaN
+        column = np.full(n, np.nan)
+        values = np.asarray(values, dtype=float)[:n]
+        column[:len(values)] = values
+        return column
+
+    columns = {
+        "time": time,
+        "price": day["values_kosten"],
+        "pv": day["values_pv"],
+        "consumption": day["energyConsumption"],
+        "soc": controller(day["soc_bestehend"]),
+        "bezug": controller(day["bezug_bestehend"]),
+    }
+    new = ~np.isin(time, store.times("series", site, int(time[0]), int(time[-1]) + 1))
+    sources = store.index["sources"].setdefault(site or store.site, [])
+    if os.path.abspath(folderName) not in sources:
+        sources.append(os.path.abspath(folderName))
+    if not new.any():
+        store._write_index()
+        return 0
+    return store.append("series", {name: np.asarray(values)[new] for name, values in columns.items()}, site)
+
+
+def import_folders(store, root=".", site=None):
+    """Import all day folders below root, see import_folder()."""
+    return {folderName: import_folder(store, folderName, site) for folderName in find_day_folders(root)}
+
+
+def record_plan(store, result, start, site=None, durations=None, created=None):
+    """
+    Append a plan of solve_solar to the plans table.
+
+    Args:
+        store: HistoryStore
+        result: SolarResult, a result without plan is not recorded
+        start: Start of the first period (datetime or see to_minutes())
+        site: Site, None for store.site
+        durations: Slot durations in minutes (see timegrid.py), None for 15 minute slots
+        created: Time of the plan, None for now; also the plan id (ms since 1970)
+
+    Returns:
+        int: Plan id, None if the result has no plan
+    """
+    if not result:
+        return None
+    n = len(result.soc)
+    durations = np.full(n, BASE_MINUTES) if durations is None else np.asarray(durations)
+    created = datetime.datetime.now() if created is None else created
+    plan = int(np.datetime64(created, "ms").astype(np.int64))
+    status = STATUS_CODES.index(result.status) if result.status in STATUS_CODES else -1
+
+    def optional(values):
+        return np.full(n, np.nan) if values is None else values
+
+    columns = {
+        "time": to_minutes(start) + slot_starts(durations).astype(np.int64),
+        "plan": np.full(n, plan),
+        "created": np.full(n, to_minutes(created)),
+        "minutes": durations,
+        "status": np.full(n, status),
+        "objective": np.full(n, np.nan if result.objective is None else result.objective),
+        "energy_sold": optional(result.energy_sold),
+        "consumption": optional(result.consumption),
+        "price": optional(result.price),
+    }
+    for name in ("soc", "energy_bought", "battery_charge", "battery_discharge", "outside_to_battery",
+                 "solar_to_battery", "solar_energy", "is_charging", "is_discharging"):
+        columns[name] = getattr(result, name)
+    store.append("plans", columns, site)
+    return plan
+
+
+# ----------------------------------------------------------------- analytics
+
+def day_matrix(store, column, start=None, end=None, site=None, table="series"):
+    """
+    One row of 96 slots per day of [start, end), e.g. as C / S / P of
+    backtest.simulate(). Slots without data are NaN.
+
+    Returns:
+        tuple: (days as np.datetime64[D], days x 96 array)
+    """
+    slots = MINUTES_PER_DAY // BASE_MINUTES
+    data = store.read(table, site, start, end, columns=(column,))
+    if not len(data["time"]):
+        return np.empty(0, dtype="datetime64[D]"), np.empty((0, slots))
+    day = data["time"] // MINUTES_PER_DAY
+    first = day.min()
+    matrix = np.full((day.max() - first + 1, slots), np.nan)
+    matrix[day - first, (data["time"] % MINUTES_PER_DAY) // BASE_MINUTES] = data[column]
+    days = (first + np.arange(len(matrix))).astype("datetime64[D]")
+    return days, matrix
+
+
+def daily_summary(store, start=None, end=None, site=None):
+    """
+    Aggregates of the series table per day, computed partition by partition.
+
+    Returns:
+        list: One dict per day with 'day', 'slots', 'price_min', 'price_mean',
+              'negative_slots', 'pv_kwh', 'consumption_kwh' (positive) and 'bezug_kwh'
+    """
+    totals = {}
+    for part in store.scan("series", site, start, end, columns=("price", "pv", "consumption", "bezug")):
+        day = part["time"] // MINUTES_PER_DAY
+        days, index = np.unique(day, return_inverse=True)
+        price_min = np.full(len(days), np.inf)
+        np.minimum.at(price_min, index, part["price"])
+        sums = {
+            "slots": np.bincount(index, minlength=len(days)),
+            "price_sum": np.bincount(index, part["price"], len(days)),
+            "negative_slots": np.bincount(index, part["price"] < 0, len(days)),
+            "pv_kwh": np.bincount(index, part["pv"], len(days)),
+            "consumption_kwh": np.bincount(index, -part["consumption"], len(days)),
+            "bezug_kwh": np.bincount(index, np.nan_to_num(part["bezug"]), len(days)),
+        }
+        for k, value in enumerate(days.tolist()):
+            row = totals.setdefault(value, {"price_min": np.inf, **{name: 0.0 for name in sums}})
+            row["price_min"] = min(row["price_min"], float(price_min[k]))
+            for name, values in sums.items():
+                row[name] += float(values[k])
+
+    rows = []
+    for value, row in sorted(totals.items()):
+        rows.append({
+            "day": str(np.datetime64(value, "D")),
+            "slots": int(row["slots"]),
+            "price_min": row["price_min"],
+            "price_mean": row["price_sum"] / row["slots"],
+            "negative_slots": int(row["negative_slots"]),
+            "pv_kwh": row["pv_kwh"],
+            "consumption_kwh": row["consumption_kwh"],
+            "bezug_kwh": row["bezug_kwh"],
+        })
+    return rows
+
+
+def format_days(rows):
+    lines = [f"{'Tag':12s}{'Slots':>6s}{'Preis min':>10s}{'Mittel':>8s}{'neg.':>6s}{'PV kWh':>8s}"
+             f"{'Verbr. kWh':>11s}{'Bezug kWh':>10s}"]
+    for row in rows:
+        lines.append(f"{row['day']:12s}{row['slots']:6d}{row['price_min']:10.2f}{row['price_mean']:8.2f}"
+                     f"{row['negative_slots']:6d}{row['pv_kwh']:8.2f}{row['consumption_kwh']:11.2f}"
+                     f"{row['bezug_kwh']:10.2f}")
+    return "\n".join(lines)
+
+
+def format_info(store):
+    lines = []
+    for site in store.sites():
+        for table in TABLES:
+            for month, entry in store.partitions(table, site):
+                lines.append(f"{site:12s}{table:8s}{month:9s}{entry['rows']:8d}  "
+                             f"{to_datetime64(entry['start'])} - {to_datetime64(entry['end'])}")
+    return "\n".join(lines) or "Keine Daten"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar history of the day folders and plans")
+    parser.add_argument("command", choices=("import", "days", "info"))
+    parser.add_argument("root", nargs="?", default=".", help="folder with the day folders (import)")
+    parser.add_argument("--store", default=".history", help="directory of the store")
+    parser.add_argument("--site", default="default")
+    parser.add_argument("--start", help="e.g. 2026-01 or 2026-01-19")
+    parser.add_argument("--end", help="exclusive, e.g. 2026-02")
+    parser.add_argument("--negative", action="store_true", help="only days with negative prices")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.store, args.site)
+    if args.command == "import":
+        for folderName, rows in import_folders(store, args.root).items():
+            print(f"{folderName:12s}{rows:6d} neue Slots")
+    elif args.command == "days":
+        rows = daily_summary(store, args.start, args.end)
+        if args.negative:
+            rows = [row for row in rows if row["negative_slots"]]
+        print(format_days(rows))
+    else:
+        print(format_info(store))
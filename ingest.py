@@ -0,0 +1,451 @@
+"""
+Streaming ingestion of live feeds with asyncio.
+
+Feeds are read concurrently and kept as 15 minute slot aggregates:
+
+- price: day-ahead prices (ct/kWh), one line per publication
+- pv: PV forecast (kWh per slot), republished e.g. every hour
+- consumption: consumption forecast (kWh per slot), optional
+- meter: power of the meter (W), one line every few seconds
+- soc: measured state of charge of the battery (%)
+
+Every line has the format of the day folder logs:
+
+    2026-01-19 00:00:00 0.123 0.456 ...
+
+Price, pv and consumption lines hold consecutive 15 minute slots starting at
+the timestamp, meter and soc lines one value at that time. So a day folder can
+be replayed directly, see replay_day_folder() and
+
+    python ingest.py 19.01 --speed 3600
+
+solve_solar is only called again after the inputs settled for debounce_s
+seconds (at the latest after max_delay_s) and only if the current slot moved
+forward, new slots arrived or a price / energy of the horizon changed by more
+than the thresholds. The solve runs in a thread, so the feeds keep being read.
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from dataset import build_inputs, load_day
+
+SLOT = datetime.timedelta(minutes=15)
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# feeds with one value per slot starting at the timestamp
+SERIES_FEEDS = ("price", "pv", "consumption")
+
+
+def parse_line(line):
+    """
+    Split one feed line into timestamp and values.
+
+    Returns:
+        tuple: (datetime, list of floats), None for empty or malformed lines
+    """
+    parts = line.split()
+    if len(parts) < 3:
+        return None
+    try:
+        timestamp = datetime.datetime.strptime(parts[0] + " " + parts[1], TIME_FORMAT)
+        return timestamp, [float(x) for x in parts[2:]]
+    except ValueError:
+        return None
+
+
+def slot_start(timestamp):
+    """Start of the 15 minute slot containing timestamp."""
+    return timestamp.replace(minute=timestamp.minute - timestamp.minute % 15, second=0, microsecond=0)
+
+
+async def tail_file(filename, poll_interval=0.5):
+    """
+    Yield every complete line of filename, also the ones appended later
+    (like tail -f). The file may not exist yet. If it gets shorter (truncated
+    or replaced), it is read from the start again.
+    """
+    position = 0
+    buffer = ""
+    while True:
+        try:
+            if os.path.getsize(filename) < position:
+                position = 0
+                buffer = ""
+            with open(filename) as f:
+                f.seek(position)
+                data = f.read()
+                position = f.tell()
+        except FileNotFoundError:
+            data = ""
+
+        if not data:
+            await asyncio.sleep(poll_interval)
+            continue
+
+        buffer += data
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+
+
+class SlotAggregates:
+    """
+    Current view of all feeds, aggregated to 15 minute slots.
+
+    Args:
+        soc_percent: SOC until the first soc line arrives
+    """
+
+    def __init__(self, soc_percent=50):
+        self.series = {name: {} for name in SERIES_FEEDS}
+        # measured consumption (kWh) per slot from the meter
+        self.measured = {}
+        self.last_tick = None
+        self.soc_percent = soc_percent
+        # time of the latest meter or soc line
+        self.now = None
+
+    def update_series(self, name, timestamp, values):
+        """Store a published series, later publications overwrite earlier ones."""
+        slot = slot_start(timestamp)
+        target = self.series[name]
+        for k, value in enumerate(values):
+            target[slot + k * SLOT] = value
+
+    def add_meter(self, timestamp, watts):
+        """Integrate the meter power since the previous tick into the slot of that tick."""
+        if self.last_tick is not None and timestamp > self.last_tick[0]:
+            previous, previous_watts = self.last_tick
+            slot = slot_start(previous)
+            hours = (timestamp - previous).total_seconds() / 3600
+            self.measured[slot] = self.measured.get(slot, 0.0) + previous_watts * hours / 1000
+        self.last_tick = (timestamp, watts)
+        self.advance(timestamp)
+
+    def set_soc(self, timestamp, soc_percent):
+        self.soc_percent = soc_percent
+        self.advance(timestamp)
+
+    def advance(self, timestamp):
+        if self.now is None or timestamp > self.now:
+            self.now = timestamp
+
+    def current_slot(self):
+        """Slot of the latest measurement, the first known price slot before that."""
+        if self.now is not None:
+            return slot_start(self.now)
+        prices = self.series["price"]
+        return min(prices) if prices else None
+
+    def consumption(self, slot, current):
+        """
+        Consumption estimate of a slot (kWh). For the current slot the measured
+        part plus the forecast for the rest, without forecast the last measured
+        slot is repeated.
+        """
+        forecast = self.series["consumption"].get(slot)
+        if forecast is None:
+            previous = [s for s in self.measured if s < current]
+            forecast = self.measured[max(previous)] if previous else 0.0
+        if slot != current or self.now is None:
+            return forecast
+        elapsed = (self.now - current) / SLOT
+        return self.measured.get(current, 0.0) + forecast * (1 - elapsed)
+
+    def window(self, horizon):
+        """
+        Inputs from the current slot on, as far as prices are known.
+
+        Returns:
+            dict: slot -> (price ct/kWh, pv kWh, consumption kWh), empty without prices
+        """
+        current = self.current_slot()
+        window = {}
+        if current is None:
+            return window
+        for k in range(horizon):
+            slot = current + k * SLOT
+            price = self.series["price"].get(slot)
+            if price is None:
+                break
+            window[slot] = (price, self.series["pv"].get(slot, 0.0), self.consumption(slot, current))
+        return window
+
+
+def change_reason(old, new, price_threshold, energy_threshold):
+    """
+    Why the new window needs a new plan compared to the window of the last plan.
+
+    Args:
+        old: Window of the last solve, None if there was none
+        new: Current window
+        price_threshold: Maximum price change of a slot (ct/kWh) which is ignored
+        energy_threshold: Sum of PV and consumption changes over the horizon (kWh) which is ignored
+
+    Returns:
+        str: 'initial', 'slot', 'horizon', 'price' or 'energy', None if the plan is still good
+    """
+    if not new:
+        return None
+    if old is None:
+        return "initial"
+    if min(new) != min(old):
+        return "slot"
+    if any(slot not in old for slot in new):
+        return "horizon"
+
+    slots = list(new)
+    old_values = np.array([old[slot] for slot in slots])
+    new_values = np.array([new[slot] for slot in slots])
+    if np.max(np.abs(new_values[:, 0] - old_values[:, 0])) > price_threshold:
+        return "price"
+    if np.sum(np.abs(new_values[:, 1:] - old_values[:, 1:])) > energy_threshold:
+        return "energy"
+    return None
+
+
+class IngestPipeline:
+    """
+    Reads the feeds concurrently and re-optimizes when the inputs changed enough.
+
+    Args:
+        feeds: dict feed name ('price', 'pv', 'consumption', 'meter', 'soc')
+            -> async iterable of lines, e.g. tail_file()
+        on_plan: Optional callback(result, window, reason), called after every solve
+        horizon: Maximum number of slots per solve
+        parameters: Overrides for dataset.DEFAULT_PARAMETERS
+        soc_percent: SOC until the first soc line arrives
+        debounce_s: Quiet time after the last change before the inputs are checked
+        max_delay_s: Maximum wait for quiet feeds, e.g. with a meter ticking every few seconds
+        price_threshold: See change_reason()
+        energy_threshold: See change_reason()
+        backend: Backend for solve_solar
+    """
+
+    def __init__(self, feeds, on_plan=None, horizon=96, parameters=None, soc_percent=50,
+                 debounce_s=2.0, max_delay_s=10.0, price_threshold=0.5, energy_threshold=0.2,
+                 backend="CBC"):
+        self.feeds = feeds
+        self.on_plan = on_plan
+        self.horizon = horizon
+        self.parameters = parameters
+        self.debounce_s = debounce_s
+        self.max_delay_s = max_delay_s
+        self.price_threshold = price_threshold
+        self.energy_threshold = energy_threshold
+        self.backend = backend
+
+        self.state = SlotAggregates(soc_percent)
+        self.changed = asyncio.Event()
+        self.last_window = None
+        self.result = None
+        self.stats = {"lines": 0, "checks": 0, "solves": 0, "skipped": 0, "solve_seconds": 0.0}
+
+    def ingest(self, name, line):
+        """Apply one line of a feed to the aggregates."""
+        parsed = parse_line(line)
+        if parsed is None:
+            return False
+        timestamp, values = parsed
+        if name in SERIES_FEEDS:
+            self.state.update_series(name, timestamp, values)
+        elif name == "meter":
+            self.state.add_meter(timestamp, values[0])
+        elif name == "soc":
+            self.state.set_soc(timestamp, values[0])
+        else:
+            raise ValueError(f"Unbekannter Feed: {name}")
+        self.stats["lines"] += 1
+        return True
+
+    async def consume(self, name, lines):
+        async for line in lines:
+            if self.ingest(name, line):
+                self.changed.set()
+
+    async def settle(self):
+        """Wait until no line arrived for debounce_s, at most max_delay_s."""
+        loop = asyncio.get_running_loop()
+        first = loop.time()
+        while True:
+            self.changed.clear()
+            remaining = self.max_delay_s - (loop.time() - first)
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(self.changed.wait(), min(self.debounce_s, remaining))
+            except asyncio.TimeoutError:
+                return
+
+    def solve(self, window):
+        """Run solve_solar for a window, blocking."""
+        from solver import solve_solar
+
+        interval = list(range(len(window)))
+        values = list(window.values())
+        inputs = build_inputs(
+            interval,
+            [v[2] for v in values],
+            [v[0] for v in values],
+            [v[1] for v in values],
+            self.state.soc_percent,
+            self.parameters,
+        )
+        return solve_solar(**inputs, backend=self.backend)
+
+    async def check(self):
+        """Re-optimize if the current window differs enough from the last solved one."""
+        self.stats["checks"] += 1
+        window = self.state.window(self.horizon)
+        reason = change_reason(self.last_window, window, self.price_threshold, self.energy_threshold)
+        if reason is None:
+            self.stats["skipped"] += 1
+            return
+
+        start = time.perf_counter()
+        result = await asyncio.to_thread(self.solve, window)
+        self.stats["solve_seconds"] += time.perf_counter() - start
+        self.stats["solves"] += 1
+        self.last_window = window
+        self.result = result
+        if self.on_plan:
+            self.on_plan(result, window, reason)
+
+    async def optimizer(self):
+        while True:
+            await self.changed.wait()
+            await self.settle()
+            await self.check()
+
+    async def run(self):
+        """
+        Run until all feeds are finished (file tails never finish, cancel the
+        task to stop). The last inputs are checked once more at the end.
+        """
+        optimizer = asyncio.create_task(self.optimizer())
+        try:
+            await asyncio.gather(*(self.consume(name, lines) for name, lines in self.feeds.items()))
+        finally:
+            optimizer.cancel()
+            try:
+                await optimizer
+            except asyncio.CancelledError:
+                pass
+        await self.check()
+        return self.stats
+
+
+def format_line(timestamp, values):
+    return timestamp.strftime(TIME_FORMAT) + " " + " ".join(f"{v:.3f}" for v in values) + "\n"
+
+
+async def replay_day_folder(folderName, directory, speed=3600, tick_s=60, pv_update_slots=4,
+                            pv_error=0.1, seed=0, plan_soc=None):
+    """
+    Stand-in for the live feeds: writes the values of a day folder into
+    price.log, pv.log, consumption.log, meter.log and soc.log in directory,
+    in data time running speed times faster than real time.
+
+    Prices and the consumption forecast are published at the start. The PV
+    forecast is republished every pv_update_slots slots with a relative error
+    of pv_error for the future slots. The meter ticks every tick_s seconds
+    with the power of the consumption of its slot.
+
+    Args:
+        plan_soc: Optional callable returning the planned SOC at the next
+            slot boundary, written to soc.log (the battery follows the plan)
+    """
+    day = load_day(folderName)
+    n = len(day["interval"])
+    start = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    with open(os.path.join(folderName, "netztarif.log")) as f:
+        parsed = parse_line(f.readline())
+        if parsed:
+            start = parsed[0]
+
+    rng = np.random.default_rng(seed)
+    pv = np.asarray(day["values_pv"])
+    consumption = np.abs(np.asarray(day["energyConsumption"]))
+
+    def write(name, line):
+        with open(os.path.join(directory, name + ".log"), "a") as f:
+            f.write(line)
+
+    write("price", format_line(start, day["values_kosten"]))
+    write("consumption", format_line(start, consumption))
+    write("soc", format_line(start, [day["battery_soc_initial"]]))
+
+    ticks_per_slot = int(SLOT.total_seconds() // tick_s)
+    for k in range(n):
+        slot = start + k * SLOT
+        if k % pv_update_slots == 0:
+            forecast = pv[k:] * (1 + pv_error * rng.standard_normal(n - k))
+            write("pv", format_line(slot, np.maximum(forecast, 0)))
+        if k > 0 and plan_soc is not None and plan_soc() is not None:
+            write("soc", format_line(slot, [plan_soc()]))
+        watts = consumption[k] * 4000
+        for t in range(ticks_per_slot):
+            write("meter", format_line(slot + datetime.timedelta(seconds=t * tick_s), [watts]))
+            await asyncio.sleep(tick_s / speed)
+    write("meter", format_line(start + n * SLOT, [0]))
+
+
+async def replay(folderName, speed, tick_s, horizon, backend, debounce_s, max_delay_s):
+    from batteryCommands.custom import generate_commands
+
+    with tempfile.TemporaryDirectory() as directory:
+        plan = {}
+
+        def on_plan(result, window, reason):
+            first = min(window)
+            command = "-"
+            if result:
+                plan["soc"] = result.soc[0]
+                command = generate_commands(
+                    [0], result.is_discharging, result.battery_discharge,
+                    result.is_charging, result.outside_to_battery, result.solar_to_battery
+                )[0]
+            print(f"{first:%H:%M} {reason:8s} {len(window):4d} Slots  {command}  Zielfunktion {result.objective}")
+
+        writer = asyncio.create_task(replay_day_folder(
+            folderName, directory, speed=speed, tick_s=tick_s, plan_soc=lambda: plan.get("soc")
+        ))
+        poll = min(0.5, tick_s / speed)
+        feeds = {name: tail_file(os.path.join(directory, name + ".log"), poll)
+                 for name in ("price", "pv", "consumption", "meter", "soc")}
+        pipeline = IngestPipeline(feeds, on_plan=on_plan, horizon=horizon, backend=backend,
+                                  debounce_s=debounce_s, max_delay_s=max_delay_s)
+        task = asyncio.create_task(pipeline.run())
+        await writer
+        # let the tails read the last lines
+        await asyncio.sleep(3 * poll + debounce_s)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return pipeline.stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a day folder as live feeds")
+    parser.add_argument("folder")
+    parser.add_argument("--speed", type=float, default=3600, help="data seconds per real second")
+    parser.add_argument("--tick", type=float, default=60, help="meter interval in data seconds")
+    parser.add_argument("--horizon", type=int, default=96)
+    parser.add_argument("--backend", default="CBC")
+    parser.add_argument("--debounce", type=float, default=0.2, help="seconds")
+    parser.add_argument("--max-delay", type=float, default=1.0, help="seconds")
+    args = parser.parse_args()
+
+    stats = asyncio.run(replay(args.folder, args.speed, args.tick, args.horizon, args.backend,
+                               args.debounce, args.max_delay))
+    print(f"{stats['lines']} Zeilen, {stats['checks']} Prüfungen, {stats['solves']} Optimierungen, "
+          f"{stats['skipped']} übersprungen, {stats['solve_seconds']:.1f} s Solver")
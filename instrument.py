@@ -0,0 +1,107 @@
+"""
+Instrumentation of the solves.
+
+Every solve (SolarPlanner.solve and the DP backend) emits one event, a plain
+dict with the model size, the timings and the solver statistics:
+
+    backend, status, periods, objective,
+    variables, constraints, binaries,       model size
+    build_s, update_s, solve_s, extract_s,  timings in seconds
+    iterations, nodes, best_bound, gap,     MILP statistics (None for DP)
+    states, warnings,
+    presolve                                reduction of presolve.py (None without)
+
+Events go to all registered sinks. A sink is any callable taking the event,
+JsonLinesSink writes one JSON object per line:
+
+    import instrument
+    instrument.add_sink(instrument.JsonLinesSink("solves.jsonl"))
+    instrument.add_sink(lambda event: print(event["solve_s"]))
+
+Without sinks no event is built. The same registry is per process, so worker
+processes have to add their sinks themselves (see batch.py --events).
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+_sinks = []
+
+
+def add_sink(sink):
+    """Register a callable which receives every event."""
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    """Unregister a sink, closes it if it has a close() method."""
+    _sinks.remove(sink)
+    if hasattr(sink, "close"):
+        sink.close()
+
+
+@contextmanager
+def recording(sink):
+    """Register sink for the duration of a with block."""
+    add_sink(sink)
+    try:
+        yield sink
+    finally:
+        remove_sink(sink)
+
+
+def enabled():
+    """True if at least one sink is registered, callers skip building events otherwise."""
+    return bool(_sinks)
+
+
+def emit(event):
+    """Send an event to all sinks, the time of the event is added as 'time'."""
+    if not _sinks:
+        return
+    event.setdefault("time", time.time())
+    for sink in list(_sinks):
+        sink(event)
+
+
+def mip_gap(objective, best_bound):
+    """Relative gap between the objective and the best bound, None if unknown."""
+    if objective is None or best_bound is None:
+        return None
+    return abs(objective - best_bound) / max(abs(objective), 1e-9)
+
+
+class JsonLinesSink:
+    """
+    Appends every event as one JSON line to a file. The file is opened in
+    append mode, so several processes can write into the same file.
+
+    Args:
+        filename: JSON-lines file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(filename, "a", buffering=1)
+
+    def __call__(self, event):
+        # one write per line, so lines of different processes do not mix
+        self.file.write(json.dumps(event, default=float) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class MemorySink:
+    """Keeps all events in a list, e.g. for benchmarks."""
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
@@ -0,0 +1,207 @@
+"""
+Rolling horizon (MPC) controller on top of SolarPlanner.
+
+At every 15 minute slot boundary the controller takes the measured SOC,
+shifts the price / PV / consumption window forward by one slot, warm starts
+the solver with the shifted previous plan and solves again. Only the command
+for the next slot is emitted, the rest of the plan is kept for the next step.
+
+Each step can be limited in time. If the solver has no incumbent when the
+limit is hit, the shifted previous plan is used instead, so there is always a
+command for the next slot. Before the first plan exists the safe NOD command
+is sent. The warm start hint is only used by backends which support hints
+(e.g. SCIP), CBC ignores it.
+"""
+
+import time
+
+from solver import SolarPlanner
+from batteryCommands.custom import generate_commands
+
+
+def shift_window(values, start, horizon):
+    """
+    Cut a window of length horizon out of values, starting at start.
+    If the series is too short, the last value is repeated.
+    """
+    window = list(values[start:start + horizon])
+    if not window:
+        raise ValueError(f"Keine Daten ab Periode {start}")
+    window += [window[-1]] * (horizon - len(window))
+    return window
+
+
+def shift_plan(values):
+    """Shift a plan (dict of lists) one period forward, repeating the last period."""
+    return {name: series[1:] + series[-1:] for name, series in values.items()}
+
+
+class LatencyStats:
+    """
+    Collects the wall time of every MPC step.
+
+    Args:
+        budget_ms: Latency budget per step, used to count overruns
+    """
+
+    def __init__(self, budget_ms=None):
+        self.budget_ms = budget_ms
+        self.latencies_ms = []
+
+    def add(self, latency_ms):
+        self.latencies_ms.append(latency_ms)
+
+    def summary(self):
+        """
+        Returns:
+            dict: count, mean, p50, p95, max (ms) and number of budget overruns
+        """
+        values = sorted(self.latencies_ms)
+        if not values:
+            return {"count": 0}
+
+        def percentile(p):
+            return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+        return {
+            "count": len(values),
+            "mean_ms": sum(values) / len(values),
+            "p50_ms": percentile(50),
+            "p95_ms": percentile(95),
+            "max_ms": values[-1],
+            "overruns": sum(1 for v in values if self.budget_ms and v > self.budget_ms),
+        }
+
+
+class RollingHorizonController:
+    """
+    Receding horizon controller for one battery.
+
+    Args:
+        horizon: Number of periods in every solve (96 = one day)
+        B_c_min: Minimum capacity of the battery (Wh)
+        B_c_max: Maximum capacity of the battery (Wh)
+        B_charge_max: Maximum charge per period (Wh)
+        B_discharge_max: Maximum discharge per period (Wh)
+        P_solar: Price for selling solar energy
+        P_loaded: Value of the energy left in the battery at the end
+        time_limit_ms: Time limit per solve, None for no limit
+        solver_name: Backend passed to pywraplp.Solver.CreateSolver
+    """
+
+    def __init__(self, horizon, B_c_min, B_c_max, B_charge_max, B_discharge_max,
+                 P_solar, P_loaded, time_limit_ms=None, solver_name="CBC"):
+        self.planner = SolarPlanner(horizon, B_c_min, B_c_max, B_charge_max, B_discharge_max, solver_name)
+        self.horizon = horizon
+        self.B_c_max = B_c_max
+        self.P_solar = P_solar
+        self.P_loaded = P_loaded
+        self.time_limit_ms = time_limit_ms
+        self.latency = LatencyStats(time_limit_ms)
+
+        # last plan as returned by the planner, and the raw values for warm starts
+        self.plan = None
+        self.plan_values = None
+        self.fallback_count = 0
+
+    def step(self, slot, soc_percent, C, P, S, printEnabled=0):
+        """
+        Re-plan at the start of a slot and return the command for it.
+
+        Args:
+            slot: Index of the slot that starts now
+            soc_percent: Measured state of charge in percent
+            C: Consumption series (Wh) for the whole run, windowed from slot
+            P: Price series for the whole run, windowed from slot
+            S: Solar series (Wh) for the whole run, windowed from slot
+            printEnabled: Passed through to the planner
+
+        Returns:
+            dict: 'slot', 'command', 'source' ('solver', 'fallback' or 'idle'), 'latency_ms'
+        """
+        start = time.perf_counter()
+
+        B_c_initial = int(round(soc_percent * self.B_c_max / 100))
+        C_window = shift_window(C, slot, self.horizon)
+        P_window = shift_window(P, slot, self.horizon)
+        S_window = shift_window(S, slot, self.horizon)
+
+        if self.plan_values is not None:
+            self.planner.set_hint(shift_plan(self.plan_values))
+
+        result = self.planner.solve(
+            C=C_window,
+            P=P_window,
+            S=S_window,
+            B_c_initial=B_c_initial,
+            P_solar=self.P_solar,
+            P_loaded=self.P_loaded,
+            printEnabled=printEnabled,
+            time_limit_ms=self.time_limit_ms,
+        )
+
+        if result[0]:
+            source = "solver"
+            self.plan = result
+            self.plan_values = self.planner.solution_values()
+            command = self.next_command()
+        elif self.plan is not None:
+            # no incumbent in time, continue with the previous plan one slot later
+            source = "fallback"
+            self.fallback_count += 1
+            self.plan = tuple(series[1:] + series[-1:] for series in self.plan)
+            self.plan_values = shift_plan(self.plan_values)
+            command = self.next_command()
+        else:
+            # nothing to fall back to yet, neither charge from grid nor discharge
+            source = "idle"
+            self.fallback_count += 1
+            command = "NOD"
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.latency.add(latency_ms)
+
+        return {"slot": slot, "command": command, "source": source, "latency_ms": latency_ms}
+
+    def next_command(self):
+        """Command for the first period of the current plan."""
+        (soc_list, energy_bought_list, battery_discharge_list, battery_charge_list,
+         solar_energy_list, is_charging_list, is_discharging_list,
+         outside_to_battery_list, solar_to_battery_list) = self.plan
+
+        commands = generate_commands(
+            [0], is_discharging_list, battery_discharge_list,
+            is_charging_list, outside_to_battery_list, solar_to_battery_list
+        )
+        return commands[0]
+
+    def planned_soc(self):
+        """SOC in percent at the end of the first period of the current plan, None without plan."""
+        return self.plan[0][0] if self.plan else None
+
+    def run(self, C, P, S, soc_percent, steps, measure_soc=None):
+        """
+        Run the controller over several slots.
+
+        Args:
+            C: Consumption series (Wh)
+            P: Price series
+            S: Solar series (Wh)
+            soc_percent: Measured state of charge at the start
+            steps: Number of slots to run
+            measure_soc: Optional callback(slot, planned_soc) returning the
+                measured SOC at the next slot boundary. Without it the plan is
+                assumed to be executed exactly.
+
+        Returns:
+            list: One dict per step as returned by step()
+        """
+        emitted = []
+        for slot in range(steps):
+            emitted.append(self.step(slot, soc_percent, C, P, S))
+            planned = self.planned_soc()
+            if measure_soc:
+                soc_percent = measure_soc(slot, planned)
+            elif planned is not None:
+                soc_percent = planned
+        return emitted
@@ -0,0 +1,144 @@
+"""
+Presolve of the solve_solar model from the input profiles.
+
+Many periods are decided by the data alone: at night (S = 0) there is no
+solar flow and no export, with a large PV surplus the export is forced and
+import impossible, and in the first periods the SOC can only reach a small
+range around B_c_initial. bounds() derives per period bounds for every
+variable group of SolarPlanner from C, S, the battery limits and the grid
+limits:
+
+    E_D  <= min(discharge_max, C, SOC above B_c_min)     E_GL <= C
+    E_SL <= min(C, S)                                    E_S  <= min(S, export_max)
+    E_SB <= min(discharge_max, S, charge_max / 0.9)      E_G  <= min(C + charge_max, import_max)
+    B in the SOC range reachable from B_c_initial
+
+and fixes the binaries which are determined:
+
+    S = 0                           y = 0 (no export possible)
+    no discharge possible           x = 0
+    no full charge possible         c = 0 (charging is always charge_max)
+    S > C + max solar to battery    y = 1, m = 0, no import (export is forced)
+    C > S + max discharge           m = 1, y = 0, no export (import is forced)
+
+Fixing x = 0 or y = 0 where the energy is 0 anyway only removes symmetric
+choices, every optimal plan stays feasible. SolarPlanner(presolve=True)
+applies the bounds in every update(), fixed variables are removed by the
+presolve of CBC / SCIP, so the persistent model is still built only once.
+"""
+
+import numpy as np
+
+# variable groups with an integrality requirement, see SolarPlanner.variable_groups()
+BINARIES = ("c", "x", "m", "y")
+
+
+def bounds(C, S, B_c_initial, B_c_min, B_c_max, charge_max, discharge_max, efficiency=0.9,
+           import_max=None, export_max=None):
+    """
+    Per period bounds of all variables.
+
+    Args:
+        C, S: Consumption and solar production per period (Wh), arrays over the horizon
+        B_c_initial, B_c_min, B_c_max: SOC at the start, minimum and maximum (Wh)
+        charge_max, discharge_max: Charge and discharge limit per period (Wh), arrays
+        efficiency: Share of the solar energy which arrives in the battery
+        import_max, export_max: Optional grid limits per period (Wh), arrays
+
+    Returns:
+        dict: Per variable group (lower, upper) arrays over the horizon
+    """
+    C = np.asarray(C, dtype=float)
+    S = np.asarray(S, dtype=float)
+    charge_max = np.asarray(charge_max, dtype=float)
+    discharge_max = np.asarray(discharge_max, dtype=float)
+    n = len(C)
+    zeros = np.zeros(n)
+    ones = np.ones(n)
+
+    # SOC range reachable from the start, charging adds exactly charge_max
+    soc_low = np.empty(n)
+    soc_high = np.empty(n)
+    low = high = float(B_c_initial)
+    for i in range(n):
+        # SOC before period i
+        can_charge = low + charge_max[i] <= B_c_max
+        high = min(B_c_max, high + charge_max[i]) if can_charge else high
+        low = max(B_c_min, low - min(discharge_max[i], C[i]))
+        soc_low[i], soc_high[i] = low, high
+    before_high = np.concatenate(([B_c_initial], soc_high[:-1]))
+    before_low = np.concatenate(([B_c_initial], soc_low[:-1]))
+
+    E_D = np.minimum(np.minimum(discharge_max, C), np.maximum(before_high - B_c_min, 0))
+    E_SB = np.minimum(np.minimum(discharge_max, S), np.floor(charge_max / efficiency))
+    E_G = C + charge_max if import_max is None else np.minimum(C + charge_max, import_max)
+    E_S = S.copy() if export_max is None else np.minimum(S, export_max)
+    E_GB = charge_max.copy()
+    E_GL = C.copy()
+
+    c_high = (before_low + charge_max <= B_c_max).astype(float)
+    x_high = (E_D > 0).astype(float)
+    y_low, y_high = zeros.copy(), (S > 0).astype(float)
+    m_low, m_high = zeros.copy(), ones.copy()
+
+    # more PV than load and battery can take: export is forced, import impossible
+    export_forced = S > C + E_SB
+    y_low[export_forced] = 1
+    m_high[export_forced] = 0
+    E_GL[export_forced] = 0
+    E_GB[export_forced] = 0
+    E_G[export_forced] = 0
+    # charging then only from PV, which needs charge_max / efficiency of it
+    c_high[export_forced & (efficiency * E_SB < charge_max)] = 0
+
+    # more load than PV and battery can cover: import is forced, export impossible
+    import_forced = C > S + E_D
+    m_low[import_forced] = 1
+    y_high[import_forced] = 0
+    E_S[import_forced] = 0
+
+    E_C_high = charge_max * c_high
+    E_SB = np.minimum(E_SB, np.floor(E_C_high / efficiency))
+    E_GB = np.minimum(E_GB, E_C_high)
+    E_D = E_D * x_high
+
+    return {
+        "B": (soc_low, soc_high),
+        "E_C": (zeros, E_C_high),
+        "E_D": (zeros, E_D),
+        "E_G": (zeros, E_G),
+        "E_GL": (zeros, E_GL),
+        "E_GB": (zeros, E_GB),
+        "E_SB": (zeros, E_SB),
+        "E_SL": (zeros, np.minimum(C, S)),
+        "E_S": (zeros, E_S),
+        "c": (zeros, c_high),
+        "x": (zeros, x_high),
+        "m": (m_low, m_high),
+        "y": (y_low, y_high),
+    }
+
+
+def statistics(reduced, original):
+    """
+    Reduction of bounds() against the bounds of the built model.
+
+    Args:
+        reduced: Result of bounds()
+        original: Same structure with the bounds of the model without presolve
+
+    Returns:
+        dict: 'variables', 'binaries' (count), 'fixed_variables', 'fixed_binaries'
+              (lower == upper) and 'tightened' (bounds narrower than before)
+    """
+    stats = {"variables": 0, "binaries": 0, "fixed_variables": 0, "fixed_binaries": 0, "tightened": 0}
+    for name, (low, high) in reduced.items():
+        original_low, original_high = original[name]
+        fixed = int(np.sum(low >= high))
+        stats["variables"] += len(low)
+        stats["fixed_variables"] += fixed
+        stats["tightened"] += int(np.sum((low > original_low) | (high < original_high)))
+        if name in BINARIES:
+            stats["binaries"] += len(low)
+            stats["fixed_binaries"] += fixed
+    return stats
@@ -0,0 +1,357 @@
+"""
+Dumps of solved instances and their replay.
+
+solve_solar(..., dump=directory) writes the inputs, the settings, the
+outcome (status, objective, solve time) and, for CBC / SCIP, the built
+model as OR-Tools MPModelProto into one compressed .npz file per solve.
+With dump_slower_than only solves without an optimal plan or slower than
+this many seconds are written, so it can stay on in production:
+
+    result = solve_solar(**inputs, dump=".cache/dumps", dump_slower_than=2.0)
+
+The files form a corpus of hard instances which can be solved again with
+other backends and settings:
+
+    python replay.py .cache/dumps --backend CBC SCIP DP --time-limit-ms 5000
+    python replay.py .cache/dumps --backend CBC SCIP --model    # the dumped model, not rebuilt
+    python replay.py dump.npz --mps                              # dump.mps for other solvers
+
+Without --model the instance is rebuilt from its inputs by the current
+solve_solar, so the corpus also shows the effect of changes to the model.
+With --model the stored proto is loaded as it was, which only needs
+OR-Tools and also works if the model building changed.
+"""
+
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import numbers
+import os
+import time
+
+import numpy as np
+
+DUMP_VERSION = 1
+
+# per period inputs of solve_solar, stored as arrays
+SERIES = ("C", "P", "S")
+
+# scalar inputs of solve_solar, stored in the meta data
+SCALARS = ("B_c_initial", "B_c_min", "B_charge_max", "B_discharge_max", "B_c_max", "P_loaded",
+           "battery_target_capacity", "mustLoadFirst", "min_battery_discharge")
+
+# settings of solve_solar which are replayed unless they are overridden
+SETTINGS = ("backend", "soc_resolution", "num_threads", "chunk", "lookahead", "chunk_time_limit_ms",
+            "time_limit_ms", "relative_gap", "switch_penalty", "min_dwell", "presolve", "lp_first")
+
+
+def should_dump(result, seconds, slower_than=None):
+    """
+    True if a solve is worth a dump: always without slower_than, otherwise
+    only solves without an optimal plan (for the DP: optimal on its SOC grid)
+    or slower than slower_than seconds.
+    """
+    if slower_than is None:
+        return True
+    return not result or result.status not in ("OPTIMAL", "DISCRETIZED") or seconds > slower_than
+
+
+def model_proto(planner):
+    """The model of a SolarPlanner as serialized MPModelProto."""
+    from ortools.linear_solver import linear_solver_pb2
+
+    model = linear_solver_pb2.MPModelProto()
+    planner.solver.ExportModelToProto(model)
+    return model.SerializeToString()
+
+
+def _values(values, interval):
+    return np.array([values[i] for i in interval], dtype=float)
+
+
+def dump_instance(directory, inputs, settings, result, seconds, model=None, solved_by=None):
+    """
+    Write one instance into directory.
+
+    Args:
+        directory: Target directory, created if missing
+        inputs: Keyword arguments of solve_solar (interval, C, P, ... min_battery_discharge)
+        settings: Settings of the solve (backend, time_limit_ms, ..., durations)
+        result: SolarResult of the solve
+        seconds: Wall time of the solve
+        model: Serialized MPModelProto, None for the DP backend and accepted LP solutions
+        solved_by: Backend or LP solver (lp_first) which produced the plan, None for the backend
+
+    Returns:
+        str: Path of the written file
+    """
+    interval = list(inputs["interval"])
+    arrays = {"interval": np.array(interval)}
+    for name in SERIES:
+        arrays[name] = _values(inputs[name], interval)
+    P_solar = inputs["P_solar"]
+    if not isinstance(P_solar, numbers.Number):
+        arrays["P_solar"] = _values(P_solar, interval)
+        P_solar = None
+    durations = settings.get("durations")
+    if durations is not None:
+        arrays["durations"] = np.asarray(durations, dtype=float)
+    if model is not None:
+        arrays["model"] = np.frombuffer(model, dtype=np.uint8)
+
+    meta = {
+        "version": DUMP_VERSION,
+        "created": time.time(),
+        "scalars": {name: inputs[name] for name in SCALARS},
+        "P_solar": P_solar,
+        "settings": {name: settings.get(name) for name in SETTINGS},
+        "solved_by": solved_by or settings.get("backend"),
+        "status": result.status if result is not None else None,
+        "objective": result.objective if result else None,
+        "gap": result.gap if result else None,
+        "seconds": seconds,
+    }
+    digest = hashlib.sha1()
+    for name in ("interval",) + SERIES:
+        digest.update(arrays[name].tobytes())
+    digest.update(json.dumps(meta["scalars"], sort_keys=True, default=float).encode())
+
+    os.makedirs(directory, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{meta['solved_by']}-{meta['status']}-{digest.hexdigest()[:10]}"
+    path = os.path.join(directory, name + ".npz")
+    # written under a temporary name, a reader never sees half a file
+    temporary = os.path.join(directory, f"{name}.{os.getpid()}.tmp.npz")
+    np.savez_compressed(temporary, meta=np.array(json.dumps(meta, default=float)), **arrays)
+    os.replace(temporary, path)
+    return path
+
+
+def load_instance(path):
+    """
+    Read a file of dump_instance().
+
+    Returns:
+        dict: 'inputs' (keyword arguments of solve_solar), 'settings' (incl.
+              'durations'), 'solved_by', 'status', 'objective', 'gap', 'seconds'
+              of the dumped solve and 'model' (serialized MPModelProto or None)
+    """
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    meta = json.loads(str(arrays.pop("meta")))
+    if meta["version"] != DUMP_VERSION:
+        raise ValueError(f"{path}: Version {meta['version']} wird nicht unterstützt")
+
+    interval = arrays["interval"].tolist()
+
+    def per_period(values):
+        return {i: v for i, v in zip(interval, values.tolist())}
+
+    inputs = {"interval": interval}
+    for name in SERIES:
+        inputs[name] = per_period(arrays[name])
+    inputs["P_solar"] = per_period(arrays["P_solar"]) if "P_solar" in arrays else meta["P_solar"]
+    inputs.update(meta["scalars"])
+    inputs["printEnabled"] = 0
+
+    settings = dict(meta["settings"])
+    settings["durations"] = arrays["durations"].tolist() if "durations" in arrays else None
+    model = arrays["model"].tobytes() if "model" in arrays else None
+    return {
+        "inputs": inputs,
+        "settings": settings,
+        "solved_by": meta.get("solved_by", settings["backend"]),
+        "status": meta["status"],
+        "objective": meta["objective"],
+        "gap": meta["gap"],
+        "seconds": meta["seconds"],
+        "model": model,
+    }
+
+
+def solve_model(model, backend="CBC", time_limit_ms=None, relative_gap=None, num_threads=None):
+    """
+    Solve a serialized MPModelProto as it is.
+
+    Returns:
+        dict: status, objective, best_bound, seconds (solve only)
+    """
+    from ortools.linear_solver import linear_solver_pb2, pywraplp
+
+    from solver import STATUS_NAMES
+
+    proto = linear_solver_pb2.MPModelProto()
+    proto.ParseFromString(model)
+    solver = pywraplp.Solver.CreateSolver(backend)
+    if solver is None:
+        raise ValueError(f"Solver {backend} ist nicht verfügbar")
+    error = solver.LoadModelFromProto(proto)
+    if error:
+        raise ValueError(f"Modell kann nicht geladen werden: {error}")
+    if num_threads:
+        solver.SetNumThreads(num_threads)
+    if time_limit_ms:
+        solver.SetTimeLimit(int(time_limit_ms))
+    parameters = pywraplp.MPSolverParameters()
+    if relative_gap is not None:
+        parameters.SetDoubleParam(parameters.RELATIVE_MIP_GAP, relative_gap)
+
+    start = time.perf_counter()
+    status = solver.Solve(parameters)
+    seconds = time.perf_counter() - start
+    found = status in (pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE)
+    return {
+        "status": STATUS_NAMES.get(status, str(status)),
+        "objective": solver.Objective().Value() if found else None,
+        "best_bound": solver.Objective().BestBound() if found else None,
+        "seconds": seconds,
+    }
+
+
+def mps_text(model):
+    """A serialized MPModelProto in free MPS format."""
+    from ortools.linear_solver import linear_solver_pb2, pywraplp
+
+    proto = linear_solver_pb2.MPModelProto()
+    proto.ParseFromString(model)
+    solver = pywraplp.Solver.CreateSolver("CBC")
+    solver.LoadModelFromProto(proto)
+    return solver.ExportModelAsMpsFormat(False, False)
+
+
+def replay_instance(instance, backend=None, from_model=False, **overrides):
+    """
+    Solve a loaded instance again.
+
+    Args:
+        instance: Result of load_instance()
+        backend: Backend, None for the dumped one
+        from_model: Solve the dumped model instead of rebuilding it from the inputs
+        overrides: Settings of solve_solar replacing the dumped ones (time_limit_ms, relative_gap, ...)
+
+    Returns:
+        dict: backend, status, objective, seconds and the dumped status, objective and seconds
+    """
+    from solver import solve_solar
+
+    settings = dict(instance["settings"])
+    settings.update({name: value for name, value in overrides.items() if value is not None})
+    backend = backend or settings["backend"]
+    settings["backend"] = backend
+
+    if from_model:
+        if instance["model"] is None:
+            raise ValueError("Der Dump enthält kein Modell (DP oder LP-Lösung), nur ohne --model möglich")
+        outcome = solve_model(instance["model"], backend, settings["time_limit_ms"], settings["relative_gap"],
+                              settings["num_threads"])
+    else:
+        if backend == "DP":
+            settings["switch_penalty"], settings["min_dwell"] = 0, 1
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = solve_solar(**instance["inputs"], **settings)
+        outcome = {
+            "status": result.status,
+            "objective": result.objective if result else None,
+            "seconds": time.perf_counter() - start,
+        }
+    return {
+        "backend": backend,
+        "source": "model" if from_model else "inputs",
+        "status": outcome["status"],
+        "objective": outcome["objective"],
+        "seconds": outcome["seconds"],
+        "dumped_backend": instance["solved_by"],
+        "dumped_status": instance["status"],
+        "dumped_objective": instance["objective"],
+        "dumped_seconds": instance["seconds"],
+    }
+
+
+def find_dumps(paths):
+    """The .npz files of the given files and directories, sorted."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(p for p in glob.glob(os.path.join(path, "*.npz")) if ".tmp" not in p)
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def replay_corpus(paths, backends=(None,), from_model=False, repeat=1, **overrides):
+    """
+    Replay all dumps of paths with every backend.
+
+    Returns:
+        list: One row (see replay_instance) per file, backend and repetition, with 'file'
+    """
+    rows = []
+    for path in find_dumps(paths):
+        instance = load_instance(path)
+        for backend in backends:
+            # DP dumps and accepted LP solutions have no model, and the DP backend needs the inputs
+            if from_model and (instance["model"] is None or backend == "DP"):
+                continue
+            for _ in range(repeat):
+                row = replay_instance(instance, backend, from_model, **overrides)
+                row["file"] = os.path.basename(path)
+                rows.append(row)
+    return rows
+
+
+def format_rows(rows):
+    """Table of replay rows, one line per row plus the total time per backend."""
+    lines = [f"{'Datei':48s} {'Backend':7s} {'Status':11s} {'Ziel':>14s} {'s':>8s} "
+             f"{'Dump-Status':11s} {'Dump-Ziel':>14s} {'Dump-s':>8s}"]
+
+    def number(value):
+        return "-" if value is None else f"{value:.0f}"
+
+    for row in rows:
+        lines.append(f"{row['file'][:48]:48s} {row['backend']:7s} {row['status']:11s} "
+                     f"{number(row['objective']):>14s} {row['seconds']:8.3f} "
+                     f"{str(row['dumped_status']):11s} {number(row['dumped_objective']):>14s} "
+                     f"{row['dumped_seconds']:8.3f}")
+    totals = {}
+    for row in rows:
+        totals[row["backend"]] = totals.get(row["backend"], 0.0) + row["seconds"]
+    for backend, seconds in totals.items():
+        lines.append(f"{backend}: {seconds:.2f} s gesamt")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve dumped instances again and record the timings")
+    parser.add_argument("paths", nargs="+", help="dump files or directories")
+    parser.add_argument("--backend", nargs="+", default=[None], help="backends, default the dumped one")
+    parser.add_argument("--model", action="store_true", help="solve the dumped model instead of rebuilding it")
+    parser.add_argument("--time-limit-ms", type=int)
+    parser.add_argument("--gap", type=float, help="relative MIP gap")
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--out", help="JSON-lines file for the rows")
+    parser.add_argument("--mps", action="store_true", help="only write the models as .mps next to the dumps")
+    args = parser.parse_args()
+
+    if args.mps:
+        for path in find_dumps(args.paths):
+            instance = load_instance(path)
+            if instance["model"] is None:
+                print(f"{path}: kein Modell")
+                continue
+            target = os.path.splitext(path)[0] + ".mps"
+            with open(target, "w") as f:
+                f.write(mps_text(instance["model"]))
+            print(target)
+        raise SystemExit(0)
+
+    rows = replay_corpus(args.paths, args.backend, args.model, args.repeat,
+                         time_limit_ms=args.time_limit_ms, relative_gap=args.gap, num_threads=args.threads)
+    print(format_rows(rows))
+    if args.out:
+        with open(args.out, "a") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
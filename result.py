@@ -0,0 +1,140 @@
+"""
+Result of solve_solar, backed by NumPy arrays.
+
+The nine lists of the old tuple form are still available: iterating and
+indexing a SolarResult gives them in the old order, so
+
+    soc_list, energy_bought_list, ... = solve_solar(...)
+
+keeps working. New code can use the arrays and the aggregates directly.
+"""
+
+import numpy as np
+
+# order of the old tuple form
+FIELDS = (
+    "soc",
+    "energy_bought",
+    "battery_discharge",
+    "battery_charge",
+    "solar_energy",
+    "is_charging",
+    "is_discharging",
+    "outside_to_battery",
+    "solar_to_battery",
+)
+
+# P is given in ct/kWh * 100 and energies in Wh, P * E / COST_SCALE is ct
+COST_SCALE = 100 * 1000
+
+
+class SolarResult:
+    """
+    Plan of one solve.
+
+    Args:
+        soc: SOC at the end of every period in percent
+        energy_bought: Energy bought from the grid (Wh)
+        battery_discharge: Energy discharged from the battery (Wh)
+        battery_charge: Energy charged into the battery (Wh)
+        solar_energy: Solar production (Wh)
+        is_charging: Charging flag c
+        is_discharging: Discharging flag x
+        outside_to_battery: Energy from the grid into the battery (Wh)
+        solar_to_battery: Solar energy into the battery (Wh)
+        price: Grid price per period as passed to the solver (P)
+        consumption: Consumption per period as passed to the solver (C)
+        energy_sold: Solar energy sold to the grid (Wh), not part of the tuple form
+        status: Solver status as string, e.g. "OPTIMAL", "HEURISTIC" for a fallback plan,
+            "DISCRETIZED" for a DP plan (optimal on its SOC grid only)
+        objective: Objective value of the solver
+        gap: Relative MIP gap of the plan, 0 for optimal, None if unknown
+    """
+
+    def __init__(self, soc, energy_bought, battery_discharge, battery_charge, solar_energy,
+                 is_charging, is_discharging, outside_to_battery, solar_to_battery,
+                 price=None, consumption=None, energy_sold=None, status="OPTIMAL", objective=None, gap=None):
+        self.soc = np.asarray(soc, dtype=float)
+        self.energy_bought = np.asarray(energy_bought, dtype=float)
+        self.battery_discharge = np.asarray(battery_discharge, dtype=float)
+        self.battery_charge = np.asarray(battery_charge, dtype=float)
+        self.solar_energy = np.asarray(solar_energy, dtype=float)
+        self.is_charging = np.asarray(is_charging, dtype=float)
+        self.is_discharging = np.asarray(is_discharging, dtype=float)
+        self.outside_to_battery = np.asarray(outside_to_battery, dtype=float)
+        self.solar_to_battery = np.asarray(solar_to_battery, dtype=float)
+        self.price = None if price is None else np.asarray(price, dtype=float)
+        self.consumption = None if consumption is None else np.asarray(consumption, dtype=float)
+        self.energy_sold = None if energy_sold is None else np.asarray(energy_sold, dtype=float)
+        self.status = status
+        self.objective = objective
+        self.gap = gap
+
+    @classmethod
+    def empty(cls, status):
+        """Result without a plan, e.g. for an infeasible model."""
+        return cls(*([[]] * len(FIELDS)), status=status)
+
+    @classmethod
+    def concatenate(cls, parts, status="FEASIBLE", objective=None):
+        """Join the plans of consecutive horizons into one result."""
+        def join(name):
+            values = [getattr(part, name) for part in parts]
+            if any(v is None for v in values):
+                return None
+            return np.concatenate(values)
+        return cls(*(join(name) for name in FIELDS),
+                   price=join("price"), consumption=join("consumption"), energy_sold=join("energy_sold"),
+                   status=status, objective=objective)
+
+    def head(self, periods):
+        """Result of the first periods only."""
+        def cut(values):
+            return None if values is None else values[:periods]
+        return SolarResult(*(cut(getattr(self, name)) for name in FIELDS),
+                           price=cut(self.price), consumption=cut(self.consumption),
+                           energy_sold=cut(self.energy_sold),
+                           status=self.status, objective=self.objective, gap=self.gap)
+
+    # ------------------------------------------------------------- tuple form
+
+    def as_tuple(self):
+        """The nine lists in the order solve_solar used to return them."""
+        return tuple(getattr(self, name).tolist() for name in FIELDS)
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.as_tuple()[index]
+        return getattr(self, FIELDS[index]).tolist()
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __bool__(self):
+        """True if the result contains a plan."""
+        return len(self.soc) > 0
+
+    # ------------------------------------------------------------- aggregates
+
+    def energy_bought_total(self):
+        """Energy bought from the grid over the horizon (Wh)."""
+        return float(self.energy_bought.sum())
+
+    def cost_optimized(self):
+        """Costs of the energy bought with this plan in ct."""
+        return float(self.price @ self.energy_bought) / COST_SCALE
+
+    def cost_without(self):
+        """Costs in ct without battery optimization, consumption minus solar at grid price like Solar.py."""
+        return float(self.price @ (self.consumption - self.solar_energy)) / COST_SCALE
+
+    def savings(self):
+        """cost_without() - cost_optimized() in ct."""
+        return self.cost_without() - self.cost_optimized()
+
+    def cost_per_period(self):
+        """Costs of the bought energy per period in ct."""
+        return self.price * self.energy_bought / COST_SCALE
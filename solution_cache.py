@@ -0,0 +1,404 @@
+"""
+Cache of solved plans, keyed on the quantized inputs.
+
+Re-plans within a day often see the same prices and nearly the same
+forecasts, and households with the same tariff and battery solve the same
+problem. SolutionCache stores every optimal plan under a hash of
+
+    C, P, S (rounded to quantum), B_c_initial (rounded to quantum),
+    battery parameters, P_solar, P_loaded, backend
+
+in an LRU of max_entries plans and optionally as .npz files in a directory
+(bounded by max_bytes, the least recently used files are removed first).
+
+A second key leaves out B_c_initial and the first hint_slots periods. If the
+exact key misses but this one hits, the stored plan is passed as warm start
+hint to the solver (used by SCIP, CBC ignores hints):
+
+    cache = SolutionCache(".cache/solutions")
+    result = solve_cached(cache, **inputs, backend="SCIP")
+    cache.stats()   # hits, misses, hint_hits, hit_rate, ...
+
+With quantum > 1 near-identical inputs share a plan. The plan was solved for
+the first inputs of its key, so its energies may differ from the new inputs
+by up to quantum Wh per period.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from result import FIELDS, SolarResult
+
+CACHE_VERSION = 1
+
+# arrays of a SolarResult besides FIELDS
+EXTRA_ARRAYS = ("price", "consumption", "energy_sold")
+
+# per process: planners per battery spec for the MILP backends
+_planners = {}
+
+
+def quantize(values, quantum):
+    """Values rounded to multiples of quantum, as a list of ints."""
+    values = np.asarray(values, dtype=float)
+    if quantum <= 1:
+        return np.round(values).astype(np.int64).tolist()
+    return (np.round(values / quantum) * quantum).astype(np.int64).tolist()
+
+
+def series(values, interval):
+    """Per period values of a dict or list indexed by the interval, numbers are repeated."""
+    if isinstance(values, (int, float)):
+        return [values] * len(interval)
+    return [values[i] for i in interval]
+
+
+class SolutionCache:
+    """
+    LRU of solved plans, optionally backed by a directory.
+
+    Args:
+        directory: Directory for the .npz files, None for memory only
+        max_entries: Plans kept in memory
+        max_bytes: Size limit of the directory
+        quantum: Rounding of C, S and B_c_initial (Wh) before hashing, 1 for exact inputs
+        hint_slots: Periods at the start ignored by the hint key
+    """
+
+    def __init__(self, directory=None, max_entries=1024, max_bytes=64 * 1024 * 1024, quantum=1, hint_slots=4):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.quantum = quantum
+        self.hint_slots = hint_slots
+        self.entries = OrderedDict()
+        self.hint_index = {}
+        self.hits = 0
+        self.misses = 0
+        self.hint_hits = 0
+        self.evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # ----------------------------------------------------------------- keys
+
+    def keys(self, inputs, backend, soc_resolution=10):
+        """
+        (exact key, hint key) of solve_solar keyword arguments.
+
+        The hint key contains everything but B_c_initial and the first
+        hint_slots periods of C, P and S.
+        """
+        interval = inputs["interval"]
+        q = self.quantum
+        C = quantize(series(inputs["C"], interval), q)
+        P = quantize(series(inputs["P"], interval), 1)
+        S = quantize(series(inputs["S"], interval), q)
+        P_solar = quantize(series(inputs["P_solar"], interval), 1)
+        common = [
+            CACHE_VERSION, backend, soc_resolution if backend == "DP" else None,
+            inputs["B_c_min"], inputs["B_c_max"], inputs["B_charge_max"], inputs["B_discharge_max"],
+            inputs["P_loaded"],
+        ]
+        start = self.hint_slots
+        exact = common + [quantize([inputs["B_c_initial"]], q)[0], C, P, S, P_solar]
+        hint = common + [len(interval), C[start:], P[start:], S[start:], P_solar[start:]]
+
+        def digest(value):
+            return hashlib.sha1(json.dumps(value).encode()).hexdigest()
+
+        return digest(exact), digest(hint)
+
+    # --------------------------------------------------------------- access
+
+    def get(self, key):
+        """Cached plan of a key or None, counts a hit or a miss."""
+        result = self._lookup(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def hint(self, hint_key):
+        """Plan of a similar problem (same hint key) or None."""
+        key = self.hint_index.get(hint_key)
+        if key is None and self.directory:
+            key = self._read_hint_file(hint_key)
+        result = self._lookup(key) if key else None
+        if result is not None:
+            self.hint_hits += 1
+        return result
+
+    def put(self, key, hint_key, result):
+        """
+        Store a plan, plans without a proven optimum are not cached. DP plans
+        are optimal on their SOC grid, which is part of the key.
+        """
+        if not result or result.status not in ("OPTIMAL", "DISCRETIZED"):
+            return
+        self._remember(key, result)
+        self.hint_index[hint_key] = key
+        if self.directory:
+            self._write(key, hint_key, result)
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses, hint_hits, evictions, entries (in memory) and hit_rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hint_hits": self.hint_hits,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    # -------------------------------------------------------------- helpers
+
+    def _lookup(self, key):
+        result = self.entries.get(key)
+        if result is not None:
+            self.entries.move_to_end(key)
+        elif self.directory:
+            result = self._read(key)
+            if result is not None:
+                self._remember(key, result)
+        # a new object for the caller, the arrays are shared and read-only
+        return None if result is None else result.head(len(result.soc))
+
+    def _remember(self, key, result):
+        # a read-only copy, the caller keeps its own arrays
+        result = result.head(len(result.soc))
+        for name in FIELDS + EXTRA_ARRAYS:
+            values = getattr(result, name)
+            if values is not None:
+                values = values.copy()
+                values.flags.writeable = False
+                setattr(result, name, values)
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            self.evictions += 1
+            if not self.directory:
+                # the plan is gone, so are the hints to it
+                for hint_key in [h for h, k in self.hint_index.items() if k == evicted]:
+                    del self.hint_index[hint_key]
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read(self, key):
+        path = self._path(key + ".npz")
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files if name != "meta"}
+                meta = json.loads(str(data["meta"]))
+        except (OSError, ValueError, KeyError):
+            return None
+        # the access time decides which files are removed first
+        os.utime(path)
+        return SolarResult(*(arrays[name] for name in FIELDS),
+                           **{name: arrays.get(name) for name in EXTRA_ARRAYS},
+                           status=meta["status"], objective=meta["objective"], gap=meta["gap"])
+
+    def _read_hint_file(self, hint_key):
+        try:
+            with open(self._path(hint_key + ".hint")) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def _write(self, key, hint_key, result):
+        arrays = {name: getattr(result, name) for name in FIELDS + EXTRA_ARRAYS if getattr(result, name) is not None}
+        meta = json.dumps({"status": result.status, "objective": result.objective, "gap": result.gap})
+        # written under a temporary name, a reader never sees half a file
+        temporary = self._path(f"{key}.{os.getpid()}.tmp.npz")
+        np.savez(temporary, meta=np.array(meta), **arrays)
+        os.replace(temporary, self._path(key + ".npz"))
+        with open(self._path(hint_key + ".hint"), "w") as f:
+            f.write(key)
+        self._limit_directory()
+
+    def _limit_directory(self):
+        # every plan with the .hint files pointing to it, they are removed together
+        plans = {}
+        hints = []
+        for entry in os.scandir(self.directory):
+            if ".tmp" in entry.name:
+                continue
+            if entry.name.endswith(".npz"):
+                st = entry.stat()
+                plans[entry.name[:-4]] = [st.st_mtime, st.st_size, [entry.path]]
+            elif entry.name.endswith(".hint"):
+                hints.append(entry)
+        for entry in hints:
+            try:
+                with open(entry.path) as f:
+                    key = f.read().strip()
+                size = entry.stat().st_size
+            except OSError:
+                continue
+            if key in plans:
+                plans[key][1] += size
+                plans[key][2].append(entry.path)
+            else:
+                # the plan of this hint was already removed
+                with contextlib.suppress(OSError):
+                    os.remove(entry.path)
+        total = sum(size for _, size, _ in plans.values())
+        for _, size, paths in sorted(plans.values()):
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+            total -= size
+            self.evictions += 1
+
+
+def hint_values(result, B_c_max, S):
+    """
+    Warm start hint for SolarPlanner.set_hint() from a plan.
+
+    Args:
+        result: SolarResult
+        B_c_max: Battery capacity (Wh), to convert the SOC back to Wh
+        S: Solar production per period of the new problem (Wh)
+    """
+    E_G = result.energy_bought
+    E_GB = result.outside_to_battery
+    E_SB = result.solar_to_battery
+    E_S = result.energy_sold if result.energy_sold is not None else np.zeros(len(E_G))
+    return {
+        "B": np.round(result.soc * B_c_max / 100).tolist(),
+        "E_C": result.battery_charge.tolist(),
+        "E_D": result.battery_discharge.tolist(),
+        "E_G": E_G.tolist(),
+        "E_GL": (E_G - E_GB).tolist(),
+        "E_GB": E_GB.tolist(),
+        "E_SB": E_SB.tolist(),
+        "E_SL": np.maximum(np.asarray(S, dtype=float) - E_SB - E_S, 0).tolist(),
+        "E_S": E_S.tolist(),
+        "c": result.is_charging.tolist(),
+        "x": result.is_discharging.tolist(),
+        "m": (E_G > 0).astype(float).tolist(),
+        "y": (E_S > 0).astype(float).tolist(),
+    }
+
+
+def solve_cached(cache, interval, C, P, P_solar, S, B_c_initial, B_c_min, B_charge_max, B_discharge_max,
+                 B_c_max, P_loaded, battery_target_capacity, mustLoadFirst, min_battery_discharge,
+                 printEnabled, backend="CBC", soc_resolution=10, num_threads=None, time_limit_ms=None,
+                 relative_gap=None):
+    """
+    solve_solar() with a SolutionCache. The MILP model is built once per
+    battery spec and process and reused for all misses.
+
+    Returns:
+        SolarResult: Cached or new plan
+    """
+    from solver import SolarPlanner, anytime_result, solve_solar
+
+    inputs = {
+        "interval": interval, "C": C, "P": P, "P_solar": P_solar, "S": S, "B_c_initial": B_c_initial,
+        "B_c_min": B_c_min, "B_c_max": B_c_max, "B_charge_max": B_charge_max,
+        "B_discharge_max": B_discharge_max, "P_loaded": P_loaded,
+    }
+    key, hint_key = cache.keys(inputs, backend, soc_resolution)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    if backend == "DP":
+        result = solve_solar(interval, C, P, P_solar, S, B_c_initial, B_c_min, B_charge_max, B_discharge_max,
+                             B_c_max, P_loaded, battery_target_capacity, mustLoadFirst, min_battery_discharge,
+                             printEnabled, backend="DP", soc_resolution=soc_resolution)
+    else:
+        spec = (len(interval), B_c_min, B_c_max, B_charge_max, B_discharge_max, backend, num_threads)
+        if spec not in _planners:
+            _planners[spec] = SolarPlanner(len(interval), B_c_min, B_c_max, B_charge_max, B_discharge_max,
+                                           backend, num_threads)
+        planner = _planners[spec]
+        C_values = series(C, interval)
+        P_values = series(P, interval)
+        S_values = series(S, interval)
+        similar = cache.hint(hint_key)
+        # the planner is shared, without a similar plan the hint of the last miss is cleared
+        planner.set_hint({} if similar is None else hint_values(similar, B_c_max, S_values))
+        result = planner.solve(C=C_values, P=P_values, S=S_values, B_c_initial=B_c_initial, P_solar=P_solar,
+                               P_loaded=P_loaded, printEnabled=printEnabled, time_limit_ms=time_limit_ms,
+                               relative_gap=relative_gap)
+        if time_limit_ms:
+            result = anytime_result(planner, result, list(range(len(interval))), C_values, P_values, P_solar,
+                                    S_values, B_c_initial, P_loaded, printEnabled)
+
+    cache.put(key, hint_key, result)
+    return result
+
+
+if __name__ == "__main__":
+    # re-plans of the day folders: most re-plans see the same data, sometimes
+    # the forecast of the next slots or the measured SOC changes a little
+    from dataset import find_day_folders, load_day
+    from solver import solve_solar
+
+    parser = argparse.ArgumentParser(description="Hit rate and time of the solution cache for repeated re-plans")
+    parser.add_argument("root", nargs="?", default=".")
+    parser.add_argument("--backend", default="CBC")
+    parser.add_argument("--replans", type=int, default=20, help="re-plans per day")
+    parser.add_argument("--change", type=float, default=0.3,
+                        help="probability that the forecast of the next slots (and the SOC) changes")
+    parser.add_argument("--noise", type=float, default=50, help="change of a forecast value (Wh)")
+    parser.add_argument("--quantum", type=int, default=1, help="rounding of C, S and SOC before hashing (Wh)")
+    parser.add_argument("--directory", help="directory of the cache, default memory only")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    days = [load_day(folder)["inputs"] for folder in find_day_folders(args.root)]
+
+    def replans(rng):
+        for inputs in days:
+            current = inputs
+            for _ in range(args.replans):
+                changed = dict(current)
+                if rng.random() < args.change:
+                    for name in ("C", "S"):
+                        values = dict(current[name])
+                        for i in inputs["interval"][:4]:
+                            values[i] = max(0, int(values[i] + rng.normal(0, args.noise)))
+                        changed[name] = values
+                if rng.random() < args.change:
+                    changed["B_c_initial"] = current["B_c_initial"] + int(rng.choice([-100, 100]))
+                current = changed
+                yield changed
+
+    for label, cache in (("ohne Cache", None),
+                         ("mit Cache", SolutionCache(args.directory, quantum=args.quantum))):
+        start = time.perf_counter()
+        count = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for inputs in replans(np.random.default_rng(args.seed)):
+                if cache is None:
+                    solve_solar(**inputs, backend=args.backend)
+                else:
+                    solve_cached(cache, **inputs, backend=args.backend)
+                count += 1
+        seconds = time.perf_counter() - start
+        print(f"{label:12s}{count:6d} Solves {seconds:8.2f} s {seconds / count * 1000:8.1f} ms/Solve")
+        if cache is not None:
+            stats = cache.stats()
+            print(f"{'':12s}Treffer {stats['hits']}, Fehlschläge {stats['misses']}, "
+                  f"Hinweise {stats['hint_hits']}, Trefferquote {stats['hit_rate']:.0%}")
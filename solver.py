@@ -1,19 +1,873 @@
-from ortools.linear_solver import pywraplp
+import datetime
+import numbers
+import time
+
+import numpy as np
+
+import instrument
+import presolve as presolve_bounds
+import replay
+import timegrid
+from cpsat_solver import solve_solar_cpsat
+from dp_solver import EFFICIENCY, EFFICIENCY_NUMERATOR, EFFICIENCY_SCALE, M, idle_plan, solve_solar_dp
+from history import record_plan
+from result import SolarResult
+
+# commands of the switching model, see SolarPlanner.add_switching()
+SWITCH_COMMANDS = ("ACC", "DIS", "NOD")
+
+# SOC bucket size (Wh) of the DP fallback, about 15 ms for 96 periods
+FALLBACK_RESOLUTION = 50
+
+# LP solvers for lp_first, they ignore the integrality of all variables
+LP_SOLVERS = ("GLOP", "PDLP")
+
+# values of pywraplp.Solver.OPTIMAL ... NOT_SOLVED, OR-Tools is only imported
+# when a MILP is built, so the DP backend and plain imports stay fast
+STATUS_NAMES = {
+    0: "OPTIMAL",
+    1: "FEASIBLE",
+    2: "INFEASIBLE",
+    3: "UNBOUNDED",
+    4: "ABNORMAL",
+    5: "MODEL_INVALID",
+    6: "NOT_SOLVED",
+}
 
 
 def addConstraintDisCharge(solver, interval, E_D, B_discharge_max, x):
+    # B_discharge_max is indexable per period, slots of different length have different limits
     for i in interval:
-        solver.Add(E_D[i] <= B_discharge_max * x[i])
+        solver.Add(E_D[i] <= B_discharge_max[i] * x[i])
 
 def addConstraintBatteryStatus(solver, interval, B, E_C, E_D, E_SB, B_c_initial ):
     #calculation of battery status, history, start and end
-    solver.Add(B[0] == B_c_initial + E_C[0] - E_D[0])
-    
+    # B_c_initial stays on the right hand side, so it can be updated later via SetBounds
+    initial = solver.Add(B[0] - E_C[0] + E_D[0] == B_c_initial)
+
     #solver.Add(B[interval[-1]] == B_c_initial)
 
     for i in range(1, len(interval)):
         solver.Add(B[i] == B[i-1] + E_C[i] - E_D[i])
 
+    return initial
+
+
+class SolarPlanner:
+    """
+    Persistent version of the solve_solar model.
+
+    The variables and constraints are built once for a horizon length and a
+    battery spec. Every call to solve() only updates the right hand sides
+    (C, S, B_c_initial) and the objective coefficients (P, P_solar, P_loaded)
+    before solving again, so re-planning skips the Python model build.
+
+    Args:
+        horizon: Number of time periods
+        B_c_min: Minimum capacity of the battery (Wh)
+        B_c_max: Maximum capacity of the battery (Wh)
+        B_charge_max: Maximum charge per period (Wh)
+        B_discharge_max: Maximum discharge per period (Wh)
+        solver_name: Backend passed to pywraplp.Solver.CreateSolver
+        num_threads: Number of solver threads, None keeps the solver default
+        switch_penalty: Cost of every command change (ct), see add_switching()
+        min_dwell: Minimum number of periods a command is kept, see add_switching()
+        durations: Slot durations in minutes (see timegrid.py), B_charge_max,
+            B_discharge_max and M are then per 15 minutes and scaled per period
+        presolve: Tighten the variable bounds and fix the binaries which the
+            data decides in every update(), see presolve.py
+    """
+
+    def __init__(self, horizon, B_c_min, B_c_max, B_charge_max, B_discharge_max, solver_name="CBC", num_threads=None,
+                 switch_penalty=0, min_dwell=1, durations=None, presolve=False):
+        from ortools.linear_solver import pywraplp
+
+        start = time.perf_counter()
+
+        self.horizon = horizon
+        self.interval = list(range(horizon))
+        self.B_c_min = B_c_min
+        self.B_c_max = B_c_max
+        self.B_charge_max = B_charge_max
+        self.B_discharge_max = B_discharge_max
+        self.solver_name = solver_name
+        self.durations = None if durations is None else list(durations)
+
+        # limits per period, scaled with the slot duration
+        period_scale = timegrid.scale(durations)
+        if period_scale is None:
+            period_scale = np.ones(horizon)
+        elif len(period_scale) != horizon:
+            raise ValueError(f"{len(period_scale)} Slotdauern für {horizon} Perioden")
+        self.charge_max = charge_max = [int(round(B_charge_max * f)) for f in period_scale]
+        self.discharge_max = discharge_max = [int(round(B_discharge_max * f)) for f in period_scale]
+        self.big_m = [M * f for f in period_scale]
+
+        self.solver = solver = pywraplp.Solver.CreateSolver(solver_name)  # oder "SCIP"
+
+        if not solver:
+            raise RuntimeError("Solver konnte nicht erstellt werden")
+
+        if num_threads:
+            solver.SetNumThreads(num_threads)
+
+        interval = self.interval
+
+        #-----------------------Battery Variables
+        self.B     = B     = {i: solver.IntVar(B_c_min, B_c_max,       f"B_{i}")          for i in interval}
+        self.E_C   = E_C   = {i: solver.IntVar(0, charge_max[i],       f"E_C_{i}")        for i in interval}
+        self.E_D   = E_D   = {i: solver.IntVar(0, discharge_max[i],    f"E_D_{i}")        for i in interval}
+
+        #-----------------------Energy Flow Variables
+        self.E_G   = E_G   = {i: solver.IntVar(0, solver.infinity(),   f"E_G_{i}")        for i in interval}
+        self.E_GL  = E_GL  = {i: solver.IntVar(0, solver.infinity(),   f"E_GL_{i}")       for i in interval}
+        self.E_GB  = E_GB  = {i: solver.IntVar(0, charge_max[i],       f"E_GB_{i}")       for i in interval}
+
+        self.E_SB  = E_SB  = {i: solver.IntVar(0, discharge_max[i],    f"E_SB_{i}")       for i in interval}
+        self.E_SL  = E_SL  = {i: solver.IntVar(0, solver.infinity(),   f"E_SL_{i}")       for i in interval}
+        self.E_S   = E_S   = {i: solver.IntVar(0, solver.infinity(),   f"E_S_{i}")        for i in interval}
+
+        #---------------------Binary Control Variables
+        # d (discharge allowed) is only needed for mustLoadFirst, which is disabled,
+        # an unconstrained binary per period only enlarges the branch and bound tree
+        self.c     = c     = {i: solver.BoolVar(f"c_{i}")                             for i in interval}
+        self.x     = x     = {i: solver.BoolVar(f"x_{i}")                             for i in interval}
+        self.m     = m     = {i: solver.BoolVar(f"m_{i}")                             for i in interval}
+        self.y     = y     = {i: solver.BoolVar(f"y_{i}")                             for i in interval}
+
+        # the Big-M coefficients are set per period in update(), tightened to the data
+        self.import_constraint = {}
+        self.export_constraint = {}
+
+        for i in interval:
+            solver.Add(c[i] + x[i] <= 1)
+
+            self.import_constraint[i] = solver.Add(E_GL[i] + E_GB[i] - M * m[i] <= 0)
+            self.export_constraint[i] = solver.Add(E_S[i] - M * y[i] <= 0)
+            solver.Add(m[i] + y[i] <= 1)
+
+        for i in interval:
+            solver.Add(E_C[i] <= charge_max[i] * c[i])
+            solver.Add(E_G[i] == E_GB[i] + E_GL[i])
+            # integer coefficients: with 0.9 * E_SB the preprocessing of CBC loses feasible
+            # plans, e.g. with a fixed first command, and returns worse plans as optimal
+            solver.Add(EFFICIENCY_SCALE * E_GB[i]
+                       >= EFFICIENCY_SCALE * charge_max[i] * c[i] - EFFICIENCY_NUMERATOR * E_SB[i])
+            solver.Add(EFFICIENCY_SCALE * E_C[i] == EFFICIENCY_NUMERATOR * E_SB[i] + EFFICIENCY_SCALE * E_GB[i])
+
+        addConstraintDisCharge(solver, interval, E_D, discharge_max, x)
+
+        # battery status constraints, history of battery status and fill level
+        # the initial value is a placeholder until solve() sets the real one
+        self.initial_constraint = addConstraintBatteryStatus(solver, interval, B, E_C, E_D, E_SB, B_c_min)
+
+        # consumption and solar balances, right hand sides are set in solve()
+        self.consumption_constraint = {i: solver.Add(E_SL[i] + E_D[i] + E_GL[i] == 0) for i in interval}
+        self.solar_constraint = {i: solver.Add(E_SB[i] + E_SL[i] + E_S[i] == 0) for i in interval}
+
+        self.objective = solver.Objective()
+        self.objective.SetMinimization()
+
+        # position of every variable in the solver, for reading all values at once
+        self.variable_index = {
+            name: np.array([group[i].index() for i in interval])
+            for name, group in self.variable_groups().items()
+        }
+
+        # bounds of the built model, update() returns to them without presolve
+        self.presolve = presolve
+        self.default_bounds = {
+            name: (np.array([group[i].lb() for i in interval]), np.array([group[i].ub() for i in interval]))
+            for name, group in self.variable_groups().items()
+        }
+        self.last_presolve = None
+
+        # rows of fix_first_command(), created on its first call
+        self.command_constraint = None
+
+        # command modes, only built with switch_penalty or min_dwell
+        self.a = {}
+        self.switch_on = None
+        self.switch_initial = None
+        self.switch_penalty = switch_penalty
+        self.min_dwell = min_dwell
+        if switch_penalty or min_dwell > 1:
+            self.add_switching(switch_penalty, min_dwell)
+
+        self.build_time = time.perf_counter() - start
+        self.solve_count = 0
+        self.last_status = None
+        self.last_timings = {}
+        self.last_warnings = []
+
+    def add_switching(self, switch_penalty=0, min_dwell=1):
+        """
+        Model the inverter command of every period and limit how often it changes.
+
+        The command is ACC (a = 1: c = 1 and E_GB >= 1), DIS (x = 1, E_D >= 1)
+        or NOD (a = x = 0), so it matches generate_commands() of the plan.
+        For every command k a continuous start-up variable u_k[i] >= k[i] - k[i-1]
+        counts the periods in which k starts, every change starts exactly one
+        command. The objective pays switch_penalty ct per start-up, and the
+        minimum dwell uses the tight min-up-time rows of unit commitment
+
+            sum(u_k[t] for t in i - min_dwell + 1 .. i) <= k[i]
+
+        instead of Big-M constraints, so the LP relaxation stays strong and
+        u_k needs no integrality. The solve takes about 2 to 20 times as
+        long as without switching (see solve_solar()).
+
+        Args:
+            switch_penalty: Cost of every command change (ct)
+            min_dwell: Minimum number of periods a command is kept after a change
+        """
+        from result import COST_SCALE
+
+        solver = self.solver
+        interval = self.interval
+        c, x, E_D, E_GB = self.c, self.x, self.E_D, self.E_GB
+        infinity = solver.infinity()
+
+        self.a = a = {i: solver.BoolVar(f"a_{i}") for i in interval}
+        for i in interval:
+            solver.Add(a[i] <= c[i])
+            solver.Add(E_GB[i] <= self.charge_max[i] * a[i])
+            solver.Add(E_GB[i] >= a[i])
+            solver.Add(E_D[i] >= x[i])
+
+        # mode k[i] as (coefficients, constant): ACC = a, DIS = x, NOD = 1 - a - x
+        def mode(command, i):
+            if command == "ACC":
+                return [(a[i], 1)], 0
+            if command == "DIS":
+                return [(x[i], 1)], 0
+            return [(a[i], -1), (x[i], -1)], 1
+
+        self.switch_on = u = {command: {i: solver.NumVar(0, 1, f"u_{command}_{i}") for i in interval}
+                              for command in SWITCH_COMMANDS}
+        self.switch_initial = {}
+        for command in SWITCH_COMMANDS:
+            for i in interval:
+                # u_k[i] - k[i] + k[i-1] >= 0, for i = 0 the previous command is set in update()
+                terms, constant = mode(command, i)
+                row = solver.Constraint(constant if i > 0 else -infinity, infinity)
+                row.SetCoefficient(u[command][i], 1)
+                for var, coefficient in terms:
+                    row.SetCoefficient(var, -coefficient)
+                if i > 0:
+                    previous_terms, previous_constant = mode(command, i - 1)
+                    for var, coefficient in previous_terms:
+                        row.SetCoefficient(var, coefficient)
+                    row.SetLb(constant - previous_constant)
+                else:
+                    self.switch_initial[command] = row
+
+                # minimum dwell: a command started in the last min_dwell periods is still active
+                if min_dwell > 1:
+                    row = solver.Constraint(-infinity, constant)
+                    for t in range(max(0, i - min_dwell + 1), i + 1):
+                        row.SetCoefficient(u[command][t], 1)
+                    for var, coefficient in terms:
+                        row.SetCoefficient(var, row.GetCoefficient(var) - coefficient)
+
+        self.switch_penalty = switch_penalty
+        self.min_dwell = min_dwell
+        for command in SWITCH_COMMANDS:
+            for i in interval:
+                self.objective.SetCoefficient(u[command][i], switch_penalty * COST_SCALE)
+
+    def update(self, C, P, S, B_c_initial, P_solar, P_loaded, import_max=None, export_max=None,
+               previous_command=None):
+        """
+        Set the per-solve data on the already built model.
+
+        Args:
+            C: Consumption per period (Wh), indexable by 0..horizon-1
+            P: Grid price per period, indexable by 0..horizon-1
+            S: Solar production per period (Wh), indexable by 0..horizon-1
+            B_c_initial: Battery capacity at the start (Wh)
+            P_solar: Price for selling solar energy, a number or indexable by 0..horizon-1
+            P_loaded: Value of the energy left in the battery at the end
+            import_max: Optional limit of the grid import per period (Wh), indexable by 0..horizon-1
+            export_max: Optional limit of the export per period (Wh), indexable by 0..horizon-1
+            previous_command: Command sent before the horizon, a change in the first period
+                is then paid as well (only with add_switching())
+        """
+        self.initial_constraint.SetBounds(B_c_initial, B_c_initial)
+
+        if not self.presolve and self.last_presolve is not None:
+            # presolve was switched off, E_G and E_S are set below again
+            self.set_bounds(self.default_bounds)
+            self.last_presolve = None
+
+        if self.switch_initial:
+            for command, row in self.switch_initial.items():
+                # u_k[0] >= k[0] - (previous == k), without previous command the row is free
+                constant = 1 if command == "NOD" else 0
+                if previous_command is None:
+                    row.SetLb(-self.solver.infinity())
+                else:
+                    row.SetLb(constant - (1 if previous_command == command else 0))
+
+        solar_per_period = not isinstance(P_solar, numbers.Number)
+        infinity = self.solver.infinity()
+
+        for i in self.interval:
+            self.E_G[i].SetUb(infinity if import_max is None else float(import_max[i]))
+            self.E_S[i].SetUb(infinity if export_max is None else float(export_max[i]))
+
+            self.consumption_constraint[i].SetBounds(C[i], C[i])
+            self.solar_constraint[i].SetBounds(S[i], S[i])
+
+            # import is at most the load plus a full charge, export at most the solar production,
+            # so M = 10000 can be replaced by the smaller value without changing the model
+            self.import_constraint[i].SetCoefficient(self.m[i], -min(self.big_m[i], C[i] + self.charge_max[i]))
+            self.export_constraint[i].SetCoefficient(self.y[i], -min(self.big_m[i], S[i]))
+
+            # we must pay all the energy we bought from outside
+            self.objective.SetCoefficient(self.E_G[i], P[i])
+            #we get the money from E_S energy
+            self.objective.SetCoefficient(self.E_S[i], -(P_solar[i] if solar_per_period else P_solar))
+
+            # possible other objective funktion
+            #    #objective function for the battery and whats inside
+            #        #the loaded energy has a price, if the inital enery was used, it must be payed
+            #    objective.SetCoefficient(E_U[i], P_loaded - P[i])
+            #        #the left over inside the battery is something positiv, we still have this value
+            #    objective.SetCoefficient(E_0[interval[-1]], -P_loaded)
+            #        #if we load more inside the battery, we create value
+            #    objective.SetCoefficient(E_B, -avg_price)
+
+        #rate the energy level at the last step
+        self.objective.SetCoefficient(self.B[self.interval[-1]], -P_loaded)
+
+        if self.presolve:
+            self.apply_presolve(C, S, B_c_initial, import_max, export_max)
+
+    def apply_presolve(self, C, S, B_c_initial, import_max=None, export_max=None):
+        """
+        Set the bounds of presolve.bounds() for this data on the model, the
+        reduction is stored in last_presolve (see presolve.statistics()).
+        """
+        def series(values):
+            return None if values is None else np.array([values[i] for i in self.interval], dtype=float)
+
+        bounds = presolve_bounds.bounds(
+            series(C), series(S), B_c_initial, self.B_c_min, self.B_c_max,
+            np.array(self.charge_max, dtype=float), np.array(self.discharge_max, dtype=float),
+            EFFICIENCY, series(import_max), series(export_max),
+        )
+        self.set_bounds(bounds)
+        self.last_presolve = presolve_bounds.statistics(bounds, self.default_bounds)
+        return self.last_presolve
+
+    def set_bounds(self, bounds):
+        """Set the variable bounds per variable name, (lower, upper) arrays over the horizon."""
+        infinity = self.solver.infinity()
+        groups = self.variable_groups()
+        for name, (lower, upper) in bounds.items():
+            group = groups[name]
+            for i in self.interval:
+                group[i].SetBounds(float(lower[i]), min(float(upper[i]), infinity))
+
+    def fix_first_command(self, command=None):
+        """
+        Restrict the first period to a battery command, None releases it again.
+
+        Args:
+            command: 'ACC' charges from the grid (c = 1, E_GB >= 1), 'DIS'
+                discharges (x = 1, E_D >= 1), 'NOD' neither charges from the
+                grid nor discharges (E_GB = 0, E_D = 0)
+        """
+        # rows instead of variable bounds, so the bounds of presolve in update() do not
+        # overwrite them; added on the first call, so the model is unchanged without it
+        if self.command_constraint is None:
+            self.command_constraint = {
+                "c": self.solver.Add(self.c[0] >= 0),
+                "x": self.solver.Add(self.x[0] >= 0),
+                "E_D": self.solver.Add(self.E_D[0] >= 0),
+                "E_GB": self.solver.Add(self.E_GB[0] >= 0),
+            }
+        rows = self.command_constraint
+        infinity = self.solver.infinity()
+        for row in rows.values():
+            row.SetBounds(0, infinity)
+
+        if command == "ACC":
+            rows["c"].SetBounds(1, 1)
+            rows["E_GB"].SetLb(1)
+        elif command == "DIS":
+            rows["x"].SetBounds(1, 1)
+            rows["E_D"].SetLb(1)
+        elif command == "NOD":
+            rows["E_D"].SetUb(0)
+            rows["E_GB"].SetUb(0)
+        elif command is not None:
+            raise ValueError(f"Unbekannter Befehl: {command}")
+
+    def variable_groups(self):
+        """Map of variable name to the per period variable dict."""
+        return {
+            "B": self.B, "E_C": self.E_C, "E_D": self.E_D,
+            "E_G": self.E_G, "E_GL": self.E_GL, "E_GB": self.E_GB,
+            "E_SB": self.E_SB, "E_SL": self.E_SL, "E_S": self.E_S,
+            "c": self.c, "x": self.x, "m": self.m, "y": self.y,
+        }
+
+    def values(self):
+        """
+        Values of the last solution, per variable name a NumPy array over the
+        horizon. All values are fetched from the solver in one call.
+        """
+        from ortools.linear_solver import linear_solver_pb2
+
+        response = linear_solver_pb2.MPSolutionResponse()
+        self.solver.FillSolutionResponseProto(response)
+        values = np.array(response.variable_value)
+        return {name: values[index] for name, index in self.variable_index.items()}
+
+    def solution_values(self):
+        """
+        Values of the last solution, per variable name a list over the horizon.
+        Can be shifted and passed to set_hint() as a warm start.
+        """
+        return {name: values.tolist() for name, values in self.values().items()}
+
+    def set_hint(self, values):
+        """
+        Pass a (partial) solution as warm start hint to the solver.
+
+        Args:
+            values: Dictionary like solution_values(), lists over the horizon
+        """
+        variables = []
+        hint = []
+        for name, group in self.variable_groups().items():
+            if name not in values:
+                continue
+            for i in self.interval:
+                variables.append(group[i])
+                hint.append(values[name][i])
+        self.solver.SetHint(variables, hint)
+
+    def lp_violations(self, tolerance=1e-6):
+        """
+        Conditions of the MILP which the last solution breaks. For a planner
+        built with an LP solver (LP_SOLVERS), which relaxes all integer
+        variables: without violations the LP solution is also a solution of
+        the MILP and, as the LP is a relaxation, an optimal one.
+
+        The integer variables (all energies and c) must be integral and no
+        period may charge and discharge or import and export at the same
+        time. Fractional x, m and y do not matter then, they are rounded up
+        where energy flows.
+
+        Returns:
+            list: One string per violation, empty if the solution is integral-consistent
+        """
+        v = self.values()
+        violations = []
+        for name in ("B", "E_C", "E_D", "E_G", "E_GL", "E_GB", "E_SB", "E_SL", "E_S", "c"):
+            for i in np.flatnonzero(np.abs(v[name] - np.round(v[name])) > tolerance):
+                violations.append(f"{i}: {name} = {v[name][i]:.3f} nicht ganzzahlig")
+        for i in np.flatnonzero((v["E_C"] > tolerance) & (v["E_D"] > tolerance)):
+            violations.append(f"{i}: Laden und Entladen gleichzeitig")
+        for i in np.flatnonzero((v["E_G"] > tolerance) & (v["E_S"] > tolerance)):
+            violations.append(f"{i}: Bezug und Einspeisung gleichzeitig")
+        return violations
+
+    def solve(self, C, P, S, B_c_initial, P_solar, P_loaded, printEnabled=0, time_limit_ms=None,
+              import_max=None, export_max=None, relative_gap=None, previous_command=None):
+        """
+        Update the model with new data and solve it.
+
+        Returns a SolarResult (iterable as the 9 lists of solve_solar). The timings of this run are
+        stored in last_timings ("build", "update", "solve", "extract"), where
+        "build" is only non zero for the first solve of the planner.
+
+        With time_limit_ms the solver stops after the given time and the best
+        incumbent found so far is returned (status FEASIBLE), its gap to the
+        best bound is in result.gap. With relative_gap the solver stops as soon
+        as the incumbent is proven within this relative gap (e.g. 0.01 for 1 %).
+        import_max and export_max limit the grid exchange per period and
+        previous_command is the command sent before the horizon, see update().
+        """
+        from ortools.linear_solver import pywraplp
+
+        start = time.perf_counter()
+        self.update(C, P, S, B_c_initial, P_solar, P_loaded, import_max, export_max, previous_command)
+        update_time = time.perf_counter() - start
+
+        # 0 removes a previously set limit
+        self.solver.SetTimeLimit(int(time_limit_ms) if time_limit_ms else 0)
+        parameters = pywraplp.MPSolverParameters()
+        if relative_gap is not None:
+            parameters.SetDoubleParam(parameters.RELATIVE_MIP_GAP, relative_gap)
+
+        start = time.perf_counter()
+        status = self.solver.Solve(parameters)
+        solve_time = time.perf_counter() - start
+        self.last_status = status
+
+        start = time.perf_counter()
+        result = self._extract(status, C, P, S, printEnabled)
+        extract_time = time.perf_counter() - start
+
+        self.last_timings = {
+            "build": self.build_time if self.solve_count == 0 else 0.0,
+            "update": update_time,
+            "solve": solve_time,
+            "extract": extract_time,
+        }
+        self.solve_count += 1
+        if instrument.enabled():
+            instrument.emit(self.solve_event(result))
+        return result
+
+    def solve_event(self, result):
+        """Instrumentation event of the last solve, see instrument.py."""
+        solver = self.solver
+        objective = result.objective if result else None
+        # the best bound is only meaningful if the solver found a solution
+        best_bound = solver.Objective().BestBound() if result else None
+        timings = self.last_timings
+        return {
+            "backend": self.solver_name,
+            "status": result.status,
+            "periods": self.horizon,
+            "objective": objective,
+            "variables": solver.NumVariables(),
+            "constraints": solver.NumConstraints(),
+            "binaries": len(self.c) + len(self.x) + len(self.m) + len(self.y) + len(self.a),
+            "build_s": timings["build"],
+            "update_s": timings["update"],
+            "solve_s": timings["solve"],
+            "extract_s": timings["extract"],
+            "iterations": solver.iterations(),
+            # LP solvers have no branch and bound nodes
+            "nodes": solver.nodes() if self.solver_name not in LP_SOLVERS else None,
+            "best_bound": best_bound,
+            "gap": result.gap,
+            "states": None,
+            "warnings": list(self.last_warnings),
+            "presolve": self.last_presolve,
+        }
+
+    def _extract(self, status, C, P, S, printEnabled):
+        B_c_max = self.B_c_max
+        B_discharge_max = np.array(self.discharge_max)
+        self.last_warnings = warnings = []
+
+        status_name = STATUS_NAMES.get(status, str(status))
+        if status_name == "FEASIBLE":
+            # only reachable with a time limit, the incumbent is still a valid plan
+            if printEnabled:
+                print("Zulässige (aber evtl. nicht optimale) Lösung gefunden")
+        elif status_name != "OPTIMAL":
+            if printEnabled:
+                print("Keine optimale Lösung gefunden")
+            return SolarResult.empty(status_name)
+
+        objective = self.solver.Objective().Value()
+        if printEnabled:
+            print("Zielfunktionswert =", objective)
+
+        # all values in one call instead of one solution_value() per variable
+        v = self.values()
+        B, E_C, E_D = v["B"], v["E_C"], v["E_D"]
+        E_G, E_GL, E_GB = v["E_G"], v["E_GL"], v["E_GB"]
+        E_SB, E_SL, E_S = v["E_SB"], v["E_SL"], v["E_S"]
+        c, x, m, y = v["c"], v["x"], v["m"], v["y"]
+        C_values = np.array([C[i] for i in self.interval], dtype=float)
+        P_values = np.array([P[i] for i in self.interval], dtype=float)
+        S_values = np.array([S[i] for i in self.interval], dtype=float)
+
+        soc = B / B_c_max * 100  # SOC in %
+
+        # consistency checks of the solution, vectorized over all periods,
+        # the findings go into the instrumentation event
+        for i in np.flatnonzero(E_D > B_discharge_max):
+            warnings.append(f"{i}: Error Discharge Value too hight")
+
+        for i in np.flatnonzero((E_S > 0) & (E_G > 0)):
+            warnings.append(f"{i}: Error E_S and Buying is impossible at the same time"
+                            f" (Charge: {E_C[i]}, davon Solar: {round(E_SB[i])} und davon Grid {round(E_GB[i])},"
+                            f" Consum: {C_values[i]}, davon Solar: {round(E_SL[i])} und davon Grid {round(E_GL[i])},"
+                            f" Verfügbarer Solarstrom: {S_values[i]}, davon verkauft: {E_S[i]},"
+                            f" Import?: {m[i]}, Export?: {y[i]})")
+
+        for i in np.flatnonzero((c == 0) & ((np.round(E_SB) > 0) | (np.round(E_GB) > 0))):
+            warnings.append(f"{i}: Error is Charging must be set, if loading occures")
+
+        for i in np.flatnonzero((c == 1) & (x == 1)):
+            warnings.append(f"{i}: Error is Charging and is Discharging must never be 1 at the same time")
+
+        if self.solver_name in LP_SOLVERS:
+            # relaxed model: the violations decide whether the MILP is needed
+            warnings.extend(self.lp_violations())
+
+        if(printEnabled):
+            for warning in warnings:
+                print(warning)
+
+            # Header mit Tabs
+            print(
+                f"Step\tUsed\tOutside\tKosten\tSolar\tSold\tSOC(%)\tBC\tBDC\tSolTB\tOuTB\tinitial\tBS"
+            )
+
+            for i in self.interval:
+                print(
+                    f"{i}\t"
+                    f"{C[i]}\t"
+                    f"{E_G[i]}\t"
+                    f"{P[i]}\t"
+                    f"{S[i]}\t"
+                    f"{E_S[i]}\t"
+                    f"{soc[i]:.1f}\t"  # SOC in %
+                    f"{E_C[i]}\t"
+                    f"{E_D[i]}\t"
+                    f"{round(E_SB[i])}\t"
+                    f"{round(E_GB[i])}\t"
+                    f"{B[i]:.1f}"
+                )
+
+        return SolarResult(
+            soc=soc,
+            energy_bought=E_G,
+            battery_discharge=E_D,
+            battery_charge=E_C,
+            solar_energy=S_values,
+            is_charging=c,
+            is_discharging=x,
+            outside_to_battery=E_GB,
+            solar_to_battery=E_SB,
+            price=P_values,
+            consumption=C_values,
+            energy_sold=E_S,
+            status=STATUS_NAMES.get(status, str(status)),
+            objective=objective,
+            gap=instrument.mip_gap(objective, self.solver.Objective().BestBound()),
+        )
+
+
+def lp_applicable(interval, P, P_solar):
+    """
+    True if the LP relaxation is worth a try: sold energy pays less than
+    EFFICIENCY times every buy price. Then importing and exporting in the
+    same period, or charging from the grid while PV is exported, only loses
+    money, so the LP optimum mostly keeps the exclusivity of the binaries.
+    Otherwise the LP uses the relaxed binaries for arbitrage and the MILP is
+    solved directly.
+    """
+    buy = min(P[i] for i in interval)
+    if isinstance(P_solar, numbers.Number):
+        sell = P_solar
+    else:
+        sell = max(P_solar[i] for i in interval)
+    return sell < EFFICIENCY * buy
+
+
+def solve_relaxed(interval, C, P, P_solar, S, B_c_initial, B_c_min, B_charge_max, B_discharge_max, B_c_max,
+                  P_loaded, printEnabled=0, lp_solver="GLOP", durations=None):
+    """
+    Solve the LP relaxation of the model and check it with lp_violations().
+
+    Returns:
+        tuple: (SolarResult or None, violations), the result only if the LP
+               solution is a solution of the MILP, with rounded energies and
+               is_discharging = 1 where the battery discharges
+    """
+    planner = SolarPlanner(len(interval), B_c_min, B_c_max, B_charge_max, B_discharge_max, lp_solver,
+                           durations=durations)
+    # the relaxed flags are no commands, the checks of _extract would only report them
+    result = planner.solve(C, P, S, B_c_initial, P_solar, P_loaded, printEnabled=0)
+    if not result:
+        return None, [f"LP {result.status}"]
+    violations = planner.lp_violations()
+    if violations:
+        return None, violations
+
+    result = SolarResult(
+        soc=result.soc,
+        energy_bought=np.round(result.energy_bought),
+        battery_discharge=np.round(result.battery_discharge),
+        battery_charge=np.round(result.battery_charge),
+        solar_energy=result.solar_energy,
+        is_charging=np.round(result.is_charging),
+        is_discharging=(np.round(result.battery_discharge) > 0).astype(float),
+        outside_to_battery=np.round(result.outside_to_battery),
+        solar_to_battery=np.round(result.solar_to_battery),
+        price=result.price,
+        consumption=result.consumption,
+        energy_sold=np.round(result.energy_sold),
+        status="OPTIMAL",
+        objective=result.objective,
+        gap=0.0,
+    )
+    if printEnabled:
+        print("LP-Lösung ist ganzzahlig, kein MILP nötig")
+        print("Zielfunktionswert =", result.objective)
+    return result, []
+
+
+def fallback_plan(interval, C, P, P_solar, S, B_c_initial, B_c_min, B_charge_max,
+                  B_discharge_max, B_c_max, P_loaded, printEnabled=0, durations=None):
+    """
+    Deterministic plan when the MILP has no incumbent within its time limit:
+    the DP engine on a coarse SOC grid (FALLBACK_RESOLUTION), and if even that
+    has no plan, the idle plan without battery actions. The time of both only
+    depends on the horizon, not on the data.
+
+    Returns:
+        SolarResult: status "HEURISTIC", never empty
+    """
+    result = solve_solar_dp(
+        interval, C, P, P_solar, S, B_c_initial, B_c_min, B_charge_max, B_discharge_max,
+        B_c_max, P_loaded, None, 0, None, printEnabled, soc_resolution=FALLBACK_RESOLUTION,
+        durations=durations,
+    )
+    if not result:
+        return idle_plan(interval, C, P, P_solar, S, B_c_initial, B_c_max, P_loaded)
+    result.status = "HEURISTIC"
+    # the gap to the MILP optimum is unknown
+    result.gap = None
+    return result
+
+
+def switching_cost(planner, result, previous_command=None):
+    """
+    Cost of the command changes of a plan in the objective of a planner with
+    add_switching(), None if the plan breaks its min_dwell.
+
+    Like in the model, the first period only counts as a change if it differs
+    from previous_command, and the last command may be cut by the end of the horizon.
+    """
+    from batteryCommands.custom import COMMAND_NAMES, FAILURE, command_runs, encode_commands
+    from result import COST_SCALE
+
+    codes = encode_commands(result.is_discharging, result.battery_discharge, result.is_charging,
+                            result.outside_to_battery, result.solar_to_battery)
+    if np.any(codes == FAILURE):
+        return None
+    starts, ends, run_codes = command_runs(codes)
+    changes = 0
+    for start, end, code in zip(starts.tolist(), ends.tolist(), run_codes.tolist()):
+        if start == 0 and (previous_command is None or previous_command == COMMAND_NAMES[code]):
+            continue
+        if end - start < planner.min_dwell and end < len(codes):
+            return None
+        changes += 1
+    return changes * planner.switch_penalty * COST_SCALE
+
+
+def anytime_result(planner, result, interval, C, P, P_solar, S, B_c_initial, P_loaded, printEnabled=0,
+                   previous_command=None):
+    """
+    Result of a solve with time limit. If the solver stopped before it proved
+    optimality, the fallback_plan() is computed as well and the cheaper plan
+    is returned; early CBC incumbents are often worse than the coarse DP plan.
+    The fallback plan is feasible for the MILP, so its gap to the best bound
+    of the solver is known if the solver found an incumbent.
+
+    The DP fallback knows no switching: with add_switching() its command
+    changes are added to its objective (switching_cost()), and if it breaks
+    min_dwell the idle plan (a single NOD run) is the fallback instead.
+    """
+    if result.status == "OPTIMAL":
+        return result
+    fallback = fallback_plan(interval, C, P, P_solar, S, B_c_initial, planner.B_c_min, planner.B_charge_max,
+                             planner.B_discharge_max, planner.B_c_max, P_loaded, printEnabled,
+                             durations=planner.durations)
+    if planner.switch_on is not None:
+        cost = switching_cost(planner, fallback, previous_command)
+        if cost is None:
+            fallback = idle_plan(interval, C, P, P_solar, S, B_c_initial, planner.B_c_max, P_loaded)
+            cost = switching_cost(planner, fallback, previous_command)
+        fallback.objective += cost
+    if not result:
+        return fallback
+    if fallback.objective < result.objective:
+        fallback.gap = instrument.mip_gap(fallback.objective, planner.solver.Objective().BestBound())
+        return fallback
+    return result
+
+
+def solve_solar_chunked(interval, C, P, P_solar, S, B_c_initial, B_c_min, B_charge_max,
+                        B_discharge_max, B_c_max, P_loaded, printEnabled=0,
+                        chunk=96, lookahead=48, backend="CBC", num_threads=None, time_limit_ms=None,
+                        relative_gap=None, switch_penalty=0, min_dwell=1, durations=None, presolve=False):
+    """
+    Long horizons (e.g. 672 periods for a week) split into chunks.
+
+    Every chunk is solved with lookahead extra periods, only the first chunk
+    periods are kept and the battery state at their end is the initial state
+    of the next chunk. The solve time grows linearly with the horizon, while a
+    single MILP over the whole week grows much faster. The planner for a
+    window length is built once and reused for all chunks. With time_limit_ms
+    every chunk returns its best incumbent after that time, a chunk without
+    incumbent gets the fallback_plan() instead. relative_gap is passed to
+    every chunk. With switch_penalty / min_dwell (see SolarPlanner.add_switching())
+    the last command of a chunk is the previous command of the next one.
+    durations (slot minutes) are cut into windows like the data. presolve is
+    passed to the planners and applied for every chunk.
+
+    Returns:
+        SolarResult: The joined plan, status FEASIBLE because the chunks are
+                     not optimal for the whole horizon
+    """
+    from batteryCommands.custom import generate_commands
+
+    n = len(interval)
+    planners = {}
+    parts = []
+    B_start = B_c_initial
+    previous_command = None
+
+    for start in range(0, n, chunk):
+        window = interval[start:start + chunk + lookahead]
+        window_durations = None if durations is None else list(durations[start:start + len(window)])
+        key = (len(window), None if window_durations is None else tuple(window_durations))
+        if key not in planners:
+            planners[key] = SolarPlanner(len(window), B_c_min, B_c_max, B_charge_max,
+                                         B_discharge_max, backend, num_threads,
+                                         switch_penalty=switch_penalty, min_dwell=min_dwell,
+                                         durations=window_durations, presolve=presolve)
+        planner = planners[key]
+
+        C_window = [C[i] for i in window]
+        P_window = [P[i] for i in window]
+        S_window = [S[i] for i in window]
+
+        result = planner.solve(
+            C=C_window,
+            P=P_window,
+            S=S_window,
+            B_c_initial=B_start,
+            P_solar=P_solar,
+            P_loaded=P_loaded,
+            printEnabled=printEnabled,
+            time_limit_ms=time_limit_ms,
+            relative_gap=relative_gap,
+            previous_command=previous_command,
+        )
+        if time_limit_ms:
+            result = anytime_result(planner, result, list(range(len(window))), C_window, P_window, P_solar,
+                                    S_window, B_start, P_loaded, printEnabled, previous_command)
+        elif not result:
+            return result
+
+        keep = min(chunk, n - start)
+        parts.append(result.head(keep))
+        # SOC boundary condition for the next chunk
+        B_start = int(round(result.soc[keep - 1] * B_c_max / 100))
+        previous_command = generate_commands(
+            [keep - 1], result.is_discharging, result.battery_discharge,
+            result.is_charging, result.outside_to_battery, result.solar_to_battery
+        )[keep - 1]
+
+    return SolarResult.concatenate(parts)
+
+
 def solve_solar(interval,
                 C,
                 P,
@@ -23,251 +877,211 @@ def solve_solar(interval,
                 B_c_min,
                 B_charge_max,
                 B_discharge_max,
-                B_c_max, 
+                B_c_max,
                 P_loaded,
                 battery_target_capacity,
                 mustLoadFirst, min_battery_discharge,
-                printEnabled):
-    
-    solver = pywraplp.Solver.CreateSolver("CBC")  # oder "SCIP"
-
-    if not solver:
-        raise RuntimeError("Solver konnte nicht erstellt werden")
-       
-    #-----------------------Battery Variables
-    B     = {i: solver.IntVar(B_c_min, B_c_max,       f"B_{i}")          for i in interval}
-    E_C   = {i: solver.IntVar(0, B_charge_max,        f"E_C_{i}")        for i in interval}
-    E_D   = {i: solver.IntVar(0, B_discharge_max,     f"E_D_{i}")        for i in interval}
-
-    #-----------------------Energy Flow Variables
-    E_G   = {i: solver.IntVar(0, solver.infinity(),   f"E_G_{i}")        for i in interval}
-    E_GL  = {i: solver.IntVar(0, solver.infinity(),   f"E_GL_{i}")       for i in interval}
-    E_GB  = {i: solver.IntVar(0, B_charge_max,        f"E_GB_{i}")       for i in interval}
-    
-    E_SB  = {i: solver.IntVar(0, B_discharge_max,     f"E_SB_{i}")       for i in interval}
-    E_SL  = {i: solver.IntVar(0, solver.infinity(),   f"E_SL_{i}")       for i in interval}
-    E_S   = {i: solver.IntVar(0, solver.infinity(),   f"E_S_{i}")        for i in interval}
-
-    #---------------------Initial Energy Variables
-    #E_0   = {i: solver.IntVar(0, B_c_initial,         f"E_0_{i}")        for i in interval}
-    #E_U   = {i: solver.IntVar(0, B_c_initial,         f"E_U_{i}")        for i in interval}
-    #E_B   = solver.IntVar(-solver.infinity(), solver.infinity(), "E_B")
-    
-    #---------------------Binary Control Variables
-    d     = {i: solver.BoolVar(f"d_{i}")                             for i in interval}
-    c     = {i: solver.BoolVar(f"c_{i}")                             for i in interval}
-    x     = {i: solver.BoolVar(f"x_{i}")                             for i in interval}
-    m     = {i: solver.BoolVar(f"m_{i}")                             for i in interval}
-    y     = {i: solver.BoolVar(f"y_{i}")                             for i in interval}
-
-    M = 10000
-    
-    for i in interval:
-            #set the variable c
-            # it must be 1 in case the B goes up
-            # and it must be 0 in case the battery does not change or discharge is happening
-                #solver.Add(B[i] >= B[i-1] + delta - B_c_max * (1 - c[i]))
-                #solver.Add(B[i] <= B[i-1] + B_c_max * c[i])
-            #set the variable x
-            # it must be 1 in case the B goes down
-            # and it must be 0 in case the battery does not change or charge is happening
-                #solver.Add(B[i] <= B[i-1] - delta + B_c_max * (1 - x[i]))
-                #solver.Add(B[i] >= B[i-1] - B_c_max * x[i])
-
-            solver.Add(c[i] + x[i] <= 1)
-            
-            solver.Add(E_GL[i] + E_GB[i] <= M * m[i])
-            solver.Add(E_S[i] <= M * y[i])
-            solver.Add(m[i] + y[i] <= 1)
-
-
-    for i in interval:
-        solver.Add(E_C[i] <= B_charge_max * c[i])
-        solver.Add(E_G[i] == E_GB[i] + E_GL[i])
-        solver.Add(E_GB[i] >= B_charge_max * c[i] - E_SB[i]*0.9)
-        solver.Add(E_C[i] == E_SB[i] * 0.9 + E_GB[i])
-
-
-    addConstraintDisCharge(solver, interval, E_D, B_discharge_max, x)
-
-    #constraint for bool variable d
-    # in case the battery was at under 30 % the inverter will first load the battery to 80 % before allowing the battery to discharge
-    #if(mustLoadFirst):
-    #    for i in interval:
-    #        if(i == 0):
-    #            #initially the variable is based on the initial battery status
-    #            solver.Add( d[i] <= (B[i] / min_battery_discharge))
-    #        else:
-    #            # in case the 
-    #            solver.Add(d[i] <= (B[i] / min_battery_discharge) + d[i-1])
-    #        solver.Add(E_D[i] >= -B_discharge_max * d[i])
-    #        solver.Add(E_C[i] <= B_charge_max)
-
-    # battery status constraints, history of battery status and fill level
-    addConstraintBatteryStatus(solver, interval, B, E_C, E_D, E_SB, B_c_initial )
-
-
-
-    #initialEnergyLeft
-    #solver.Add(E_0[0] == B_c_initial)
-    #for i in interval:
-    #    solver.Add(E_0[i] <= B[i])
-    #    
-    #for i in interval:
-    #    solver.Add(
-    #        E_0[i]
-    #        >= B_c_initial
-    #        - sum(E_D[j] for j in interval if j <= i)
-    #    )
-    
+                printEnabled,
+                backend="CBC",
+                soc_resolution=10,
+                num_threads=None,
+                chunk=None,
+                lookahead=48,
+                chunk_time_limit_ms=None,
+                time_limit_ms=None,
+                relative_gap=None,
+                switch_penalty=0,
+                min_dwell=1,
+                durations=None,
+                dump=None,
+                dump_slower_than=None,
+                lp_first=None,
+                presolve=False,
+                history=None,
+                start_time=None):
+    """
+    Solve the battery schedule for one horizon.
 
-    for i in interval:
-        solver.Add(C[i] == E_SL[i] + E_D[i] + E_GL[i] )
-        solver.Add(S[i] == E_SB[i] + E_SL[i] + E_S[i])
-    
-    #if one would want to disable switching
-    #switch = {}
-    #for i in interval[1:]:
-    #    switch[i] = solver.BoolVar(f"switch_{i}")
-    #
-    #for i in interval[1:]:
-    #    solver.Add(switch[i] >= c[i] - c[i-1])
-    #    solver.Add(switch[i] >= c[i-1] - c[i])
-
-    
-    #solver.Add(E_B == B[interval[-1]] - E_0[interval[-1]])
-    
-    #for i in interval:
-    #    solver.Add(E_U[i] == B_c_initial - E_0[i])
-        
-    objective = solver.Objective()
-    min_price = min(P.values())
-    avg_price = sum(P.values()) / len(P)
-
-
-    battery_objective_new = False
-    for i in interval:
+    backend selects the engine: "CBC" or "SCIP" build the MILP with
+    pywraplp, "CP_SAT" the same model integer-exact for CP-SAT (see
+    cpsat_solver.py), "DP" uses the dynamic programming engine of dp_solver.py
+    with SOC buckets of soc_resolution Wh. All backends return the same lists.
+    num_threads is passed to the MILP solver, for CP_SAT it is the number of
+    search workers (None: all cores).
 
-        # we must pay all the energy we bought from outside
-        objective.SetCoefficient(E_G[i], P[i])
-        #we get the money from E_S energy
-        objective.SetCoefficient(E_S[i], -P_solar)
-
-        # possible other objective funktion
-        #    #objective function for the battery and whats inside
-        #        #the loaded energy has a price, if the inital enery was used, it must be payed
-        #    objective.SetCoefficient(E_U[i], P_loaded - P[i])
-        #        #the left over inside the battery is something positiv, we still have this value
-        #    objective.SetCoefficient(E_0[interval[-1]], -P_loaded)
-        #        #if we load more inside the battery, we create value
-        #    objective.SetCoefficient(E_B, -avg_price)
-        
-        #rate the energy level at the last step
-        objective.SetCoefficient(B[interval[-1]], -P_loaded)
+    With chunk, CBC and SCIP solve horizons longer than chunk periods in chunks of
+    chunk periods (plus lookahead), see solve_solar_chunked. chunk_time_limit_ms
+    limits every chunk, so the solve time stays linear in the horizon.
 
+    time_limit_ms limits the MILP solve: after that time the best incumbent
+    is returned (status FEASIBLE, its gap in result.gap), or the deterministic
+    fallback_plan() (status HEURISTIC, about 15 ms for 96 periods) if there is
+    no incumbent or the fallback is cheaper, see anytime_result(). So there is
+    always a plan shortly after the limit.
+    relative_gap stops the MILP as soon as the incumbent is proven within
+    this gap (e.g. 0.01). The DP backend ignores both, it is always fast.
 
-            #could be used to price the intial start energy
-        #objective.SetCoefficient(E_0[0], -P_loaded)
+    switch_penalty (ct per command change) and min_dwell (periods a command
+    is kept at least) make the command schedule less fragmented, see
+    SolarPlanner.add_switching(). They need a MILP backend and cost solve
+    time: with CBC 19.01 takes 0.2 s without switching and 0.4 to 0.8 s with
+    switch_penalty=5 / min_dwell=4, 25.11 up to 3.7 s and the 192 periods of
+    19.20.01 0.5 s without and 2 to 8 s with switching. SCIP is in the same
+    range.
 
-        #if we load more inside the battery, we create value
-        #objective.SetCoefficient(B[interval[-1]], -P_loaded)
+    durations gives the length of every period in minutes for grids with
+    slots of different length (see timegrid.py). B_charge_max, B_discharge_max
+    and the import / export limit M are then per 15 minutes and scaled with
+    the slot duration; C, S and P must be given on the same grid.
 
-        #reduce over all outside power
-        #objective.SetCoefficient(E_G[i],2000)
+    dump is a directory for replay.dump_instance(): the inputs, settings,
+    outcome and (for CBC / SCIP) the built model are written there, with
+    dump_slower_than only for solves without an optimal plan or slower than
+    this many seconds. `python replay.py` solves the dumps again.
 
-        #if(i > 0):
-        #    objective.SetCoefficient(switch[i], 5000000)
+    lp_first ("GLOP" or "PDLP") first solves the LP relaxation if
+    lp_applicable() holds for the prices, and returns it if it does not
+    violate the conditions of the binaries (SolarPlanner.lp_violations()).
+    Otherwise the MILP of backend is solved as usual. The path shows in the
+    instrumentation events (an event of the LP solver with the violations in
+    'warnings', followed by the MILP event if the MILP was needed) and with
+    printEnabled.
+    Only for CBC / SCIP without switching. It rarely pays off for this model:
+    charging always uses the full B_charge_max, so the LP charges fractions of
+    it and B is not integral. On the shipped days the LP is never accepted
+    (GLOP 45 to 201 violations, PDLP more) and only adds its solve time.
 
+    presolve fixes the binaries and tightens the bounds which the data
+    decides (see presolve.py) before every CBC / SCIP solve, the reduction
+    is in the 'presolve' field of the instrumentation event. It makes SCIP
+    faster, CBC derives the same itself and branches worse with the fixed
+    binaries on some profiles (python benchmark.py --presolve).
 
+    history is a history.HistoryStore: the plan is appended to its plans
+    table, start_time (datetime of the first period, None for the current
+    15 minute slot) places it in time.
+    """
+    if backend in ("DP", "CP_SAT") and (switch_penalty or min_dwell > 1):
+        raise ValueError("switch_penalty und min_dwell gibt es nur mit CBC oder SCIP")
+    if lp_first is not None and lp_first not in LP_SOLVERS:
+        raise ValueError(f"Unbekannter LP-Solver: {lp_first!r}, möglich sind {', '.join(LP_SOLVERS)}")
 
-    objective.SetMinimization()
+    start = time.perf_counter()
+    planner = None
+    # backend or LP solver which produced the plan, for the dump
+    solved_by = backend
+    if chunk and len(interval) > chunk and backend not in ("DP", "CP_SAT"):
+        result = solve_solar_chunked(
+            interval, C, P, P_solar, S, B_c_initial, B_c_min, B_charge_max,
+            B_discharge_max, B_c_max, P_loaded, printEnabled,
+            chunk=chunk, lookahead=lookahead, backend=backend, num_threads=num_threads,
+            time_limit_ms=chunk_time_limit_ms or time_limit_ms, relative_gap=relative_gap,
+            switch_penalty=switch_penalty, min_dwell=min_dwell, durations=durations, presolve=presolve,
+        )
 
-    status = solver.Solve()
+    elif backend == "DP":
+        result = solve_solar_dp(
+            interval, C, P, P_solar, S, B_c_initial, B_c_min, B_charge_max,
+            B_discharge_max, B_c_max, P_loaded, battery_target_capacity,
+            mustLoadFirst, min_battery_discharge, printEnabled,
+            soc_resolution=soc_resolution, durations=durations,
+        )
 
-    soc_list = []
-    energy_bought_list = []
-    battery_discharge_list = []
-    battery_charge_list = []
-    solar_energy_list = []
-    is_charging_list = []
-    is_discharging_list = []
-    outside_to_battery_list = []
-    solar_to_battery_list = []
+    elif backend == "CP_SAT":
+        result = solve_solar_cpsat(
+            interval, C, P, P_solar, S, B_c_initial, B_c_min, B_charge_max,
+            B_discharge_max, B_c_max, P_loaded, printEnabled,
+            num_workers=num_threads, time_limit_ms=time_limit_ms, relative_gap=relative_gap,
+            durations=durations,
+        )
+        if time_limit_ms and not result:
+            # no solution within the limit, a plan is needed anyway
+            result = fallback_plan(interval, C, P, P_solar, S, B_c_initial, B_c_min, B_charge_max,
+                                   B_discharge_max, B_c_max, P_loaded, printEnabled, durations=durations)
 
-    if status != pywraplp.Solver.OPTIMAL:
-        print("Keine optimale Lösung gefunden")
-        return soc_list, energy_bought_list, battery_discharge_list,battery_charge_list, solar_energy_list,is_charging_list, is_discharging_list, outside_to_battery_list,solar_to_battery_list
-    elif status == pywraplp.Solver.FEASIBLE:
-        print("Zulässige (aber evtl. nicht optimale) Lösung gefunden")
+    else:
+        #constraint for bool variable d
+        # in case the battery was at under 30 % the inverter will first load the battery to 80 % before allowing the battery to discharge
+        #if(mustLoadFirst):
+        #    for i in interval:
+        #        if(i == 0):
+        #            #initially the variable is based on the initial battery status
+        #            solver.Add( d[i] <= (B[i] / min_battery_discharge))
+        #        else:
+        #            # in case the
+        #            solver.Add(d[i] <= (B[i] / min_battery_discharge) + d[i-1])
+        #        solver.Add(E_D[i] >= -B_discharge_max * d[i])
+        #        solver.Add(E_C[i] <= B_charge_max)
 
-    print("Zielfunktionswert =", solver.Objective().Value())
-    
+        # switching costs and minimum dwell: switch_penalty / min_dwell, see SolarPlanner.add_switching()
 
-    # Header mit Tabs
-    print(
-        f"Step\tUsed\tOutside\tKosten\tSolar\tSold\tSOC(%)\tBC\tBDC\tSolTB\tOuTB\tinitial\tBS"
-    )
-
-    costs_without_balancing = 0
-    costs_with_balancing = 0
-    #costs_initial_energy = 0
-    energy_bought = 0
-    for i in interval:
-        soc_percent = (B[i].solution_value() / B_c_max) * 100  # SOC in %
-        soc_list.append(soc_percent)
-        
-        costs_without_balancing += C[i] * P[i]
-        costs_with_balancing += E_G[i].solution_value() * P[i]
-        #costs_initial_energy += E_U[i].solution_value() * P_loaded
-        energy_bought +=E_G[i].solution_value()
-        
-        energy_bought_list.append(E_G[i].solution_value())
-        battery_discharge_list.append(E_D[i].solution_value())
-        battery_charge_list.append(E_C[i].solution_value())
-        solar_energy_list.append(S[i])
-        is_charging_list.append(c[i].solution_value())
-        is_discharging_list.append(x[i].solution_value())
-        outside_to_battery_list.append(E_GB[i].solution_value())
-        solar_to_battery_list.append(E_SB[i].solution_value())
-
-        if(E_D[i].solution_value() > B_discharge_max):
-            print("Error Discharge Value too hight")
-
-        if(E_S[i].solution_value() > 0 and E_G[i].solution_value() > 0):
-            print("Error E_S and Buying is impossible at the same time")
-            print(f" Charge: {E_C[i].solution_value()}, davon Solar: {round(E_SB[i].solution_value())} also *0.9: {round(E_SB[i].solution_value()) *0.9} und davon Grid {round(E_GB[i].solution_value())} ")
-            print(f" Consum: {C[i]}, davon Solar: {round(E_SL[i].solution_value())} und davon Grid {round(E_GL[i].solution_value())} ")
-            print(f" Verfügbarer Solarstrom: {S[i]}, davon verkauft: {E_S[i].solution_value()}")
-            print(f" Import?: {m[i].solution_value()}, Export?: {y[i].solution_value()}")
-
-            
-
-        if(c[i].solution_value() == 0 and ( round(E_SB[i].solution_value()) > 0 or round(E_GB[i].solution_value()) > 0) ):
-            print("Error is Charging must be set, if loading occures")
-
-        if(c[i].solution_value() == 1 and x[i].solution_value() == 1 ):
-            print("Error is Charging and is Discharging must never be 1 at the same time")
+        result = None
+        lp_warnings = []
+        if lp_first and not (switch_penalty or min_dwell > 1):
+            if lp_applicable(interval, P, P_solar):
+                result, lp_warnings = solve_relaxed(interval, C, P, P_solar, S, B_c_initial, B_c_min,
+                                                    B_charge_max, B_discharge_max, B_c_max, P_loaded,
+                                                    printEnabled, lp_first, durations)
+            else:
+                lp_warnings = ["Verkaufspreis nicht unter EFFICIENCY * Bezugspreis, LP übersprungen"]
+            if result is not None:
+                solved_by = lp_first
+            elif printEnabled:
+                reason = lp_warnings[0] if len(lp_warnings) == 1 else f"{len(lp_warnings)} Verletzungen der LP-Lösung"
+                print("MILP wird gelöst:", reason)
 
+        if result is None:
+            planner = SolarPlanner(
+                horizon=len(interval),
+                B_c_min=B_c_min,
+                B_c_max=B_c_max,
+                B_charge_max=B_charge_max,
+                B_discharge_max=B_discharge_max,
+                solver_name=backend,
+                num_threads=num_threads,
+                switch_penalty=switch_penalty,
+                min_dwell=min_dwell,
+                durations=durations,
+                presolve=presolve,
+            )
 
-        if(printEnabled):
-            print(
-                f"{i}\t"
-                f"{C[i]}\t"
-                f"{E_G[i].solution_value()}\t"
-                f"{P[i]}\t"
-                f"{S[i]}\t"
-                f"{E_S[i].solution_value()}\t"
-                f"{soc_percent:.1f}\t"  # SOC in %
-                f"{E_C[i].solution_value()}\t"
-                #f"{c[i].solution_value()}\t"
-                #f"{x[i].solution_value()}\t"
-                f"{E_D[i].solution_value()}\t"
-                f"{round(E_SB[i].solution_value())}\t"
-                f"{round(E_GB[i].solution_value())}\t"
-                #f"{round(E_SL[i].solution_value())}\t"
-                #f"{round(E_GL[i].solution_value())}\t"
-                #f"{E_0[i].solution_value():.1f}\t"
-                f"{B[i].solution_value():.1f}"
+            result = planner.solve(
+                C=C,
+                P=P,
+                S=S,
+                B_c_initial=B_c_initial,
+                P_solar=P_solar,
+                P_loaded=P_loaded,
+                printEnabled=printEnabled,
+                time_limit_ms=time_limit_ms,
+                relative_gap=relative_gap,
             )
+            if time_limit_ms:
+                # a plan is needed anyway, at worst the deterministic fallback
+                result = anytime_result(planner, result, interval, C, P, P_solar, S, B_c_initial, P_loaded, printEnabled)
 
-    return soc_list, energy_bought_list, battery_discharge_list,battery_charge_list, solar_energy_list,is_charging_list, is_discharging_list, outside_to_battery_list,solar_to_battery_list
\ No newline at end of file
+    if dump is not None:
+        seconds = time.perf_counter() - start
+        if replay.should_dump(result, seconds, dump_slower_than):
+            inputs = {
+                "interval": interval, "C": C, "P": P, "P_solar": P_solar, "S": S,
+                "B_c_initial": B_c_initial, "B_c_min": B_c_min, "B_charge_max": B_charge_max,
+                "B_discharge_max": B_discharge_max, "B_c_max": B_c_max, "P_loaded": P_loaded,
+                "battery_target_capacity": battery_target_capacity, "mustLoadFirst": mustLoadFirst,
+                "min_battery_discharge": min_battery_discharge,
+            }
+            settings = {
+                "backend": backend, "soc_resolution": soc_resolution, "num_threads": num_threads,
+                "chunk": chunk, "lookahead": lookahead, "chunk_time_limit_ms": chunk_time_limit_ms,
+                "time_limit_ms": time_limit_ms, "relative_gap": relative_gap,
+                "switch_penalty": switch_penalty, "min_dwell": min_dwell, "durations": durations,
+                "presolve": presolve, "lp_first": lp_first,
+            }
+            model = None if planner is None else replay.model_proto(planner)
+            replay.dump_instance(dump, inputs, settings, result, seconds, model, solved_by)
+    if history is not None:
+        if start_time is None:
+            now = datetime.datetime.now()
+            start_time = now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0)
+        record_plan(history, result, start_time, durations=durations)
+    return result
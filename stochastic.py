@@ -0,0 +1,314 @@
+"""
+Scenario based planning over PV and consumption forecast ensembles.
+
+Only the command of the first slot is sent before the next re-plan, so only
+this command has to be the same in all scenarios (non-anticipative). For
+every possible first command (ACC, DIS, NOD) and every scenario the rest of
+the horizon is planned with perfect knowledge of that scenario (recourse).
+The command with the lowest expected cost, optionally plus a CVaR term for
+the expensive scenarios, is chosen:
+
+    score = E[cost] + risk_weight * CVaR_alpha[cost]
+
+All (command, scenario) pairs are independent and solved in parallel. Large
+ensembles can first be reduced to n_keep scenarios by fast forward selection,
+the probabilities of removed scenarios go to the nearest kept scenario.
+
+    python stochastic.py 19.01 --scenarios 10 50 200 --keep 50 --risk 0.5
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+
+from dp_solver import solve_solar_dp
+
+COMMANDS = ("ACC", "DIS", "NOD")
+
+# per worker process: base inputs, scenarios and planners (MILP backends)
+_inputs = None
+_C_scenarios = None
+_S_scenarios = None
+_backend = None
+_soc_resolution = None
+_planners = {}
+
+
+def forecast_ensemble(C, S, K, seed=0, pv_sigma=0.35, load_sigma=0.15, correlation=0.9):
+    """
+    K samples around a forecast, for testing without real ensembles.
+
+    The errors are multiplicative and correlated in time (AR(1) with the
+    given correlation per slot). PV is additionally scaled per scenario, so
+    there are sunny and cloudy samples.
+
+    Args:
+        C: Consumption forecast per period (Wh)
+        S: PV forecast per period (Wh)
+        K: Number of scenarios
+
+    Returns:
+        tuple: (C scenarios, S scenarios), integer arrays K x periods
+    """
+    rng = np.random.default_rng(seed)
+    C = np.asarray(C, dtype=float)
+    S = np.asarray(S, dtype=float)
+    n = len(C)
+
+    def correlated(sigma):
+        noise = np.zeros((K, n))
+        innovation = rng.normal(0, sigma * np.sqrt(1 - correlation ** 2), (K, n))
+        noise[:, 0] = rng.normal(0, sigma, K)
+        for t in range(1, n):
+            noise[:, t] = correlation * noise[:, t - 1] + innovation[:, t]
+        return noise
+
+    clouds = np.clip(rng.normal(1, pv_sigma, (K, 1)), 0.1, 1.6)
+    S_scenarios = S * clouds * np.exp(correlated(pv_sigma / 2))
+    C_scenarios = C * np.exp(correlated(load_sigma))
+    return np.round(C_scenarios).astype(int), np.round(S_scenarios).astype(int)
+
+
+def reduce_scenarios(C_scenarios, S_scenarios, probabilities, n_keep):
+    """
+    Fast forward selection: pick n_keep scenarios one after another, each
+    time the one which lowers the probability weighted distance of all
+    scenarios to their nearest picked scenario most.
+
+    Returns:
+        tuple: (indices of the kept scenarios, their new probabilities)
+    """
+    vectors = np.hstack([C_scenarios, S_scenarios]).astype(float)
+    K = len(vectors)
+    if n_keep >= K:
+        return np.arange(K), np.asarray(probabilities, dtype=float)
+
+    squared = np.sum(vectors ** 2, axis=1)
+    distance = np.sqrt(np.maximum(squared[:, None] + squared[None, :] - 2 * vectors @ vectors.T, 0))
+    probabilities = np.asarray(probabilities, dtype=float)
+
+    nearest = np.full(K, np.inf)
+    selected = []
+    for _ in range(n_keep):
+        # distance of every scenario to its nearest pick, if candidate u was picked as well
+        candidate = np.minimum(nearest[:, None], distance)
+        score = probabilities @ candidate
+        score[selected] = np.inf
+        u = int(np.argmin(score))
+        selected.append(u)
+        nearest = candidate[:, u]
+
+    selected = np.array(selected)
+    owner = selected[np.argmin(distance[:, selected], axis=1)]
+    kept_probabilities = np.array([probabilities[owner == u].sum() for u in selected])
+    return selected, kept_probabilities
+
+
+def cvar(costs, probabilities, alpha=0.9):
+    """Conditional value at risk: expected cost of the worst 1 - alpha share of the scenarios."""
+    if not 0 <= alpha < 1:
+        raise ValueError("alpha muss in [0, 1) liegen")
+    order = np.argsort(costs)[::-1]
+    remaining = tail = 1 - alpha
+    total = 0.0
+    for k in order:
+        take = min(probabilities[k], remaining)
+        total += take * costs[k]
+        remaining -= take
+        if remaining <= 1e-12:
+            break
+    return total / tail
+
+
+def _init_worker(inputs, C_scenarios, S_scenarios, backend, soc_resolution):
+    global _inputs, _C_scenarios, _S_scenarios, _backend, _soc_resolution
+    _inputs = inputs
+    _C_scenarios = C_scenarios
+    _S_scenarios = S_scenarios
+    _backend = backend
+    _soc_resolution = soc_resolution
+    _planners.clear()
+
+
+def _solve_milp(backend, command, C, P, S):
+    """One scenario with a MILP backend, the planner is built once per worker and backend."""
+    from solver import SolarPlanner
+
+    inputs = _inputs
+    if backend not in _planners:
+        _planners[backend] = SolarPlanner(len(C), inputs["B_c_min"], inputs["B_c_max"], inputs["B_charge_max"],
+                                          inputs["B_discharge_max"], backend, num_threads=1)
+    planner = _planners[backend]
+    planner.fix_first_command(command)
+    return planner.solve(C=C, P=P, S=S, B_c_initial=inputs["B_c_initial"],
+                         P_solar=inputs["P_solar"], P_loaded=inputs["P_loaded"])
+
+
+def _solve_scenarios(command, indices):
+    """
+    Cost of every scenario in indices with the first period fixed to command.
+    Runs in a worker.
+
+    Returns:
+        list: (scenario index, objective), inf if the command is not possible
+    """
+    inputs = _inputs
+    interval = list(range(len(inputs["interval"])))
+    P = [inputs["P"][i] for i in inputs["interval"]]
+    costs = []
+    for k in indices:
+        C = _C_scenarios[k].tolist()
+        S = _S_scenarios[k].tolist()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if _backend == "DP":
+                result = solve_solar_dp(
+                    interval, C, P, inputs["P_solar"], S, inputs["B_c_initial"], inputs["B_c_min"],
+                    inputs["B_charge_max"], inputs["B_discharge_max"], inputs["B_c_max"], inputs["P_loaded"],
+                    inputs["battery_target_capacity"], inputs["mustLoadFirst"], inputs["min_battery_discharge"], 0,
+                    soc_resolution=_soc_resolution, first_command=command,
+                )
+            else:
+                result = _solve_milp(_backend, command, C, P, S)
+        costs.append((k, result.objective if result else np.inf))
+    return costs
+
+
+def solve_scenarios(inputs, C_scenarios, S_scenarios, probabilities=None, risk_weight=0.0, alpha=0.9,
+                    n_keep=None, backend="DP", workers=None, soc_resolution=10, commands=COMMANDS):
+    """
+    Choose the first command which is best over all scenarios.
+
+    Args:
+        inputs: solve_solar keyword arguments (see dataset.build_inputs), C and S are replaced by the scenarios
+        C_scenarios: Consumption per scenario and period (Wh), K x periods
+        S_scenarios: PV per scenario and period (Wh), K x periods
+        probabilities: Probability per scenario, None for equal probabilities
+        risk_weight: Weight of the CVaR term, 0 minimizes the expected cost only
+        alpha: CVaR level, 0.9 is the mean of the 10% most expensive scenarios
+        n_keep: Reduce the ensemble to this many scenarios first, None keeps all
+        backend: "DP" (default), "CBC" or "SCIP"
+        workers: Number of processes, None for one per core
+        soc_resolution: SOC step of the DP backend (Wh)
+        commands: First commands to compare
+
+    Returns:
+        dict: 'command' (best first command, None if no command is possible in
+              every scenario), 'candidates' (per command 'expected', 'cvar',
+              'score' and 'costs' per kept scenario), 'scenarios' (kept
+              indices), 'probabilities', 'solves' and 'seconds'
+    """
+    start = time.perf_counter()
+    C_scenarios = np.asarray(C_scenarios)
+    S_scenarios = np.asarray(S_scenarios)
+    K = len(C_scenarios)
+    if probabilities is None:
+        probabilities = np.full(K, 1 / K)
+
+    kept, kept_probabilities = np.arange(K), np.asarray(probabilities, dtype=float)
+    if n_keep and n_keep < K:
+        kept, kept_probabilities = reduce_scenarios(C_scenarios, S_scenarios, probabilities, n_keep)
+
+    C_kept = C_scenarios[kept]
+    S_kept = S_scenarios[kept]
+    workers = workers or os.cpu_count() or 1
+    chunk_size = max(1, len(kept) * len(commands) // (4 * workers))
+    chunks = [list(range(k, min(k + chunk_size, len(kept)))) for k in range(0, len(kept), chunk_size)]
+
+    costs = {command: np.full(len(kept), np.inf) for command in commands}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker,
+        initargs=(inputs, C_kept, S_kept, backend, soc_resolution),
+    ) as pool:
+        futures = {pool.submit(_solve_scenarios, command, chunk): command for command in commands for chunk in chunks}
+        for future in concurrent.futures.as_completed(futures):
+            for k, cost in future.result():
+                costs[futures[future]][k] = cost
+
+    candidates = {}
+    for command in commands:
+        values = costs[command]
+        if np.all(np.isfinite(values)):
+            expected = float(kept_probabilities @ values)
+            risk = cvar(values, kept_probabilities, alpha)
+            score = expected + risk_weight * risk
+        else:
+            # the command is not possible in at least one scenario, e.g. DIS with an empty battery
+            expected = risk = score = np.inf
+        candidates[command] = {"expected": expected, "cvar": risk, "score": score, "costs": values}
+
+    best = min(commands, key=lambda command: candidates[command]["score"])
+    return {
+        "command": best if np.isfinite(candidates[best]["score"]) else None,
+        "candidates": candidates,
+        "scenarios": kept,
+        "probabilities": kept_probabilities,
+        "solves": len(kept) * len(commands),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def runtime_report(inputs, sizes=(10, 20, 50, 100, 200), n_keep=None, budget_s=60.0, seed=0, **kwargs):
+    """
+    Runtime of solve_scenarios for growing ensembles.
+
+    Args:
+        inputs: solve_solar keyword arguments, the forecast the ensembles are sampled around
+        sizes: Ensemble sizes K
+        n_keep: Scenario reduction, see solve_scenarios
+        budget_s: Time available per re-plan
+        kwargs: Passed to solve_scenarios
+
+    Returns:
+        list: One dict per K with 'K', 'kept', 'solves', 'seconds', 'ms_per_solve',
+              'command', 'within_budget' and 'max_scenarios' (kept scenarios
+              which would still fit into the budget at this speed)
+    """
+    C = [inputs["C"][i] for i in inputs["interval"]]
+    S = [inputs["S"][i] for i in inputs["interval"]]
+    rows = []
+    for K in sizes:
+        C_scenarios, S_scenarios = forecast_ensemble(C, S, K, seed)
+        plan = solve_scenarios(inputs, C_scenarios, S_scenarios, n_keep=n_keep, **kwargs)
+        kept = len(plan["scenarios"])
+        rows.append({
+            "K": K,
+            "kept": kept,
+            "solves": plan["solves"],
+            "seconds": plan["seconds"],
+            "ms_per_solve": plan["seconds"] / plan["solves"] * 1000,
+            "command": plan["command"],
+            "within_budget": plan["seconds"] <= budget_s,
+            "max_scenarios": int(budget_s / (plan["seconds"] / kept)),
+            "candidates": {command: c["score"] for command, c in plan["candidates"].items()},
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    from dataset import load_day
+
+    parser = argparse.ArgumentParser(description="Scenario planning of the first command over forecast ensembles")
+    parser.add_argument("folder", nargs="?", default="19.01")
+    parser.add_argument("--scenarios", nargs="+", type=int, default=[10, 20, 50, 100, 200])
+    parser.add_argument("--keep", type=int, default=None, help="reduce to this many scenarios")
+    parser.add_argument("--risk", type=float, default=0.0, help="weight of the CVaR term")
+    parser.add_argument("--alpha", type=float, default=0.9)
+    parser.add_argument("--backend", default="DP")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--budget", type=float, default=60, help="seconds available per re-plan")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    inputs = load_day(args.folder)["inputs"]
+    rows = runtime_report(inputs, args.scenarios, args.keep, args.budget, args.seed, risk_weight=args.risk,
+                          alpha=args.alpha, backend=args.backend, workers=args.workers)
+
+    print(f"{'K':>6s}{'Behalten':>10s}{'Solves':>8s}{'Sek':>9s}{'ms/Solve':>10s}  {'Befehl':8s}{'Budget':>8s}{'K max':>8s}")
+    for row in rows:
+        print(f"{row['K']:6d}{row['kept']:10d}{row['solves']:8d}{row['seconds']:9.2f}{row['ms_per_solve']:10.1f}  "
+              f"{row['command'] or '-':8s}{'ja' if row['within_budget'] else 'nein':>8s}{row['max_scenarios']:8d}")
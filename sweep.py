@@ -0,0 +1,365 @@
+"""
+Parameter sweep over battery and tariff settings for many day folders.
+
+    python sweep.py [root] --grid battery_max_capacity=14400,28800,43200 price_using_battery=2000,3091,4000
+
+Every combination of the grid values (overrides of dataset.DEFAULT_PARAMETERS)
+is solved for every day folder. The points are ordered so that neighbours
+differ in one parameter only, and all points of one day with the same battery
+spec (capacity, minimum SOC, charge and discharge power) are solved one after
+another in the same worker: the MILP model is built once per spec, only the
+data changes, and the previous plan is passed as warm start hint (used by
+SCIP, CBC ignores it). The groups run in parallel. So the default backend is
+SCIP; with --backend DP every point is solved from scratch (fast, but
+without model reuse and warm starts).
+
+Results are stored per (day, parameters, backend) in a JSON-lines file. The
+key contains mtime and size of the log files, so a repeated sweep only solves
+new points and changed days. The output is the savings surface over two of
+the parameters, compared with the existing controller (bezugneu / socneu) and
+with no battery at all.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import time
+
+from batch import day_costs
+from dataset import CACHE_DIR, DAY_FILES, DEFAULT_PARAMETERS, file_signature, find_day_folders, load_day
+
+# parameters which define the MILP model, the others only change its data
+BATTERY_PARAMETERS = (
+    "battery_max_capacity",
+    "battery_soc_minimum_allowed",
+    "battery_charge_power",
+    "battery_discharge_power",
+)
+
+SWEEP_VERSION = 1
+
+RESULT_FIELDS = [
+    "status", "seconds", "cost_without", "cost_existing", "cost_optimized",
+    "savings", "savings_vs_existing", "error",
+]
+
+# per worker process: planners per (horizon, battery spec, backend)
+_planners = {}
+
+
+def parse_grid(specs):
+    """
+    Parse "name=v1,v2,..." strings into a grid.
+
+    Returns:
+        dict: Parameter name -> list of values
+    """
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in DEFAULT_PARAMETERS:
+            raise ValueError(f"Unbekannter Parameter: {name}")
+        grid[name] = [int(v) if float(v).is_integer() else float(v) for v in values.split(",") if v]
+        if not grid[name]:
+            raise ValueError(f"Keine Werte für {name}")
+    return grid
+
+
+def parameter_points(grid):
+    """
+    All combinations of the grid, battery parameters varying slowest, in
+    snake order: two consecutive points differ in exactly one parameter.
+
+    Returns:
+        list: One parameter dict per point
+    """
+    names = sorted(grid, key=lambda name: (name not in BATTERY_PARAMETERS, list(grid).index(name)))
+
+    def snake(depth):
+        if depth == len(names):
+            return [{}]
+        rest = snake(depth + 1)
+        points = []
+        for n, value in enumerate(grid[names[depth]]):
+            for point in (rest if n % 2 == 0 else rest[::-1]):
+                points.append({names[depth]: value, **point})
+        return points
+
+    return snake(0)
+
+
+def battery_spec(parameters):
+    """The battery parameters of a point, with defaults filled in."""
+    params = dict(DEFAULT_PARAMETERS)
+    params.update(parameters)
+    return tuple(params[name] for name in BATTERY_PARAMETERS)
+
+
+def day_signature(folderName):
+    """Hash over mtime and size of the log files of a day folder."""
+    signatures = [file_signature(os.path.join(folderName, name)) for name in DAY_FILES]
+    return hashlib.sha1(json.dumps([os.path.abspath(folderName), signatures]).encode()).hexdigest()
+
+
+def point_key(signature, parameters, backend, soc_resolution):
+    """Key of one result in the SweepCache."""
+    text = json.dumps([SWEEP_VERSION, signature, sorted(parameters.items()), backend,
+                       soc_resolution if backend == "DP" else None])
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class SweepCache:
+    """
+    Results of earlier sweeps, one JSON object per line. New results are
+    appended as soon as they are finished, so an interrupted sweep keeps them.
+
+    Args:
+        filename: JSON-lines file, None for an in-memory cache
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.rows = {}
+        self.hits = 0
+        if filename and os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # cut off line of an interrupted run
+                        continue
+                    self.rows[entry["key"]] = entry["row"]
+
+    def get(self, key):
+        row = self.rows.get(key)
+        if row is not None:
+            self.hits += 1
+        return row
+
+    def add(self, key, row):
+        self.rows[key] = row
+        if self.filename:
+            os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+            with open(self.filename, "a") as f:
+                f.write(json.dumps({"key": key, "row": row}) + "\n")
+
+
+def _planner(inputs, backend):
+    """Planner for the battery spec of the inputs, built once per worker and spec."""
+    from solver import SolarPlanner
+
+    key = (len(inputs["interval"]), inputs["B_c_min"], inputs["B_c_max"],
+           inputs["B_charge_max"], inputs["B_discharge_max"], backend)
+    if key not in _planners:
+        _planners[key] = SolarPlanner(len(inputs["interval"]), inputs["B_c_min"], inputs["B_c_max"],
+                                      inputs["B_charge_max"], inputs["B_discharge_max"], backend, num_threads=1)
+    return _planners[key]
+
+
+def solve_points(folderName, points, backend="SCIP", soc_resolution=10, cache=False):
+    """
+    Solve one day for consecutive parameter points. Runs in a worker and never
+    raises, errors are returned in the rows.
+
+    Returns:
+        list: One row (keys of RESULT_FIELDS) per point
+    """
+    from solver import solve_solar
+
+    rows = []
+    hint = None
+    for parameters in points:
+        row = {name: None for name in RESULT_FIELDS}
+        start = time.perf_counter()
+        try:
+            day = load_day(folderName, parameters=parameters, cache=cache)
+            inputs = day["inputs"]
+            with contextlib.redirect_stdout(io.StringIO()):
+                if backend == "DP":
+                    result = solve_solar(**inputs, backend="DP", soc_resolution=soc_resolution)
+                else:
+                    planner = _planner(inputs, backend)
+                    # the planner is shared by all groups of the worker, a hint of another day is cleared
+                    planner.set_hint(hint[1] if hint is not None and hint[0] is planner else {})
+                    interval = inputs["interval"]
+                    result = planner.solve(
+                        C=[inputs["C"][i] for i in interval],
+                        P=[inputs["P"][i] for i in interval],
+                        S=[inputs["S"][i] for i in interval],
+                        B_c_initial=inputs["B_c_initial"],
+                        P_solar=inputs["P_solar"],
+                        P_loaded=inputs["P_loaded"],
+                    )
+                    hint = (planner, planner.solution_values()) if result else None
+
+            if not result:
+                row["status"] = "infeasible"
+            else:
+                row["status"] = "ok"
+                cost_without, cost_existing, cost_optimized = day_costs(day, result.energy_bought.tolist())
+                row["cost_without"] = cost_without
+                row["cost_existing"] = cost_existing
+                row["cost_optimized"] = cost_optimized
+                row["savings"] = cost_without - cost_optimized
+                if cost_existing is not None:
+                    row["savings_vs_existing"] = cost_existing - cost_optimized
+        except Exception as e:
+            row["status"] = "error"
+            row["error"] = f"{type(e).__name__}: {e}"
+        row["seconds"] = time.perf_counter() - start
+        rows.append(row)
+    return rows
+
+
+def run_sweep(folders, grid, backend="SCIP", workers=None, soc_resolution=10, cache_file=None, cache=False):
+    """
+    Solve every point of the grid for every folder, points already in the
+    cache file are not solved again.
+
+    Args:
+        folders: List of day folders
+        grid: Parameter name -> list of values, see parse_grid()
+        backend: "SCIP" (default, reuses the model and warm starts), "CBC" (reuses the model) or "DP"
+        workers: Number of processes, None for one per core
+        soc_resolution: SOC bucket size of the DP backend (Wh)
+        cache_file: JSON-lines file with the results, None to solve everything
+        cache: Read the days with the binary cache of dataset.load_day_cached()
+
+    Returns:
+        dict: 'rows' (folder, parameters and the RESULT_FIELDS per day and point),
+              'points', 'solved', 'cached' and 'seconds'
+    """
+    start = time.perf_counter()
+    points = parameter_points(grid)
+    results = SweepCache(cache_file)
+
+    rows = []
+    tasks = []
+    for folderName in folders:
+        signature = day_signature(folderName)
+        missing = []
+        for parameters in points:
+            key = point_key(signature, parameters, backend, soc_resolution)
+            row = results.get(key)
+            if row is None:
+                missing.append((key, parameters))
+            else:
+                rows.append({"folder": folderName, **parameters, **row})
+        # consecutive points with the same battery spec share the model
+        for _, group in itertools.groupby(missing, key=lambda item: battery_spec(item[1])):
+            tasks.append((folderName, list(group)))
+
+    solved = 0
+    if tasks:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(solve_points, folderName, [p for _, p in group], backend, soc_resolution, cache):
+                    (folderName, group)
+                for folderName, group in tasks
+            }
+            for future in concurrent.futures.as_completed(futures):
+                folderName, group = futures[future]
+                for (key, parameters), row in zip(group, future.result()):
+                    # only finished days are cached, errors are tried again next time
+                    if row["status"] != "error":
+                        results.add(key, row)
+                    rows.append({"folder": folderName, **parameters, **row})
+                    solved += 1
+
+    return {
+        "rows": rows,
+        "points": points,
+        "solved": solved,
+        "cached": results.hits,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def savings_surface(rows, x, y=None, value="savings_vs_existing"):
+    """
+    Sum of value over all days per (x, y) grid point. Points where one of the
+    days has no plan (or no existing controller data) are None.
+
+    Args:
+        rows: Rows of run_sweep()
+        x: Parameter along the columns
+        y: Parameter along the rows, None for a single row
+        value: "savings_vs_existing", "savings" or "cost_optimized"
+
+    Returns:
+        tuple: (x values, y values, matrix as list of rows)
+    """
+    xs = sorted({row[x] for row in rows})
+    ys = sorted({row[y] for row in rows}) if y else [None]
+    totals = {}
+    for row in rows:
+        cell = (row[x], row[y] if y else None)
+        if row[value] is None or cell in totals and totals[cell] is None:
+            totals[cell] = None
+        else:
+            totals[cell] = totals.get(cell, 0.0) + row[value]
+    return xs, ys, [[totals.get((vx, vy)) for vx in xs] for vy in ys]
+
+
+def format_surface(xs, ys, matrix, x, y=None):
+    lines = [f"{(y or '') + ' / ' + x:>36s}" + "".join(f"{v:>12}" for v in xs)]
+    for vy, values in zip(ys, matrix):
+        lines.append(f"{'' if vy is None else vy!s:>36s}"
+                     + "".join(f"{'-' if v is None else f'{v:.1f}':>12s}" for v in values))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parameter sweep over all day folders")
+    parser.add_argument("root", nargs="?", default=".")
+    parser.add_argument("--grid", nargs="+", required=True, help="name=v1,v2,... per parameter")
+    parser.add_argument("--backend", default="SCIP", help="SCIP (model reuse and warm starts), CBC or DP")
+    parser.add_argument("--workers", type=int, default=None, help="processes, default one per core")
+    parser.add_argument("--soc-resolution", type=int, default=10, help="SOC bucket size of the DP backend (Wh)")
+    parser.add_argument("--results", default=os.path.join(CACHE_DIR, "sweep.jsonl"),
+                        help="JSON-lines file with the results of earlier sweeps, '' to disable")
+    parser.add_argument("--cache", action="store_true", help="parse the log files once into a binary cache")
+    parser.add_argument("--x", help="parameter along the columns of the surface, default the first of --grid")
+    parser.add_argument("--y", help="parameter along the rows of the surface, default the second of --grid")
+    parser.add_argument("--value", default="savings_vs_existing",
+                        choices=["savings_vs_existing", "savings", "cost_optimized"])
+    parser.add_argument("--output", help="CSV file with one row per day and point")
+    args = parser.parse_args()
+
+    grid = parse_grid(args.grid)
+    names = list(grid)
+    x = args.x or names[0]
+    y = args.y or (names[1] if len(names) > 1 else None)
+
+    folders = find_day_folders(args.root)
+    sweep = run_sweep(folders, grid, backend=args.backend, workers=args.workers,
+                      soc_resolution=args.soc_resolution, cache_file=args.results or None, cache=args.cache)
+    rows = sweep["rows"]
+
+    print(f"{len(folders)} Ordner, {len(sweep['points'])} Punkte, {sweep['solved']} gelöst, "
+          f"{sweep['cached']} aus dem Cache, {sweep['seconds']:.1f} s")
+    failed = [row for row in rows if row["status"] != "ok"]
+    for row in failed:
+        print(f"{row['folder']}: {row['status']} {row['error'] or ''}")
+
+    others = [name for name in names if name not in (x, y)]
+    for values in itertools.product(*(grid[name] for name in others)):
+        fixed = dict(zip(others, values))
+        selected = [row for row in rows if all(row[name] == v for name, v in fixed.items())]
+        print()
+        if fixed:
+            print(", ".join(f"{name}={v}" for name, v in fixed.items()))
+        print(format_surface(*savings_surface(selected, x, y, args.value), x, y))
+
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["folder"] + names + RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,45 @@
+"""
+Price coordination and recovery of the fleet optimizer on small synthetic fleets.
+
+    python -m pytest -q test_fleet.py
+"""
+
+import numpy as np
+import pytest
+
+from fleet import solve_fleet, synthetic_sites
+
+
+@pytest.fixture(scope="module")
+def fleet():
+    sites = synthetic_sites(3, seed=0, horizon=24)
+    free = solve_fleet(sites, np.inf, workers=1, max_iterations=1)
+    return sites, free["imports"].max()
+
+
+def test_prices_converge(fleet):
+    sites, peak = fleet
+    import_max = round(0.95 * peak)
+    result = solve_fleet(sites, import_max, workers=1)
+    assert result["status"] == "converged"
+    # the first plans exceed the limit, the prices have to move them
+    assert result["trace"][0]["max_violation"] > 0
+    assert len(result["trace"]) > 1
+    assert result["max_violation"] == 0
+    assert result["imports"].max() <= import_max
+    assert result["import_price"].max() > 0
+
+
+def test_no_recovery_returns_last_plans(fleet):
+    sites, peak = fleet
+    result = solve_fleet(sites, round(0.7 * peak), workers=1, max_iterations=5, recovery_rounds=0)
+    assert result["status"] == "violated"
+    assert result["max_violation"] > 0
+    assert all(site_result is not None for site_result in result["results"])
+    assert len(result["trace"]) == 5
+
+
+def test_negative_recovery_rounds(fleet):
+    sites, _ = fleet
+    with pytest.raises(ValueError):
+        solve_fleet(sites, 1000, workers=1, recovery_rounds=-1)
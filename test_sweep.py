@@ -0,0 +1,43 @@
+"""
+Model reuse and warm starts of the parameter sweep.
+
+    python -m pytest -q test_sweep.py
+"""
+
+import contextlib
+import io
+import os
+
+import pytest
+
+pytest.importorskip("ortools")
+
+import sweep
+from dataset import load_day
+from solver import SolarPlanner, solve_solar
+
+FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "19.01")
+
+
+def test_points_share_planner_and_hint(monkeypatch):
+    hints = []
+    monkeypatch.setattr(SolarPlanner, "set_hint", lambda self, values: hints.append((self, values)))
+    monkeypatch.setattr(sweep, "_planners", {})
+
+    # same battery spec, only the tariff changes
+    points = [{"price_using_battery": value} for value in (2000, 3091, 4000)]
+    rows = sweep.solve_points(FOLDER, points)
+
+    assert [row["status"] for row in rows] == ["ok", "ok", "ok"]
+    assert len(sweep._planners) == 1
+    planner = next(iter(sweep._planners.values()))
+    assert all(owner is planner for owner, _ in hints)
+    # no hint for the first point, the previous plan for the others
+    assert hints[0][1] == {} and all(values for _, values in hints[1:])
+
+    # the reused, warm started model gives the plan of a fresh solve
+    day = load_day(FOLDER, parameters=points[-1])
+    with contextlib.redirect_stdout(io.StringIO()):
+        fresh = solve_solar(**day["inputs"], backend="SCIP")
+    _, _, cost_optimized = sweep.day_costs(day, fresh.energy_bought.tolist())
+    assert rows[-1]["cost_optimized"] == pytest.approx(cost_optimized)
@@ -0,0 +1,48 @@
+"""
+Minimum dwell of the plans with switching, also when the time limit stops the MILP.
+
+    python -m pytest -q test_switching.py
+"""
+
+import contextlib
+import io
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("ortools")
+
+from backtest import plan_codes
+from batteryCommands.custom import command_runs
+from dataset import load_day
+from result import SolarResult
+from solver import SolarPlanner, anytime_result, solve_solar
+
+FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "19.01")
+MIN_DWELL = 4
+
+
+def shortest_run(result):
+    """Shortest command run of a plan, without the last one which the horizon may cut."""
+    starts, ends, _ = command_runs(plan_codes(result))
+    return int(np.min(ends[:-1] - starts[:-1])) if len(starts) > 1 else len(plan_codes(result))
+
+
+def test_min_dwell_with_time_limit():
+    inputs = load_day(FOLDER)["inputs"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = solve_solar(**inputs, switch_penalty=5, min_dwell=MIN_DWELL, time_limit_ms=300)
+    assert result
+    assert shortest_run(result) >= MIN_DWELL
+
+
+def test_fallback_keeps_min_dwell():
+    # no incumbent at all: the fallback alone has to keep the dwell
+    inputs = load_day(FOLDER)["inputs"]
+    planner = SolarPlanner(len(inputs["interval"]), inputs["B_c_min"], inputs["B_c_max"], inputs["B_charge_max"],
+                           inputs["B_discharge_max"], switch_penalty=5, min_dwell=MIN_DWELL)
+    result = anytime_result(planner, SolarResult.empty("NOT_SOLVED"), inputs["interval"], inputs["C"], inputs["P"],
+                            inputs["P_solar"], inputs["S"], inputs["B_c_initial"], inputs["P_loaded"])
+    assert result.status == "HEURISTIC"
+    assert shortest_run(result) >= MIN_DWELL
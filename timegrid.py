@@ -0,0 +1,173 @@
+"""
+Time grids with slots of different length.
+
+The log files have one value per 15 minutes (BASE_MINUTES). A grid is the
+list of slot durations in minutes, e.g. 5 minute slots for the next three
+hours and hourly slots for the rest of the day:
+
+    durations = variable_grid(fine_minutes=5, fine_span=180, coarse_minutes=60, total=1440)
+    day = dataset.load_day("19.01", durations=durations)
+    result = solve_solar(**day["inputs"], durations=durations)
+
+Energies (consumption, PV) are resampled so the energy of every interval is
+kept, prices are averaged over the slot. solve_solar scales the charge and
+discharge power per period (given per 15 minutes) with the slot duration.
+"""
+
+import numpy as np
+
+# duration of one value in the log files
+BASE_MINUTES = 15
+
+
+def uniform_grid(periods, minutes=BASE_MINUTES):
+    """Grid of periods slots of the same duration."""
+    return [minutes] * periods
+
+
+def variable_grid(fine_minutes=5, fine_span=180, coarse_minutes=60, total=1440, base_minutes=BASE_MINUTES):
+    """
+    Fine slots at the start, coarse slots for the rest of the horizon.
+
+    Args:
+        fine_minutes: Duration of the fine slots
+        fine_span: Minutes covered by fine slots
+        coarse_minutes: Duration of the coarse slots
+        total: Length of the horizon in minutes
+        base_minutes: Resolution of the data, the coarse part starts on a multiple of it
+
+    Returns:
+        list: Slot durations in minutes, their sum is total
+    """
+    if fine_minutes <= 0 or coarse_minutes <= 0:
+        raise ValueError("Slotdauer muss positiv sein")
+    fine_span = min(fine_span, total)
+    # the coarse slots start on the data grid, so they average whole values
+    fine_span = -(-fine_span // base_minutes) * base_minutes if fine_span < total else total
+    durations = []
+    while sum(durations) + fine_minutes <= fine_span:
+        durations.append(fine_minutes)
+    if sum(durations) < fine_span:
+        durations.append(fine_span - sum(durations))
+    while sum(durations) < total:
+        durations.append(min(coarse_minutes, total - sum(durations)))
+    return durations
+
+
+def parse_grid(spec, total, base_minutes=BASE_MINUTES):
+    """
+    Grid of a command line spec: "15" for a uniform grid, "5:180,60" for 5
+    minute slots over 180 minutes and 60 minute slots after that. If the
+    slots do not divide total, the last slot is shorter, like in variable_grid().
+    """
+    fine, _, coarse = spec.partition(",")
+    fine_minutes, _, span = fine.partition(":")
+    if not coarse:
+        minutes = int(fine_minutes)
+        if minutes <= 0:
+            raise ValueError("Slotdauer muss positiv sein")
+        durations = uniform_grid(total // minutes, minutes)
+        if total % minutes:
+            durations.append(total % minutes)
+        return durations
+    return variable_grid(int(fine_minutes), int(span or 0), int(coarse), total, base_minutes)
+
+
+def slot_starts(durations):
+    """Start of every slot in minutes after the start of the horizon."""
+    return np.concatenate(([0], np.cumsum(durations)[:-1])).astype(int)
+
+
+def scale(durations, base_minutes=BASE_MINUTES):
+    """Duration of every slot relative to a base period, for scaling powers per period."""
+    if durations is None:
+        return None
+    return np.asarray(durations, dtype=float) / base_minutes
+
+
+def _boundaries(durations):
+    return np.concatenate(([0], np.cumsum(durations))).astype(float)
+
+
+def resample_energy(values, from_durations, to_durations):
+    """
+    Energy per slot on another grid. Within a slot the power is constant,
+    so a slot split in three gets a third of the energy each, and merged
+    slots get the sum.
+
+    Args:
+        values: Energy per slot of the source grid
+        from_durations: Slot durations of the source grid (minutes)
+        to_durations: Slot durations of the target grid, the total must not be longer
+
+    Returns:
+        np.ndarray: Energy per slot of the target grid
+    """
+    source = _boundaries(from_durations)
+    target = _boundaries(to_durations)
+    if target[-1] > source[-1] + 1e-9:
+        raise ValueError(f"Zielraster ({target[-1]:.0f} min) ist länger als die Daten ({source[-1]:.0f} min)")
+    cumulative = np.concatenate(([0.0], np.cumsum(np.asarray(values, dtype=float))))
+    # the cumulative energy is linear within every source slot
+    return np.diff(np.interp(target, source, cumulative))
+
+
+def resample_mean(values, from_durations, to_durations):
+    """Time weighted mean per slot of the target grid, e.g. for prices."""
+    energy = resample_energy(np.asarray(values, dtype=float) * np.asarray(from_durations, dtype=float),
+                             from_durations, to_durations)
+    return energy / np.asarray(to_durations, dtype=float)
+
+
+def resample_state(values, from_durations, to_durations):
+    """
+    Value at the end of every target slot of a state given at the end of the
+    source slots (e.g. the SOC), linear in between.
+    """
+    source = _boundaries(from_durations)
+    target = _boundaries(to_durations)
+    return np.interp(target[1:], source[1:], np.asarray(values, dtype=float))
+
+
+def resample_hold(values, from_durations, to_durations):
+    """Value of the source slot in which every target slot starts, e.g. for flags and commands."""
+    source = _boundaries(from_durations)
+    starts = _boundaries(to_durations)[:-1]
+    index = np.searchsorted(source, starts, side="right") - 1
+    return np.asarray(values)[np.clip(index, 0, len(values) - 1)]
+
+
+def to_base(result, durations, base_minutes=BASE_MINUTES):
+    """
+    Plan of a variable grid on the uniform base grid, e.g. to compare it with
+    the log files or to plot it. Energies are spread evenly over the slot,
+    the SOC is interpolated and the flags are held.
+
+    Returns:
+        SolarResult: One period per base_minutes
+    """
+    from result import SolarResult
+
+    total = sum(durations)
+    base = uniform_grid(int(total // base_minutes), base_minutes)
+
+    def energy(values):
+        return None if values is None else resample_energy(values, durations, base)
+
+    return SolarResult(
+        soc=resample_state(result.soc, durations, base),
+        energy_bought=energy(result.energy_bought),
+        battery_discharge=energy(result.battery_discharge),
+        battery_charge=energy(result.battery_charge),
+        solar_energy=energy(result.solar_energy),
+        is_charging=resample_hold(result.is_charging, durations, base),
+        is_discharging=resample_hold(result.is_discharging, durations, base),
+        outside_to_battery=energy(result.outside_to_battery),
+        solar_to_battery=energy(result.solar_to_battery),
+        price=None if result.price is None else resample_hold(result.price, durations, base),
+        consumption=energy(result.consumption),
+        energy_sold=energy(result.energy_sold),
+        status=result.status,
+        objective=result.objective,
+        gap=result.gap,
+    )